@@ -182,8 +182,16 @@ class Agent:
                     "SYSTEM: ", Fore.YELLOW, "Unable to execute command"
                 )
 
-    def single_step(self, command_name: str, arguments: str):
-        # Send message to AI, get response
+    def execute_step(self, command_name: str, arguments: str):
+        """Execute the command chosen in the previous step and record its result
+
+        Args:
+            command_name (str): The command to execute
+            arguments (str): The arguments for the command
+
+        Returns:
+            tuple: The command result, the text to add to memory and the log so far
+        """
         self.user_input = (
             self.arguments if command_name == "human_feedback" else "GENERATE NEXT COMMAND JSON"
         )
@@ -216,8 +224,6 @@ class Agent:
             f"\nHuman Feedback: {self.user_input} "
         )
 
-        self.memory.add(memory_to_add)
-
         # Check if there's a result from the command append it to the message
         # history
         if result is not None:
@@ -230,7 +236,20 @@ class Agent:
             godmode_log += logger.typewriter_log(
                 "SYSTEM: ", Fore.YELLOW, "Unable to execute command"
             )
-        
+
+        return result, memory_to_add, godmode_log
+
+    def think(self, on_delta=None):
+        """Ask the AI for the next command and parse its reply
+
+        Args:
+            on_delta (Callable, optional): Called with every piece of the reply
+                as it is streamed from the model
+
+        Returns:
+            tuple: The parsed thoughts and the log of this phase
+        """
+        godmode_log = ""
         self.assistant_reply = chat_with_ai(
             self.system_prompt,
             self.triggering_prompt,
@@ -238,6 +257,7 @@ class Agent:
             self.memory,
             self.cfg.fast_token_limit,
             self.cfg,
+            on_delta=on_delta,
         )
 
         self.assistant_reply_json = fix_json_using_multiple_techniques(self.assistant_reply, self.cfg)
@@ -256,13 +276,27 @@ class Agent:
                 # command_name, arguments = assistant_reply_json_valid["command"]["name"], assistant_reply_json_valid["command"]["args"]
             except Exception as e:
                 godmode_log += "Error: \n" + str(e)
-        
-        # upload log
+
+        return thoughts, godmode_log
+
+    def build_log(self, memory_to_add: str, godmode_log: str) -> str:
+        """Build the text of the step log that is uploaded for this agent"""
         ai_info = f"You are {self.ai_name}, {self.ai_role}\nGOALS:\n\n"
         for i, goal in enumerate(self.ai_goals):
             ai_info += f"{i+1}. {goal}\n"
 
-        upload_log(ai_info + "\n\n" + memory_to_add + "\n\n" + godmode_log, self.agent_id)
+        return ai_info + "\n\n" + memory_to_add + "\n\n" + godmode_log
+
+    def single_step(self, command_name: str, arguments: str):
+        result, memory_to_add, godmode_log = self.execute_step(command_name, arguments)
+
+        self.memory.add(memory_to_add)
+
+        thoughts, log = self.think()
+        godmode_log += log
+
+        # upload log
+        upload_log(self.build_log(memory_to_add, godmode_log), self.agent_id)
 
         return (
             self.command_name,
@@ -1,9 +1,15 @@
+import asyncio
+import contextvars
 import datetime
+import functools
 from functools import wraps
 import json
 import logging
+import queue
+import threading
 import time
 import traceback
+from typing import Any, Callable, Dict, List, Optional
 from uuid import uuid4
 from autogpt.config.ai_config import AIConfig
 from autogpt.memory import get_memory
@@ -11,7 +17,6 @@ import autogpt.chat as chat
 from autogpt.config import Config
 import os
 from openai.error import OpenAIError
-import firebase_admin
 from firebase_admin import auth as firebase_auth
 from autogpt.llm_utils import create_chat_completion
 from autogpt.api_utils import (
@@ -20,29 +25,253 @@ from autogpt.api_utils import (
     WARNING,
     generate_task_name,
     get_file_urls,
+    log_shipper,
     print_log,
+    upload_log,
 )
 import logging
 from autogpt.agent.agent import Agent
+from autogpt.auth_cache import (
+    CertificateWarmer,
+    VerifiedTokenCache,
+    fetch_firebase_certs,
+)
+from autogpt.cloud_clients import (
+    datastore_client,
+    ensure_firebase_app,
+    firestore_client,
+)
 
 from autogpt.config import Config
+from autogpt.embedding_cache import embedding_cache
+from autogpt.llm_backend import backend as llm_backend
+from autogpt.llm_cache import build_redis_client, completion_cache
+from autogpt.llm_hedging import hedger
+from autogpt.llm_transport import session_pool
 from autogpt.logs import logger
 from autogpt.memory import get_memory
+from autogpt.metrics import call_site, register_stats, render
+from autogpt.model_router import model_router
 from autogpt.memory.pinecone import PineconeMemory
+from autogpt.session_index import SessionIndex
+from autogpt.singleflight import singleflight
+from autogpt.session_store import (
+    SESSION_MAX_MESSAGES,
+    HistoryVersionMismatch,
+    Session,
+    SessionStore,
+)
+from autogpt.step_pipeline import (
+    PhaseTimer,
+    StepSlots,
+    phase_timeout,
+    run_with_deadline,
+    settle,
+)
+from autogpt.task_log import (
+    PUT_BATCH_SIZE,
+    TASK_PAGE_SIZE,
+    embedded_task_entities,
+    list_tasks,
+    migrate_embedded_tasks,
+    set_task_name,
+    task_entities,
+)
+from autogpt.rate_limiter import rate_limiter
+from autogpt.task_naming import TaskNamer, placeholder_task_name
+from autogpt.usage import (
+    UsageQuota,
+    add_usage,
+    calibration,
+    current_ledger,
+    track_usage,
+)
 from google.cloud import datastore
 
-from google.cloud import firestore
 
-fireclient = firestore.Client()
-
-client = datastore.Client()
 
 global_config = Config()
 
 START = "###start###"
+# seconds a Datastore read of a step may take, cut to the step deadline
+DATASTORE_TIMEOUT = float(os.getenv("DATASTORE_TIMEOUT", 30))
+# seconds to connect to and wait on the Redis of the sessions and quotas
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 2))
+
+task_namer = TaskNamer(generate_task_name)
+
+
+def entity_session(entity) -> Optional[Session]:
+    """Return the message history stored on an Agent entity"""
+    if entity is None or entity.get("history_version") is None:
+        return None
+    return Session(
+        entity["history_version"], json.loads(entity.get("full_message_history", "[]"))
+    )
+
+
+def load_session(agent_id: str) -> Optional[Session]:
+    """Load the message history of an agent from its Datastore entity"""
+    client = datastore_client()
+    return entity_session(client.get(client.key("Agent", agent_id)))
+
+
+# the sessions and quotas are read on every step, so a stalled Redis must not
+# outlast the step deadline
+redis_client = build_redis_client(REDIS_TIMEOUT)
+
+session_store = SessionStore(
+    redis_client=redis_client,
+    loader=load_session,
+)
+
+
+def legacy_sessions(user_id: str) -> List[Dict[str, Any]]:
+    """Query all the sessions of a user, to backfill their session index"""
+    docs = (
+        firestore_client()
+        .collection("User")
+        .document(user_id)
+        .collection("Agents")
+        .where("ai_name", "!=", "deleted")
+        .select(["ai_name", "ai_role", "created"])
+        .stream()
+    )
+    return [{**doc.to_dict(), "agent_id": doc.id} for doc in docs]
+
+
+session_index = SessionIndex(datastore_client, legacy_sessions)
+
+# the tokens users spend on the server's API key per day
+usage_quota = UsageQuota(redis_client)
+
+
+def persist_step(
+    key,
+    prev,
+    agent: Agent,
+    command_name: str,
+    arguments,
+    thoughts: dict,
+    result,
+    task_name,
+    task_name_pending: bool,
+    history_version: int,
+    usage: dict,
+) -> int:
+    """Write the state of the agent after a step to Datastore
+
+    Returns:
+        int: The index of the task that was added for this step
+    """
+    try:
+        entity = datastore.Entity(
+            key=key,
+            exclude_from_indexes=(
+                "full_message_history",
+                "agents",
+                "assistant_reply",
+                "thoughts",
+                "arguments",
+                "command_name",
+                "ai_role",
+                "ai_goals",
+                "usage",
+            ),
+        )
+
+        client = datastore_client()
+        prev = prev or {}
+        task_count = prev.get("task_count")
+        migrated = []
+        if task_count is None:
+            # agents stored before the task log keep their tasks on the entity
+            embedded = prev.get("tasks", [])
+            migrated = embedded_task_entities(client, agent.agent_id, embedded)
+            task_count = len(migrated)
+            if task_count + 3 > PUT_BATCH_SIZE:
+                # too many for the commit of the step; the keys are fixed, so a
+                # step that loses the race below rewrites the same tasks
+                migrate_embedded_tasks(client, agent.agent_id, embedded)
+                migrated = []
+
+        task_index = task_count
+        entity.update(
+            {
+                "ai_name": agent.ai_name,
+                "ai_role": agent.ai_role,
+                "ai_goals": agent.ai_goals,
+                "agent_id": agent.agent_id,
+                "full_message_history": json.dumps(agent.full_message_history),
+                "history_version": history_version,
+                "command_name": agent.command_name,
+                "arguments": json.dumps(agent.arguments),
+                "assistant_reply": json.dumps(agent.assistant_reply),
+                "thoughts": json.dumps(thoughts),
+                "agents": agent.agent_manager.agents,
+                "task_count": task_index + 1,
+                "usage": json.dumps(usage),
+            }
+        )
+        # of two steps started from the same version, only the first is stored,
+        # along with its task so that task_count always matches the log
+        with client.transaction():
+            stored = client.get(key, timeout=phase_timeout(DATASTORE_TIMEOUT))
+            if ((stored or {}).get("history_version") or 0) != history_version - 1:
+                raise HistoryVersionMismatch(entity_session(stored))
+            tasks = task_entities(
+                client,
+                agent.agent_id,
+                task_index,
+                {
+                    "command_name": command_name,
+                    "arguments": json.dumps(arguments),
+                    "result": None,
+                    "task_name": task_name,
+                    "task_name_pending": task_name_pending,
+                    "relevant_goal": thoughts.get("relevant_goal", None),
+                },
+                # update the result for the last task, if it exists
+                previous_updates={"result": result},
+                # fill in a name that finished after the previous step was stored
+                fill_pending_name=lambda task: task_namer.lookup(
+                    task.get("command_name"), task.get("arguments")
+                ),
+                unsaved=migrated,
+            )
+            client.put_multi([entity, *migrated, *tasks])
+    except HistoryVersionMismatch:
+        raise
+    except Exception as e:
+        print_log("Datastore error", severity=WARNING, errorMsg=e, key=str(key))
+        raise e
+
+    return task_index
 
 
-def new_interact(
+def patch_task_name(agent_id: str, task_index: int, task_name: str):
+    """Replace the placeholder name of a stored task once its name is generated"""
+    try:
+        set_task_name(datastore_client(), agent_id, task_index, task_name)
+    except Exception as e:
+        print_log(
+            "Task name patch error", severity=WARNING, errorMsg=e, agent_id=agent_id
+        )
+
+
+async def settle_quietly(agent_id: str, *tasks) -> None:
+    """Wait for the phases of a failed step, logging their own failures
+
+    The error of the step is the one raised; the phases that failed too only
+    have to be finished.
+    """
+    for error in await settle(*tasks, raise_error=False):
+        print_log(
+            "Step phase failed", severity=WARNING, errorMsg=error, agent_id=agent_id
+        )
+
+
+async def new_interact(
     cfg: Config,
     ai_config: AIConfig,
     memory: PineconeMemory,
@@ -50,9 +279,16 @@ def new_interact(
     arguments: str,
     assistant_reply: str,  # TODO: fetch from Datastore
     agent_id: str,
-    full_message_history=[],  # TODO: fetch from Datastore
+    full_message_history=[],
+    history_version: int = 0,
+    emit: Optional[Callable[[str, Any], None]] = None,
 ):
-    key = client.key("Agent", agent_id)
+    key = datastore_client().key("Agent", agent_id)
+
+    def notify(event: str, data) -> None:
+        if emit is not None:
+            emit(event, data)
+
 
     logger.set_level(logging.DEBUG if cfg.debug_mode else logging.INFO)
     system_prompt = ai_config.construct_full_prompt()
@@ -87,90 +323,110 @@ def new_interact(
         cfg=cfg,
     )
 
-    (
-        command_name,
-        arguments,
-        thoughts,
-        full_message_history,
-        assistant_reply,
-        result,
-    ) = agent.single_step(
-        command_name=command_name,
-        arguments=arguments,
-    )
-
-    # generate simplified task name
-    task_name = generate_task_name(cfg, command_name, arguments)
+    timer = PhaseTimer()
 
+    result, memory_to_add, godmode_log = await timer.run(
+        "execute_command", agent.execute_step, command_name, arguments
+    )
+    notify("command_result", {"result": result})
+
+    # The memory write and the read of the previous agent state overlap with the
+    # LLM call. The memory added here may not yet be visible to the relevant
+    # memory lookup of this step, but the result is already in the message history.
+    memory_write = timer.spawn("memory_add", memory.add, memory_to_add)
+    prev_fetch = timer.spawn(
+        "datastore_get",
+        datastore_client().get,
+        key,
+        timeout=phase_timeout(DATASTORE_TIMEOUT),
+    )
     try:
-        entity = datastore.Entity(
-            key=key,
-            exclude_from_indexes=(
-                "full_message_history",
-                "agents",
-                "assistant_reply",
-                "thoughts",
-                "arguments",
-                "command_name",
-                "tasks",
-                "ai_role",
-                "ai_goals",
-            ),
+        thoughts, log = await timer.run(
+            "chat_with_ai",
+            agent.think,
+            # only stream the reply from the model when someone is listening
+            on_delta=(lambda delta: notify("thoughts", {"delta": delta}))
+            if emit is not None
+            else None,
         )
+    except BaseException:
+        await settle_quietly(agent_id, memory_write, prev_fetch)
+        raise
+    godmode_log += log
+
+    command_name = agent.command_name
+    arguments = agent.arguments
+    notify(
+        "command",
+        {"command": command_name, "arguments": arguments, "thoughts": thoughts},
+    )
 
-        prev = client.get(key) or {}
-        tasks = prev.get("tasks", [])
-        # update the result for the last task, if it exists
-        if len(tasks) > 0:
-            lastTask: datastore.Entity = tasks[-1]
-            lastTask.update({"result": result})
+    # use a cached simplified task name, or a placeholder until one is generated
+    task_name = task_namer.lookup(command_name, arguments)
+    task_name_pending = task_name is None
+    if task_name_pending:
+        task_name = placeholder_task_name(command_name, arguments)
 
-        task = datastore.Entity(exclude_from_indexes=("result", "arguments"))
-        task.update(
-            {
-                "command_name": command_name,
-                "arguments": json.dumps(arguments),
-                "result": None,
-                "task_name": task_name,
-                "relevant_goal": thoughts.get("relevant_goal", None),
-            }
+    log_upload = timer.spawn(
+        "upload_log", upload_log, agent.build_log(memory_to_add, godmode_log), agent_id
+    )
+    try:
+        # the embeddings of the memory write are part of the step's usage, and
+        # a step whose memory write failed is not stored
+        await settle(memory_write)
+        prev = await prev_fetch
+        # the tokens of the agent so far, with all those of this step
+        ledger = current_ledger()
+        agent_usage = add_usage(
+            json.loads((prev or {}).get("usage") or "{}"),
+            ledger.as_dict() if ledger is not None else {},
         )
-        tasks.append(task)
-
-        entity.update(
-            {
-                "ai_name": agent.ai_name,
-                "ai_role": agent.ai_role,
-                "ai_goals": agent.ai_goals,
-                "agent_id": agent.agent_id,
-                "full_message_history": json.dumps(agent.full_message_history),
-                "command_name": agent.command_name,
-                "arguments": json.dumps(agent.arguments),
-                "assistant_reply": json.dumps(agent.assistant_reply),
-                "thoughts": json.dumps(thoughts),
-                "agents": agent.agent_manager.agents,
-                "tasks": tasks,
-            }
+        task_index = await timer.run(
+            "datastore_put",
+            persist_step,
+            key,
+            prev,
+            agent,
+            command_name,
+            arguments,
+            thoughts,
+            result,
+            task_name,
+            task_name_pending,
+            history_version,
+            agent_usage,
+        )
+    except BaseException:
+        await settle_quietly(agent_id, memory_write, log_upload, prev_fetch)
+        raise
+    await settle(memory_write, log_upload, prev_fetch)
+    notify("persisted", {"task": task_name, "task_pending": task_name_pending})
+
+    if task_name_pending:
+        task_namer.submit(
+            cfg,
+            command_name,
+            arguments,
+            on_named=functools.partial(patch_task_name, agent_id, task_index),
         )
-        client.put(entity)
-    except Exception as e:
-        print_log("Datastore error", severity=WARNING, errorMsg=e, key=str(key))
-        raise e
 
     return (
         command_name,
         arguments,
         thoughts,
-        full_message_history,
-        assistant_reply,
+        agent.full_message_history,
+        agent.assistant_reply,
         result,
         task_name,
+        task_name_pending,
+        timer.as_dict(),
+        agent_usage,
     )
 
 
 # make an api using flask
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 
 class LogRequestDurationMiddleware:
@@ -246,6 +502,15 @@ def health():
     return "OK"
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return "Unauthorized", 401
+    payload, content_type = render()
+    return Response(payload, content_type=content_type)
+
+
 def make_rate_limit(rate: str):
     def get_rate_limit():
         request_data = request.get_json()
@@ -254,13 +519,51 @@ def make_rate_limit(rate: str):
             and len(request_data.get("openai_key", "")) > 0
         ):
             return "5000 per day;1200 per hour;200 per minute"
+        if quota_exceeded():
+            # rejects every request until the quota resets
+            return "0 per day"
 
         return rate
 
     return get_rate_limit
 
 
-firebase_admin.initialize_app()
+def quota_exceeded() -> bool:
+    """Whether the signed in user spent their tokens on the server's key today
+
+    Runs before the token is checked by verify_firebase_token, so an invalid
+    token is not over quota; it is rejected there.
+    """
+    id_token = request.headers.get("Authorization")
+    if id_token is None or usage_quota.daily_tokens <= 0:
+        return False
+    if id_token.startswith("Bearer "):
+        id_token = id_token[7:]
+    try:
+        user_id = token_cache.verify(id_token).get("user_id")
+    except Exception:
+        return False
+    return user_id is not None and usage_quota.exceeded(user_id)
+
+
+def charge_usage(user: Optional[dict], openai_key: Optional[str], ledger) -> None:
+    """Charge the tokens of a request on the server's key to the user's quota"""
+    if user and not openai_key:
+        usage_quota.add(user.get("user_id"), ledger.as_dict()["total_tokens"])
+
+
+def verify_id_token(id_token: str) -> dict:
+    ensure_firebase_app()
+    return firebase_auth.verify_id_token(id_token)
+
+
+def fetch_certs() -> None:
+    ensure_firebase_app()
+    fetch_firebase_certs()
+
+
+token_cache = VerifiedTokenCache(verify_id_token)
+cert_warmer = CertificateWarmer(fetch_certs)
 
 
 def verify_firebase_token(f):
@@ -274,7 +577,8 @@ def verify_firebase_token(f):
                 # Remove 'Bearer ' from the token if it's present
                 if id_token.startswith("Bearer "):
                     id_token = id_token[7:]
-                decoded_token = firebase_auth.verify_id_token(id_token)
+                cert_warmer.ensure_started()
+                decoded_token = token_cache.verify(id_token)
                 user = decoded_token
             except ValueError as e:
                 return jsonify({"error": "Unauthorized", "message": str(e)}), 401
@@ -315,6 +619,7 @@ def verify_firebase_token(f):
 @app.route("/api-goal-subgoals", methods=["POST"])  # type: ignore
 @limiter.limit(make_rate_limit("100 per day;60 per hour;15 per minute"))
 @verify_firebase_token
+@call_site("subgoals")
 def subgoals():
     request_data = request.get_json()
 
@@ -324,24 +629,29 @@ def subgoals():
 
     subgoals = []
     try:
-        subgoals = create_chat_completion(
-            [
-                chat.create_chat_message(
-                    "system",
-                    "You are ChatGPT, a large language model trained by OpenAI.\nKnowledge cutoff: 2021-09\nCurrent date: 2023-03-26",
-                ),
-                chat.create_chat_message(
-                    "user",
-                    f'Make a list of 3 subtasks to the overall goal of: "{goal}".\n'
-                    + "\n"
-                    + "ONLY answer this message with a numbered list of short, standalone subtasks. write nothing else. Make sure to make the subtask descriptions as brief as possible.",
-                ),
-            ],
-            model="gpt-3.5-turbo",
-            temperature=0.2,
-            max_tokens=150,
-            cfg=cfg,
-        )
+        with track_usage() as ledger:
+            try:
+                subgoals = create_chat_completion(
+                    [
+                        chat.create_chat_message(
+                            "system",
+                            "You are ChatGPT, a large language model trained by OpenAI.\nKnowledge cutoff: 2021-09\nCurrent date: 2023-03-26",
+                        ),
+                        chat.create_chat_message(
+                            "user",
+                            f'Make a list of 3 subtasks to the overall goal of: "{goal}".\n'
+                            + "\n"
+                            + "ONLY answer this message with a numbered list of short, standalone subtasks. write nothing else. Make sure to make the subtask descriptions as brief as possible.",
+                        ),
+                    ],
+                    model="gpt-3.5-turbo",
+                    temperature=0.2,
+                    max_tokens=150,
+                    cfg=cfg,
+                    cache=True,
+                )
+            finally:
+                charge_usage(getattr(request, "user", None), cfg.openai_api_key, ledger)
     except Exception as e:
         if isinstance(e, OpenAIError):
             print_log("OpenAI error", severity=WARNING, errorMsg=e)
@@ -356,83 +666,235 @@ def subgoals():
     )
 
 
-@app.route("/api", methods=["POST"])  # type: ignore
-@limiter.limit(make_rate_limit("500 per day;200 per hour;8 per minute"))
-@verify_firebase_token
-def godmode_main():
+def client_history(messages: Optional[List[dict]]) -> Optional[List[dict]]:
+    """Return messages without the token counts the stored history carries"""
+    if messages is None:
+        return None
+    return [chat.api_message(message) for message in messages]
+
+
+def history_mismatch(e: HistoryVersionMismatch):
+    """The response asking the client to resync with the stored history"""
+    return (
+        {
+            "error": "history_version_mismatch",
+            "history_version": e.session.version if e.session else None,
+            "message_history": client_history(e.session.messages)
+            if e.session
+            else None,
+        },
+        409,
+    )
+
+
+def run_step(request_data: dict, user: Optional[dict], emit=None):
+    """Run one step of an agent for an /api request
+
+    Args:
+        request_data (dict): The body of the request
+        user (dict, optional): The verified claims of the signed in user
+        emit (Callable, optional): Called as ``emit(event, data)`` with progress
+            events while the step runs
+
+    Returns:
+        tuple: The response body and the HTTP status
+    """
+    command_name = request_data["command"]
+    arguments = request_data["arguments"]
+    assistant_reply = request_data.get("assistant_reply", "")
+
+    ai_name = request_data["ai_name"]
+    ai_description = request_data["ai_description"]
+    ai_goals = request_data["ai_goals"]
+
+    agent_id = request_data["agent_id"]
+
+    # Clients on the delta protocol send the version of the history they
+    # have plus any new messages, and only send the full history to resync.
+    history_version = request_data.get("history_version", None)
+    delta_protocol = history_version is not None
+    delta = request_data.get("message_history_delta", None)
+    full_history = request_data.get("message_history", None if delta_protocol else [])
     try:
-        request_data = request.get_json()
+        session = session_store.resolve(
+            agent_id,
+            history_version,
+            # the token counts of the messages are ours to make
+            delta=client_history(delta),
+            full_history=client_history(full_history),
+        )
+    except HistoryVersionMismatch as e:
+        return history_mismatch(e)
+    message_history = session.messages
+    base_history_length = min(len(message_history), SESSION_MAX_MESSAGES)
 
-        command_name = request_data["command"]
-        arguments = request_data["arguments"]
-        assistant_reply = request_data.get("assistant_reply", "")
+    if user:
+        try:
+            shortened_desc = ai_description[:1200]
+            users_agent = datastore.Entity(
+                key=datastore_client().key(
+                    "User", user.get("user_id"), "Agents", agent_id
+                ),
+            )
+            users_agent.update(
+                {
+                    "created": datetime.datetime.now(),
+                    "agent_id": agent_id,
+                    "ai_name": ai_name,
+                    "ai_role": shortened_desc,
+                }
+            )
+            users_agent["index_page"] = session_index.ensure(
+                user.get("user_id"),
+                dict(users_agent),
+                lambda: datastore_client().get(users_agent.key),
+            )
+            datastore_client().put(users_agent)
+        except Exception as e:
+            print_log("User entity failed", severity=WARNING, errorMsg=e)
 
-        ai_name = request_data["ai_name"]
-        ai_description = request_data["ai_description"]
-        ai_goals = request_data["ai_goals"]
-        message_history = request_data.get("message_history", [])
+    openai_key = request_data.get("openai_key", None)
+    gpt_model = "gpt-3.5-turbo"
+    if len(openai_key or "") > 0:
+        gpt_model = request_data.get("gpt_model", "gpt-3.5-turbo")
+    else:
+        gpt_model = "gpt-3.5-turbo"
 
-        agent_id = request_data["agent_id"]
+    cfg = Config()
+    cfg.openai_api_key = openai_key
+    # the agent steps run on the chosen model; the light calls (task names,
+    # JSON fixes, summaries) are routed to LLM_LIGHT_MODEL by the model router
+    cfg.fast_llm_model = gpt_model
+    cfg.smart_llm_model = gpt_model
+    cfg.agent_id = agent_id
+
+    memory: PineconeMemory = get_memory(cfg)  # type: ignore
+
+    ai_config = AIConfig(
+        ai_name=ai_name,
+        ai_role=ai_description,
+        ai_goals=ai_goals,
+    )
 
-        if hasattr(request, "user"):
-            try:
-                shortened_desc = ai_description[:1200]
-                users_agent = datastore.Entity(
-                    key=client.key(
-                        "User", request.user.get("user_id"), "Agents", agent_id
-                    ),
-                )
-                users_agent.update(
-                    {
-                        "created": datetime.datetime.now(),
-                        "agent_id": agent_id,
-                        "ai_name": ai_name,
-                        "ai_role": shortened_desc,
-                    }
+    with track_usage() as ledger:
+        try:
+            (
+                command_name,
+                arguments,
+                thoughts,
+                message_history,
+                assistant_reply,
+                result,
+                task,
+                task_pending,
+                timings,
+                agent_usage,
+            ) = run_with_deadline(
+                new_interact(
+                    cfg=cfg,
+                    ai_config=ai_config,
+                    memory=memory,
+                    command_name=command_name,
+                    arguments=arguments,
+                    assistant_reply=assistant_reply,
+                    agent_id=agent_id,
+                    full_message_history=message_history,
+                    history_version=session.version + 1,
+                    emit=emit,
                 )
-                client.put(users_agent)
-            except Exception as e:
-                print_log("User entity failed", severity=WARNING, errorMsg=e)
+            )
+        except asyncio.TimeoutError:
+            print_log("Step deadline exceeded", severity=WARNING, agent_id=agent_id)
+            return {"error": "step_deadline_exceeded"}, 504
+        except HistoryVersionMismatch as e:
+            # another step of the same version was stored first
+            return history_mismatch(e)
+        finally:
+            # the tokens of a step that failed were spent all the same
+            charge_usage(user, openai_key, ledger)
 
-        openai_key = request_data.get("openai_key", None)
-        gpt_model = "gpt-3.5-turbo"
-        if len(openai_key or "") > 0:
-            gpt_model = request_data.get("gpt_model", "gpt-3.5-turbo")
-        else:
-            gpt_model = "gpt-3.5-turbo"
-
-        cfg = Config()
-        cfg.openai_api_key = openai_key
-        cfg.fast_llm_model = gpt_model
-        cfg.smart_llm_model = gpt_model
-        cfg.agent_id = agent_id
-
-        memory: PineconeMemory = get_memory(cfg)  # type: ignore
-
-        ai_config = AIConfig(
-            ai_name=ai_name,
-            ai_role=ai_description,
-            ai_goals=ai_goals,
+    try:
+        session_store.put(
+            agent_id, Session(session.version + 1, message_history), session.version
         )
-
-        (
-            command_name,
-            arguments,
-            thoughts,
-            message_history,
-            assistant_reply,
-            result,
-            task,
-        ) = new_interact(
-            cfg=cfg,
-            ai_config=ai_config,
-            memory=memory,
-            command_name=command_name,
-            arguments=arguments,
-            assistant_reply=assistant_reply,
+    except Exception as e:
+        # the step is stored in Datastore already, the next read goes there
+        print_log(
+            "Session cache write failed",
+            severity=WARNING,
             agent_id=agent_id,
-            full_message_history=message_history,
+            errorMsg=e,
+        )
+        session_store.invalidate(agent_id)
+
+    response = {
+        "command": command_name,
+        "arguments": arguments,
+        "thoughts": thoughts,
+        "history_version": session.version + 1,
+        "assistant_reply": assistant_reply,
+        "result": result,
+        "task": task,
+        "task_pending": task_pending,
+        "timings": timings,
+        "usage": {
+            "step": ledger.as_dict(),
+            "agent": agent_usage,
+            "quota": usage_quota.status(user.get("user_id"))
+            if user and not openai_key
+            else None,
+        },
+    }
+    if delta_protocol:
+        response["message_history_delta"] = client_history(
+            message_history[base_history_length:]
         )
+    else:
+        response["message_history"] = client_history(message_history)
+
+    return response, 200
+
+
+step_slots = StepSlots()
+
+for name, source in {
+    "task_namer": task_namer,
+    "log_shipper": log_shipper,
+    "token_cache": token_cache,
+    "session_index": session_index,
+    "step_slots": step_slots,
+    "session_pool": session_pool,
+    "rate_limiter": rate_limiter,
+    "completion_cache": completion_cache,
+    "embedding_cache": embedding_cache,
+    "model_router": model_router,
+    "hedger": hedger,
+    "singleflight": singleflight,
+    "usage_quota": usage_quota,
+    "usage_calibration": calibration,
+}.items():
+    register_stats(name, source.stats)
+if hasattr(llm_backend, "stats"):
+    register_stats("llm_backend", llm_backend.stats)
+
+
+def overloaded():
+    print_log("Step slots exhausted", severity=WARNING, **step_slots.stats())
+    return (
+        json.dumps({"error": "overloaded"}),
+        503,
+        {"Retry-After": str(max(1, int(step_slots.wait)))},
+    )
+
+
+@app.route("/api", methods=["POST"])  # type: ignore
+@limiter.limit(make_rate_limit("500 per day;200 per hour;8 per minute"))
+@verify_firebase_token
+def godmode_main():
+    if not step_slots.acquire():
+        return overloaded()
+    try:
+        response, status = run_step(request.get_json(), getattr(request, "user", None))
     except Exception as e:
         if isinstance(e, OpenAIError):
             print_log("OpenAI error", severity=WARNING, errorMsg=e)
@@ -440,17 +902,68 @@ def godmode_main():
 
         print_log("/api error", severity=ERROR, errorMsg=e)
         raise e
+    finally:
+        step_slots.release()
 
-    return json.dumps(
-        {
-            "command": command_name,
-            "arguments": arguments,
-            "thoughts": thoughts,
-            "message_history": message_history,
-            "assistant_reply": assistant_reply,
-            "result": result,
-            "task": task,
-        }
+    return json.dumps(response), status
+
+
+def format_sse(event: str, data) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/stream", methods=["POST"])  # type: ignore
+@limiter.limit(make_rate_limit("500 per day;200 per hour;8 per minute"))
+@verify_firebase_token
+def godmode_stream():
+    """Run a step like /api, streaming its progress as Server-Sent Events
+
+    Events: command_result, thoughts (deltas of the reply), command, persisted,
+    then done with the body /api would return, or error.
+    """
+    request_data = request.get_json()
+    user = getattr(request, "user", None)
+    events: queue.Queue = queue.Queue()
+
+    def emit(event: str, data) -> None:
+        events.put((event, data))
+
+    def run() -> None:
+        try:
+            response, status = run_step(request_data, user, emit=emit)
+            emit("done" if status == 200 else "error", response)
+        except Exception as e:
+            if isinstance(e, OpenAIError):
+                print_log("OpenAI error", severity=WARNING, errorMsg=e)
+                emit("error", e.error)
+            else:
+                err_uuid = str(uuid4())
+                print_log(
+                    "/api/stream error", severity=ERROR, errorMsg=e, error_id=err_uuid
+                )
+                emit("error", {"error": f"There was an error. Error ID: {err_uuid}"})
+        finally:
+            step_slots.release()
+            events.put(None)
+
+    if not step_slots.acquire():
+        return overloaded()
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(run,), daemon=True
+    ).start()
+
+    def generate():
+        while True:
+            item = events.get()
+            if item is None:
+                return
+            yield format_sse(*item)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
@@ -474,18 +987,10 @@ def api_files():
 @verify_firebase_token
 def sessions():
     try:
-        ref = (
-            fireclient.collection("User")
-            .document(request.user.get("user_id"))
-            .collection("Agents")
-            .where("ai_name", "!=", "deleted")
+        cursor = (request.get_json(silent=True) or {}).get("cursor", None)
+        results, next_cursor = session_index.list_page(
+            request.user.get("user_id"), cursor
         )
-        docs = ref.stream()
-        results = []
-        for doc in docs:
-            agent = doc.to_dict()
-            agent["agent_id"] = doc.id
-            results.append(agent)
 
         return json.dumps(
             {
@@ -497,6 +1002,7 @@ def sessions():
                     }
                     for r in results
                 ],
+                "cursor": next_cursor,
             }
         )
 
@@ -510,8 +1016,8 @@ def sessions():
 @verify_firebase_token
 def session(agent_id):
     try:
-        ancestor_key = client.key("Agent", agent_id)
-        entity = client.get(key=ancestor_key)
+        ancestor_key = datastore_client().key("Agent", agent_id)
+        entity = datastore_client().get(key=ancestor_key)
         if entity is None:
             return json.dumps(
                 {
@@ -525,9 +1031,14 @@ def session(agent_id):
             else entity["arguments"]
         )
 
+        tasks_cursor = None
+        if "tasks" not in entity:
+            entity["tasks"], tasks_cursor = list_tasks(datastore_client(), agent_id)
+
         return json.dumps(
             {
                 "session": entity,
+                "tasks_cursor": tasks_cursor,
             }
         )
 
@@ -536,16 +1047,39 @@ def session(agent_id):
         raise e
 
 
+@app.route("/api/sessions/<agent_id>/tasks", methods=["GET"])  # type: ignore
+@limiter.limit("32 per minute")
+@verify_firebase_token
+def session_tasks(agent_id):
+    try:
+        limit = request.args.get("limit", TASK_PAGE_SIZE, type=int)
+        cursor = request.args.get("cursor", None)
+        tasks, next_cursor = list_tasks(
+            datastore_client(), agent_id, limit=limit, cursor=cursor
+        )
+
+        return json.dumps(
+            {
+                "tasks": tasks,
+                "cursor": next_cursor,
+            }
+        )
+
+    except Exception as e:
+        print_log("Session tasks error", severity=ERROR, errorMsg=e)
+        raise e
+
+
 @app.route("/api/sessions/<agent_id>", methods=["DELETE"])  # type: ignore
 @limiter.limit("16 per minute")
 @verify_firebase_token
 def delete_session(agent_id):
     try:
-        useragent_key = client.key(
+        useragent_key = datastore_client().key(
             "User", request.user.get("user_id"), "Agents", agent_id
         )
 
-        current_agent = client.get(key=useragent_key) or {}
+        current_agent = datastore_client().get(key=useragent_key) or {}
         users_agent = datastore.Entity(key=useragent_key)
         users_agent.update(
             {
@@ -554,7 +1088,10 @@ def delete_session(agent_id):
                 "ai_name": "deleted",  # workaround since datastore can't query for lack of a property https://stackoverflow.com/a/44187921/6912118
             }
         )
-        client.put(users_agent)
+        datastore_client().put(users_agent)
+        session_index.remove(
+            request.user.get("user_id"), agent_id, current_agent.get("index_page")
+        )
 
         return json.dumps({})
 
@@ -1,33 +1,44 @@
+import atexit
 import json
+import os
 import time
 from typing import Union
 from flask import request
-from google.cloud import storage
 from autogpt import chat
 
+from autogpt.cloud_clients import (
+    PUBLIC_BUCKET_NAME,
+    private_bucket,
+    public_bucket,
+    storage_client,
+)
 from autogpt.llm_utils import create_chat_completion
+from autogpt.metrics import call_site
+from autogpt.log_shipper import LogShipper
 
-private_bucket_name = "godmode-ai"
-public_bucket_name = "godmode-public"
+LOG_UPLOAD_TIMEOUT = float(os.getenv("LOG_UPLOAD_TIMEOUT", 10))
 
-client = storage.Client()
-private_bucket = client.bucket(private_bucket_name)
 
-
-def upload_log(text: str, session_id: str):
-    timestamp = time.time()
-    blob = private_bucket.blob(f"godmode-logs/{session_id}/{int(timestamp * 1000)}.txt")
+def upload_log_segment(name: str, data: bytes):
+    blob = private_bucket().blob(name)
+    blob.content_encoding = "gzip"
     blob.upload_from_string(
-        text,
-        content_type="text/plain",
+        data,
+        content_type="application/x-ndjson",
+        timeout=LOG_UPLOAD_TIMEOUT,
     )
 
 
-bucket = client.bucket(public_bucket_name)
+log_shipper = LogShipper(upload_log_segment)
+atexit.register(log_shipper.close)
+
+
+def upload_log(text: str, session_id: str):
+    log_shipper.submit(session_id, text)
 
 
 def write_file(text: str, filename: str, agent_id: str):
-    blob = bucket.blob(f"godmode-files/{agent_id}/{filename}")
+    blob = public_bucket().blob(f"godmode-files/{agent_id}/{filename}")
     blob.upload_from_string(
         text,
         content_type="text/plain",
@@ -35,7 +46,7 @@ def write_file(text: str, filename: str, agent_id: str):
 
 
 def get_file(filename: str, agent_id: str):
-    blob = bucket.blob(f"godmode-files/{agent_id}/{filename}")
+    blob = public_bucket().blob(f"godmode-files/{agent_id}/{filename}")
     try:
         text = blob.download_as_text()
         return text
@@ -44,17 +55,20 @@ def get_file(filename: str, agent_id: str):
 
 
 def list_files(agent_id: str):
-    blobs = bucket.list_blobs(prefix=f"godmode-files/{agent_id}/")
+    blobs = public_bucket().list_blobs(prefix=f"godmode-files/{agent_id}/")
     return [file.name for file in blobs]
 
 
 def get_file_urls(agent_id: str):
     if len(agent_id) < 5:
         return []
-    blobs = client.list_blobs(public_bucket_name, prefix=f"godmode-files/{agent_id}/")
+    blobs = storage_client().list_blobs(
+        PUBLIC_BUCKET_NAME, prefix=f"godmode-files/{agent_id}/"
+    )
     return [file.public_url for file in blobs]
 
 
+@call_site("task_name")
 def generate_task_name(cfg, command_name: str, arguments: str):
     try:
         task_name = create_chat_completion(
@@ -78,6 +92,7 @@ def generate_task_name(cfg, command_name: str, arguments: str):
             model="gpt-3.5-turbo",
             temperature=0.2,
             cfg=cfg,
+            cache=True,
         )
         return task_name
     except Exception as e:
@@ -0,0 +1,139 @@
+"""Caching of verified Firebase ID tokens and of the keys that sign them.
+
+Clients poll the API with the same ID token for up to an hour, so the claims of
+a verified token are kept in process, keyed by a hash of the token, until the
+token expires. The public certificates used for verification are fetched ahead
+of time and refreshed in the background, so a cache miss never waits on them.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from firebase_admin import auth as firebase_auth
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_MAX_TTL = int(os.getenv("TOKEN_CACHE_MAX_TTL", 3600))
+CERT_REFRESH_INTERVAL = int(os.getenv("CERT_REFRESH_INTERVAL", 600))
+FIREBASE_CERT_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/"
+    "securetoken@system.gserviceaccount.com"
+)
+
+
+class VerifiedTokenCache:
+    """LRU cache of the claims of verified tokens, bounded by size and expiry.
+
+    Args:
+        verify: Verifies a token and returns its claims, raising if it is invalid.
+        max_size: The maximum number of cached tokens.
+        max_ttl: The maximum number of seconds a token is cached, whatever its expiry.
+    """
+
+    def __init__(
+        self,
+        verify: Callable[[str], Dict[str, Any]],
+        max_size: int = TOKEN_CACHE_SIZE,
+        max_ttl: int = TOKEN_CACHE_MAX_TTL,
+    ) -> None:
+        self.verify_fn = verify
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._claims: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, id_token: str) -> Dict[str, Any]:
+        """Return the claims of a token, verifying it only if it is not cached
+
+        Raises:
+            Whatever the verify function raises for an invalid token. Failed
+            verifications are never cached.
+        """
+        key = hashlib.sha256(id_token.encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            cached = self._claims.get(key)
+            if cached is not None and cached[0] > now:
+                self._claims.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        claims = self.verify_fn(id_token)
+
+        expires = min(float(claims.get("exp", 0)), now + self.max_ttl)
+        if expires > now:
+            with self._lock:
+                self._claims[key] = (expires, claims)
+                self._claims.move_to_end(key)
+                while len(self._claims) > self.max_size:
+                    self._claims.popitem(last=False)
+        return claims
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of cached tokens, hits and misses"""
+        with self._lock:
+            return {"size": len(self._claims), "hits": self.hits, "misses": self.misses}
+
+
+def fetch_firebase_certs() -> None:
+    """Fetch the Firebase token signing certificates into the verifier's HTTP cache"""
+    # firebase_admin keeps the certificates in a cache-control aware session of
+    # the verifier, which is not exposed publicly
+    request = firebase_auth._get_client(None)._token_verifier.request
+    request(url=FIREBASE_CERT_URL)
+
+
+class CertificateWarmer:
+    """Keeps the token signing certificates fetched, refreshing them periodically.
+
+    Args:
+        fetch: Fetches the certificates.
+        interval: Seconds between refreshes.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], None] = fetch_firebase_certs,
+        interval: float = CERT_REFRESH_INTERVAL,
+    ) -> None:
+        self.fetch = fetch
+        self.interval = interval
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.refreshes = 0
+        self.failures = 0
+
+    def ensure_started(self) -> None:
+        """Start refreshing in the background, once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(
+                target=self._run, name="cert-warmer", daemon=True
+            ).start()
+
+    def refresh(self) -> None:
+        """Fetch the certificates now"""
+        try:
+            self.fetch()
+            self.refreshes += 1
+        except Exception as e:
+            self.failures += 1
+            print("Failed to fetch token certificates", e)
+
+    def _run(self) -> None:
+        while True:
+            self.refresh()
+            if self._stop.wait(self.interval):
+                return
@@ -1,11 +1,18 @@
+from __future__ import annotations
+
+import bisect
+import itertools
 import time
+from typing import Any, Callable, Dict, List
 
 from openai.error import RateLimitError
 
 from autogpt import token_counter
 from autogpt.config import Config
-from autogpt.llm_utils import create_chat_completion
+from autogpt.llm_utils import create_chat_completion, create_chat_completion_with_usage
 from autogpt.logs import logger
+from autogpt.metrics import call_site
+from autogpt.usage import calibration
 
 
 def create_chat_message(role, content):
@@ -22,18 +29,136 @@ def create_chat_message(role, content):
     return {"role": role, "content": content}
 
 
-def generate_context(prompt, relevant_memory, full_message_history, model):
-    current_context = [
+def api_message(message: Dict[str, Any]) -> Dict[str, str]:
+    """Return a message of the history as the API takes it, without the token
+    counts it carries."""
+    return {key: value for key, value in message.items() if key != "tokens"}
+
+
+def message_tokens(message: Dict[str, Any], model: str) -> int:
+    """
+    Return the tokens of a message of the history, counted once per model.
+
+    The counts are kept on the message, under "tokens", and are stored with the
+    message history, so a message is only encoded the first time it is sent.
+
+    Args:
+    message (dict): The message.
+    model (str): The model the tokens are counted for.
+
+    Returns:
+    int: The tokens of the message, as count_message_tokens counts them.
+    """
+    counts = message.setdefault("tokens", {})
+    if model not in counts:
+        counts[model] = token_counter.count_message_tokens(
+            [api_message(message)], model
+        )
+    return counts[model]
+
+
+def count_history_tokens(messages: List[Dict[str, Any]], model: str) -> List[int]:
+    """
+    Return the tokens of every message of the history, see message_tokens.
+
+    The messages that were not counted yet are counted in one batch.
+
+    Args:
+    messages (list): The messages.
+    model (str): The model the tokens are counted for.
+
+    Returns:
+    list: The tokens of every message.
+    """
+    missing = [m for m in messages if model not in m.get("tokens", {})]
+    if missing:
+        counts = token_counter.count_each_message_tokens(
+            [api_message(m) for m in missing], model
+        )
+        for message, count in zip(missing, counts):
+            message.setdefault("tokens", {})[model] = count
+    return [message["tokens"][model] for message in messages]
+
+
+def context_messages(prompt, relevant_memory, now=None):
+    """
+    Create the system messages the context starts with.
+
+    Args:
+    prompt (str): The prompt explaining the rules to the AI.
+    relevant_memory (list): The memories to remind the AI of.
+    now (str, optional): The current time and date. Defaults to now.
+
+    Returns:
+    list: The system messages.
+    """
+    now = time.strftime("%c") if now is None else now
+    return [
         create_chat_message("system", prompt),
-        create_chat_message(
-            "system", f"The current time and date is {time.strftime('%c')}"
-        ),
+        create_chat_message("system", f"The current time and date is {now}"),
         create_chat_message(
             "system",
             f"This reminds you of these events from your past:\n{relevant_memory}\n\n",
         ),
     ]
 
+
+def fit_memories(relevant_memory, budget, model):
+    """
+    Keep the most relevant memories whose tokens fit in a budget.
+
+    The tokens of every memory are counted once, and the cut is found by a
+    binary search over their running total, however many memories are dropped.
+
+    Args:
+    relevant_memory (list): The memories, most relevant first.
+    budget (int): The tokens the memories may take.
+    model (str): The model the tokens are counted for.
+
+    Returns:
+    tuple: The memories kept and an estimate of their tokens.
+    """
+    if not relevant_memory or budget <= 0:
+        return relevant_memory[:0], 0
+    # a memory is rendered as the repr of an item of the list
+    costs = token_counter.count_strings_tokens(
+        [f"{memory!r}, " for memory in relevant_memory], model
+    )
+    running = list(itertools.accumulate(costs))
+    kept = bisect.bisect_right(running, budget)
+    return relevant_memory[:kept], running[kept - 1] if kept else 0
+
+
+def build_context(prompt, relevant_memory, full_message_history, model, memory_limit):
+    """
+    Create the start of the context like generate_context, with the most
+    relevant memories that keep its system messages within memory_limit tokens.
+
+    The system messages are built once, and only counted without the memories.
+
+    Returns:
+    tuple: The index of the next message of the history to add, the tokens
+    used, the index to insert it at and the context.
+    """
+    now = time.strftime("%c")
+    tokens_used = token_counter.count_message_tokens(
+        context_messages(prompt, relevant_memory[:0], now), model
+    )
+    relevant_memory, memory_tokens = fit_memories(
+        relevant_memory, memory_limit - tokens_used, model
+    )
+    current_context = context_messages(prompt, relevant_memory, now)
+    return (
+        len(full_message_history) - 1,
+        tokens_used + memory_tokens,
+        len(current_context),
+        current_context,
+    )
+
+
+def generate_context(prompt, relevant_memory, full_message_history, model):
+    current_context = context_messages(prompt, relevant_memory)
+
     # Add messages from the full message history until we reach the token limit
     next_message_to_add_index = len(full_message_history) - 1
     insertion_index = len(current_context)
@@ -47,8 +172,15 @@ def generate_context(prompt, relevant_memory, full_message_history, model):
     )
 
 
+@call_site("chat_with_ai")
 def chat_with_ai(
-    prompt, user_input, full_message_history, permanent_memory, token_limit, cfg: Config
+    prompt,
+    user_input,
+    full_message_history,
+    permanent_memory,
+    token_limit,
+    cfg: Config,
+    on_delta: Callable[[str], None] | None = None,
 ):
     """Interact with the OpenAI API, sending the prompt, user input, message history,
     and permanent memory."""
@@ -66,11 +198,15 @@ def chat_with_ai(
                 permanent_memory (Obj): The memory object containing the permanent
                   memory.
                 token_limit (int): The maximum number of tokens allowed in the API call.
+                on_delta (Callable, optional): If given, the reply is streamed and
+                  every piece is passed to it as it arrives.
 
             Returns:
             str: The AI's response.
             """
-            model = cfg.fast_llm_model  # TODO: Change model from hardcode to argument
+            # the tokens are counted for the fast model; the model router picks
+            # the model the reply is asked of
+            model = cfg.fast_llm_model
             # Reserve 1000 tokens for the response
 
             # logger.debug(f"Token limit: {token_limit}")
@@ -79,49 +215,42 @@ def chat_with_ai(
             relevant_memory = (
                 ""
                 if len(full_message_history) == 0
-                else permanent_memory.get_relevant(str(full_message_history[-9:]), 10)
+                else permanent_memory.get_relevant(
+                    str([api_message(m) for m in full_message_history[-9:]]), 10
+                )
             )
 
             # logger.debug(f"Memory Stats: {permanent_memory.get_stats()}")
 
+            # keep the most relevant memories that fit in 2500 tokens
             (
                 next_message_to_add_index,
                 current_tokens_used,
                 insertion_index,
                 current_context,
-            ) = generate_context(prompt, relevant_memory, full_message_history, model)
-
-            while current_tokens_used > 2500:
-                # remove memories until we are under 2500 tokens
-                relevant_memory = relevant_memory[:-1]
-                (
-                    next_message_to_add_index,
-                    current_tokens_used,
-                    insertion_index,
-                    current_context,
-                ) = generate_context(
-                    prompt, relevant_memory, full_message_history, model
-                )
+            ) = build_context(
+                prompt, relevant_memory, full_message_history, model, 2500
+            )
 
-            current_tokens_used += token_counter.count_message_tokens(
-                [create_chat_message("user", user_input)], model
+            user_message = create_chat_message("user", user_input)
+            current_tokens_used += message_tokens(
+                user_message, model
             )  # Account for user input (appended later)
 
+            # counted when the messages were first sent
+            history_tokens = count_history_tokens(full_message_history, model)
+
             while next_message_to_add_index >= 0:
                 # print (f"CURRENT TOKENS USED: {current_tokens_used}")
                 message_to_add = full_message_history[next_message_to_add_index]
 
-                tokens_to_add = token_counter.count_message_tokens(
-                    [message_to_add], model
-                )
+                tokens_to_add = history_tokens[next_message_to_add_index]
                 if current_tokens_used + tokens_to_add > send_token_limit:
                     break
 
                 # Add the most recent message to the start of the current context,
                 #  after the two system prompts.
-                current_context.insert(
-                    insertion_index, full_message_history[next_message_to_add_index]
-                )
+                current_context.insert(insertion_index, api_message(message_to_add))
 
                 # Count the currently used tokens
                 current_tokens_used += tokens_to_add
@@ -130,7 +259,7 @@ def chat_with_ai(
                 next_message_to_add_index -= 1
 
             # Append user input, the length of this is accounted for above
-            current_context.extend([create_chat_message("user", user_input)])
+            current_context.extend([api_message(user_message)])
 
             # Calculate remaining tokens
             tokens_remaining = token_limit - current_tokens_used
@@ -153,22 +282,52 @@ def chat_with_ai(
 
             # TODO: use a model defined elsewhere, so that model can contain
             # temperature and other settings we care about
-            assistant_reply = create_chat_completion(
-                model=model,
-                messages=current_context,
-                max_tokens=tokens_remaining,
-                cfg=cfg,
-            )
+            reply_tokens = None
+            if on_delta is None:
+                completion = create_chat_completion_with_usage(
+                    messages=current_context,
+                    max_tokens=tokens_remaining,
+                    cfg=cfg,
+                )
+                assistant_reply = completion.content
+                if completion.usage and not completion.usage["estimated_tokens"]:
+                    # how far the local count is from what OpenAI charged
+                    calibration.observe(
+                        "tiktoken",
+                        completion.model,
+                        current_tokens_used,
+                        completion.usage["prompt_tokens"],
+                    )
+                    if completion.model == model:
+                        # the reply is not encoded again to count it
+                        reply_tokens = (
+                            token_counter.count_message_tokens(
+                                [create_chat_message("assistant", "")], model
+                            )
+                            + completion.usage["completion_tokens"]
+                        )
+            else:
+                pieces = []
+                for delta in create_chat_completion(
+                    messages=current_context,
+                    max_tokens=tokens_remaining,
+                    cfg=cfg,
+                    stream=True,
+                ):
+                    pieces.append(delta)
+                    on_delta(delta)
+                assistant_reply = "".join(pieces)
 
             # Update full message history
-            full_message_history.append(create_chat_message("user", user_input))
-            full_message_history.append(
-                create_chat_message("assistant", assistant_reply)
-            )
+            full_message_history.append(user_message)
+            assistant_message = create_chat_message("assistant", assistant_reply)
+            if reply_tokens is not None:
+                assistant_message["tokens"] = {model: reply_tokens}
+            full_message_history.append(assistant_message)
 
             return assistant_reply
         except RateLimitError as e:
-            # TODO: When we switch to langchain, this is built in
-            print("Error: ", "API Rate Limit Reached. Waiting 10 seconds...")
+            # create_chat_completion has already waited and retried within the
+            # limits of autogpt.rate_limiter
+            print("Error: ", "API Rate Limit Reached.")
             raise e
-            # time.sleep(10)
@@ -0,0 +1,131 @@
+"""Lazily created, fork-safe Google Cloud clients.
+
+Clients are created on first use in each process instead of at import time, so
+importing the app stays cheap and a gunicorn worker never uses gRPC channels
+created in its parent before the fork. ``warmup`` creates them ahead of time,
+e.g. from gunicorn's ``post_fork`` hook.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import firebase_admin
+from google.cloud import datastore, firestore, storage
+
+PRIVATE_BUCKET_NAME = "godmode-ai"
+PUBLIC_BUCKET_NAME = "godmode-public"
+
+
+class ClientRegistry:
+    """Creates each registered client once per process, on first use."""
+
+    def __init__(self) -> None:
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._overrides: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """Register the factory of a client"""
+        self._factories[name] = factory
+
+    def override(self, name: str, instance: Optional[Any]) -> None:
+        """Use a given instance for a client, e.g. a fake in tests or benchmarks
+
+        Passing None removes the override.
+        """
+        with self._lock:
+            if instance is None:
+                self._overrides.pop(name, None)
+            else:
+                self._overrides[name] = instance
+
+    def get(self, name: str) -> Any:
+        """Return the client of this process, creating it if needed"""
+        instance = self._overrides.get(name)
+        if instance is not None:
+            return instance
+        if self._pid != os.getpid():
+            self.reset()
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                instance = self._factories[name]()
+                self._instances[name] = instance
+            return instance
+
+    def reset(self) -> None:
+        """Forget the clients created by the parent after a fork"""
+        with self._lock:
+            self._instances = {}
+            self._pid = os.getpid()
+
+    def warmup(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """Create clients now
+
+        Args:
+            names (Iterable[str], optional): The clients to create. Defaults to all.
+
+        Returns:
+            dict: The seconds it took to create each client
+        """
+        timings = {}
+        for name in list(names or self._factories):
+            t0 = time.perf_counter()
+            self.get(name)
+            timings[name] = round(time.perf_counter() - t0, 4)
+        return timings
+
+
+def _firebase_app():
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        return firebase_admin.initialize_app()
+
+
+registry = ClientRegistry()
+registry.register("datastore", datastore.Client)
+registry.register("firestore", firestore.Client)
+registry.register("storage", storage.Client)
+registry.register(
+    "private_bucket", lambda: registry.get("storage").bucket(PRIVATE_BUCKET_NAME)
+)
+registry.register(
+    "public_bucket", lambda: registry.get("storage").bucket(PUBLIC_BUCKET_NAME)
+)
+registry.register("firebase", _firebase_app)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def datastore_client() -> datastore.Client:
+    return registry.get("datastore")
+
+
+def firestore_client() -> firestore.Client:
+    return registry.get("firestore")
+
+
+def storage_client() -> storage.Client:
+    return registry.get("storage")
+
+
+def private_bucket() -> storage.Bucket:
+    return registry.get("private_bucket")
+
+
+def public_bucket() -> storage.Bucket:
+    return registry.get("public_bucket")
+
+
+def ensure_firebase_app() -> firebase_admin.App:
+    return registry.get("firebase")
@@ -40,6 +40,38 @@ def split_file(
         start += max_length - overlap
 
 
+def ingest_file(
+    filename: str, memory, max_length: int = 4000, overlap: int = 200
+) -> None:
+    """
+    Ingest a local file into memory, embedding all of its chunks in batches.
+
+    :param filename: The path of the file to ingest
+    :param memory: An object with an add_many() method to store the chunks in memory
+    :param max_length: The maximum length of each chunk, default is 4000
+    :param overlap: The number of overlapping characters between chunks,
+        default is 200
+    """
+    try:
+        print(f"Working with file {filename}")
+        with open(filename, "r", encoding="utf-8") as f:
+            content = f.read()
+        print(f"File length: {len(content)} characters")
+
+        chunks = list(split_file(content, max_length=max_length, overlap=overlap))
+        num_chunks = len(chunks)
+        print(f"Ingesting {num_chunks} chunks into memory")
+        memory.add_many(
+            [
+                f"Filename: {filename}\n" f"Content part#{i + 1}/{num_chunks}: {chunk}"
+                for i, chunk in enumerate(chunks)
+            ]
+        )
+        print(f"Done ingesting {num_chunks} chunks from {filename}.")
+    except Exception as e:
+        print(f"Error while ingesting file '{filename}': {str(e)}")
+
+
 def download_file(url, filename):
     """Downloads a file
     Args:
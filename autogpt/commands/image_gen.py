@@ -78,14 +78,14 @@ def generate_image_with_dalle(prompt: str, filename: str) -> str:
     Returns:
         str: The filename of the image
     """
-    openai.api_key = global_config.openai_api_key
-
-    response = openai.Image.create(
-        prompt=prompt,
-        n=1,
-        size="256x256",
-        response_format="b64_json",
-    )
+    with openai_call(global_config) as credentials:
+        response = openai.Image.create(
+            prompt=prompt,
+            n=1,
+            size="256x256",
+            response_format="b64_json",
+            **credentials,
+        )
 
     print(f"Image Generated for prompt:{prompt}")
 
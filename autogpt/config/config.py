@@ -1,9 +1,10 @@
 """Configuration class to store the state of bools for different scripts access."""
 import os
+from typing import List
+
 from colorama import Fore
 # from autogpt.agent_manager import AgentManager
 
-import openai
 import yaml
 
 from dotenv import load_dotenv
@@ -61,9 +62,6 @@ class Config():
 
         if self.use_azure:
             self.load_azure_config()
-            openai.api_type = self.openai_api_type
-            openai.api_base = self.openai_api_base
-            openai.api_version = self.openai_api_version
 
         self.elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
         self.elevenlabs_voice_1_id = os.getenv("ELEVENLABS_VOICE_1_ID")
@@ -120,8 +118,6 @@ class Config():
         # Note that indexes must be created on db 0 in redis, this is not configurable.
 
         self.memory_backend = os.getenv("MEMORY_BACKEND", "local")
-        # Initialize the OpenAI API client
-        openai.api_key = self.openai_api_key
 
     def get_azure_deployment_id_for_model(self, model: str) -> str:
         """
@@ -148,6 +144,25 @@ class Config():
         else:
             return ""
 
+    def get_azure_fallback_deployment_ids(self, model: str) -> List[str]:
+        """
+        Returns the deployments a model fails over to when its deployment times out.
+
+        Parameters:
+            model(str): The model to map to the deployment ids.
+
+        Returns:
+            The fallback deployment ids of the model, if any.
+        """
+        if model == self.fast_llm_model:
+            key = "fast_llm_model_fallback_deployment_ids"
+        elif model == self.smart_llm_model:
+            key = "smart_llm_model_fallback_deployment_ids"
+        else:
+            return []
+        mapping = self.azure_model_to_deployment_id_map or {}
+        return mapping.get(key) or []  # type: ignore
+
     AZURE_CONFIG_FILE = os.path.join(os.path.dirname(__file__), "..", "azure.yaml")
 
     def load_azure_config(self, config_file: str = AZURE_CONFIG_FILE) -> None:
@@ -0,0 +1,309 @@
+"""Content-addressed cache of embeddings.
+
+Embeddings are keyed by ``sha256(model + normalized text)`` and kept as float32
+vectors in an in-process LRU, a local sqlite file shared by the workers of a
+host and, optionally, Redis. The same text is only ever embedded once, e.g. the
+message window ``chat_with_ai`` looks relevant memory up with, which barely
+changes from one step to the next.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from autogpt.llm_cache import build_redis_client
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", "/tmp/godmode-embeddings.sqlite3"
+)
+EMBEDDING_CACHE_ROWS = int(os.getenv("EMBEDDING_CACHE_ROWS", 200000))
+EMBEDDING_MEMORY_SIZE = int(os.getenv("EMBEDDING_MEMORY_SIZE", 2000))
+EMBEDDING_REDIS_TTL = int(os.getenv("EMBEDDING_REDIS_TTL", 30 * 24 * 3600))
+REDIS_PREFIX = "embedding:"
+
+
+def normalize(text: str) -> str:
+    """Normalize text before embedding it, as OpenAI recommends"""
+    return text.replace("\n", " ")
+
+
+def embedding_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Return the cache key of the embedding of a (normalized) text"""
+    return hashlib.sha256((model + normalize(text)).encode()).hexdigest()
+
+
+class SqliteStore:
+    """Float32 vectors in a sqlite file, bounded to the most recently used rows.
+
+    The file can be shared by processes; each thread uses its own connection.
+    The file is opened on first use, not when the store is created.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_rows: int = EMBEDDING_CACHE_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        # connections must not be carried over a fork
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings"
+                " (key TEXT PRIMARY KEY, vector BLOB NOT NULL, used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_used ON embeddings (used)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT vector FROM embeddings WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute(
+            "UPDATE embeddings SET used = ? WHERE key = ?", (time.time(), key)
+        )
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector, used) VALUES (?, ?, ?)",
+            (key, vector.astype(np.float32).tobytes(), time.time()),
+        )
+        self._writes += 1
+        # checking the row count on every write is not worth it
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used rows beyond the bound"""
+        connection = self._connection()
+        (rows,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if rows > self.max_rows:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                (rows - self.max_rows,),
+            )
+
+
+class EmbeddingCache:
+    """Looks embeddings up in memory, then sqlite, then Redis, before creating them.
+
+    Args:
+        store: The sqlite store, or None for none.
+        redis_client: A Redis client, or None for none.
+        memory_size: The number of vectors kept in process.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SqliteStore] = None,
+        redis_client=None,
+        memory_size: int = EMBEDDING_MEMORY_SIZE,
+        redis_ttl: int = EMBEDDING_REDIS_TTL,
+    ) -> None:
+        self.store = store
+        self.redis = redis_client
+        self.memory_size = memory_size
+        self.redis_ttl = redis_ttl
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "errors": 0,
+        }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return a cached vector, or None"""
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return vector
+
+        try:
+            vector = self.store.get(key) if self.store is not None else None
+            if vector is not None:
+                self._count("disk_hits")
+                self._remember(key, vector)
+                return vector
+            raw = self.redis.get(REDIS_PREFIX + key) if self.redis is not None else None
+            if raw is not None:
+                self._count("redis_hits")
+                vector = np.frombuffer(raw, dtype=np.float32)
+                self._remember(key, vector)
+                if self.store is not None:
+                    self.store.put(key, vector)
+                return vector
+        except Exception as e:
+            self._count("errors")
+            print("Embedding cache read failed", e)
+        self._count("misses")
+        return None
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        """Store a vector in every tier"""
+        self._remember(key, vector)
+        try:
+            if self.store is not None:
+                self.store.put(key, vector)
+            if self.redis is not None:
+                self.redis.set(REDIS_PREFIX + key, vector.tobytes(), ex=self.redis_ttl)
+        except Exception as e:
+            self._count("errors")
+            print("Embedding cache write failed", e)
+
+    def get_or_create(
+        self,
+        text: str,
+        create: Callable[[str], List[float]],
+        model: str = EMBEDDING_MODEL,
+    ) -> List[float]:
+        """Return the embedding of a text, creating it only if it is not cached
+
+        Args:
+            text (str): The text to embed
+            create (Callable): Creates the embedding of the normalized text
+            model (str): The embedding model
+
+        Returns:
+            list: The embedding
+        """
+        key = embedding_key(text, model)
+        vector = self.get(key)
+        if vector is None:
+            vector = np.asarray(create(normalize(text)), dtype=np.float32)
+            self.put(key, vector)
+        return vector.tolist()
+
+    async def aget_or_create(
+        self,
+        text: str,
+        create: Callable[[str], Awaitable[List[float]]],
+        model: str = EMBEDDING_MODEL,
+    ) -> List[float]:
+        """Return the embedding of a text like get_or_create, created asynchronously"""
+        key = embedding_key(text, model)
+        vector = self.get(key)
+        if vector is None:
+            vector = np.asarray(await create(normalize(text)), dtype=np.float32)
+            self.put(key, vector)
+        return vector.tolist()
+
+    def get_many_or_create(
+        self,
+        texts: List[str],
+        create_many: Callable[[List[str]], List[List[float]]],
+        model: str = EMBEDDING_MODEL,
+    ) -> List[List[float]]:
+        """Return the embeddings of texts, creating the missing ones in one call
+
+        Args:
+            texts (list): The texts to embed
+            create_many (Callable): Creates the embeddings of normalized texts,
+                in order
+            model (str): The embedding model
+
+        Returns:
+            list: The embeddings, in the order of the texts
+        """
+        keys, vectors, missing = self._lookup_many(texts, model)
+        if missing:
+            self._store_many(vectors, missing, create_many(list(missing.values())))
+        return [vectors[key].tolist() for key in keys]
+
+    async def aget_many_or_create(
+        self,
+        texts: List[str],
+        create_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+        model: str = EMBEDDING_MODEL,
+    ) -> List[List[float]]:
+        """Return the embeddings of texts like get_many_or_create, asynchronously"""
+        keys, vectors, missing = self._lookup_many(texts, model)
+        if missing:
+            created = await create_many(list(missing.values()))
+            self._store_many(vectors, missing, created)
+        return [vectors[key].tolist() for key in keys]
+
+    def _lookup_many(
+        self, texts: List[str], model: str
+    ) -> Tuple[List[str], Dict[str, np.ndarray], Dict[str, str]]:
+        keys = [embedding_key(text, model) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            # a text repeated in the batch is looked up and created once
+            if key in vectors or key in missing:
+                continue
+            vector = self.get(key)
+            if vector is None:
+                missing[key] = normalize(text)
+            else:
+                vectors[key] = vector
+        return keys, vectors, missing
+
+    def _store_many(
+        self,
+        vectors: Dict[str, np.ndarray],
+        missing: Dict[str, str],
+        created: List[List[float]],
+    ) -> None:
+        for key, embedding in zip(missing, created):
+            vectors[key] = np.asarray(embedding, dtype=np.float32)
+            self.put(key, vectors[key])
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hits per tier, misses and errors"""
+        with self._lock:
+            return {"memory_size": len(self._memory), **self.counters}
+
+
+def build_embedding_cache() -> EmbeddingCache:
+    """Build the cache from the environment
+
+    The sqlite store is disabled with an empty EMBEDDING_CACHE_PATH, and Redis is
+    used when EMBEDDING_CACHE_REDIS is True and a Redis host is configured.
+    """
+    store = SqliteStore() if EMBEDDING_CACHE_PATH else None
+    redis_client = None
+    if os.getenv("EMBEDDING_CACHE_REDIS", "False") == "True":
+        redis_client = build_redis_client()
+    return EmbeddingCache(store, redis_client)
+
+
+embedding_cache = build_embedding_cache()
@@ -0,0 +1,12 @@
+"""Detection of the gevent worker.
+
+Under the gevent gunicorn worker the standard library is patched, so code that
+runs its own event loop or blocks a native thread has to take another path.
+"""
+import sys
+
+
+def gevent_patched() -> bool:
+    """Whether the process runs on gevent, with the standard library patched"""
+    gevent_monkey = sys.modules.get("gevent.monkey")
+    return gevent_monkey is not None and gevent_monkey.is_module_patched("threading")
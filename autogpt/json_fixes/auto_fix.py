@@ -3,8 +3,10 @@ import json
 
 from autogpt.llm_utils import call_ai_function
 from autogpt.logs import logger
+from autogpt.metrics import call_site
 from autogpt.config import Config
 
+@call_site("fix_json")
 def fix_json(json_string: str, schema: str, cfg: Config) -> str:
     """Fix the given JSON string to make it parseable and fully compliant with
         the provided schema.
@@ -31,7 +33,7 @@ def fix_json(json_string: str, schema: str, cfg: Config) -> str:
     if not json_string.startswith("`"):
         json_string = "```json\n" + json_string + "\n```"
     result_string = call_ai_function(
-        function_string, args, description_string, model=cfg.fast_llm_model, cfg=cfg
+        function_string, args, description_string, cfg=cfg
     )
     logger.debug("------------ JSON FIX ATTEMPT ---------------")
     logger.debug(f"Original JSON: {json_string}")
@@ -0,0 +1,399 @@
+"""Where chat completions and embeddings are sent: OpenAI, a recording or a fake.
+
+Selected with LLM_BACKEND:
+
+- ``openai`` (default) calls the API.
+- ``record`` calls the API and appends every request and response to
+  LLM_RECORD_PATH.
+- ``replay`` answers from a recording, by request hash, after
+  LLM_BACKEND_LATENCY seconds (or the recorded duration with ``recorded``).
+- ``synthetic`` answers deterministically without a recording: unit vectors
+  seeded by the text for embeddings, and for chat replies what the call site
+  expects, e.g. a valid agent reply in the prompt's JSON format for
+  ``chat_with_ai`` and ``fix_json``.
+
+Replay and synthetic make no network calls, so the agent loop and ``/api`` can
+be benchmarked offline and repeatably.
+
+Every backend also has async counterparts, ``achat_completion`` and
+``aembedding``; streamed completions are then async iterators.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import numpy as np
+import openai
+from openai.util import convert_to_openai_object
+
+from autogpt.llm_cache import cache_key
+from autogpt.metrics import current_call_site
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH", "llm_recording.jsonl")
+# seconds a replayed or synthetic response takes, or "recorded" on replay
+LLM_BACKEND_LATENCY = os.getenv("LLM_BACKEND_LATENCY", "0")
+# "error" or "synthetic": what replay does with a request it has no recording of
+LLM_REPLAY_MISS = os.getenv("LLM_REPLAY_MISS", "error")
+LLM_SYNTHETIC_COMMAND = os.getenv("LLM_SYNTHETIC_COMMAND", "do_nothing")
+EMBED_DIM = 1536
+STREAM_PIECE = 16
+
+
+class ReplayMiss(Exception):
+    """The recording has no response to a request."""
+
+
+def request_key(kind: str, request: Dict[str, Any]) -> str:
+    """Return the hash a request is recorded and replayed by
+
+    Credentials, timeouts and streaming do not change the key.
+    """
+    if kind == "chat":
+        return cache_key(
+            request["model"],
+            request["messages"],
+            request.get("temperature"),
+            request.get("max_tokens"),
+        )
+    model = request.get("model") or request.get("engine")
+    canonical = json.dumps(
+        {"model": model, "input": request["input"]},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def completion_content(response) -> str:
+    return response["choices"][0]["message"]["content"]
+
+
+def completion(content: str, usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Return a chat completion response with some content"""
+    return {
+        "object": "chat.completion",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": usage,
+    }
+
+
+def stream_chunks(content: str) -> Iterator[Any]:
+    """Yield a response content as the chunks of a streamed completion"""
+    for start in range(0, len(content), STREAM_PIECE):
+        piece = content[start : start + STREAM_PIECE]
+        yield convert_to_openai_object(
+            {"choices": [{"index": 0, "delta": {"content": piece}}]}
+        )
+    yield convert_to_openai_object(
+        {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    )
+
+
+async def astream_chunks(content: str) -> AsyncIterator[Any]:
+    """Yield a response content as the chunks of a streamed completion, async"""
+    for chunk in stream_chunks(content):
+        yield chunk
+
+
+class OpenAIBackend:
+    """Sends requests to the OpenAI API."""
+
+    name = "openai"
+    remote = True
+
+    def chat_completion(self, **request):
+        return openai.ChatCompletion.create(**request)
+
+    def embedding(self, **request):
+        return openai.Embedding.create(**request)
+
+    async def achat_completion(self, **request):
+        return await openai.ChatCompletion.acreate(**request)
+
+    async def aembedding(self, **request):
+        return await openai.Embedding.acreate(**request)
+
+
+class RecordingBackend:
+    """Sends requests to another backend and appends them to a JSONL file.
+
+    Streamed completions are recorded once the stream ends, as the complete
+    response.
+    """
+
+    name = "record"
+    remote = True
+
+    def __init__(self, inner, path: str = LLM_RECORD_PATH) -> None:
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(
+        self, kind: str, request: Dict[str, Any], response, seconds: float
+    ) -> None:
+        entry = {
+            "key": request_key(kind, request),
+            "kind": kind,
+            "call_site": current_call_site(),
+            "model": request.get("model"),
+            "seconds": round(seconds, 4),
+            "response": response,
+        }
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def chat_completion(self, **request):
+        t0 = time.time()
+        response = self.inner.chat_completion(**request)
+        if request.get("stream"):
+            return self._record_stream(request, response, t0)
+        self._write("chat", request, response.to_dict_recursive(), time.time() - t0)
+        return response
+
+    def _record_stream(self, request, response, t0: float):
+        pieces = []
+        for chunk in response:
+            pieces.append(chunk.choices[0].delta.get("content") or "")
+            yield chunk
+        self._write("chat", request, completion("".join(pieces)), time.time() - t0)
+
+    def embedding(self, **request):
+        t0 = time.time()
+        response = self.inner.embedding(**request)
+        seconds = time.time() - t0
+        self._write("embedding", request, response.to_dict_recursive(), seconds)
+        return response
+
+    async def achat_completion(self, **request):
+        t0 = time.time()
+        response = await self.inner.achat_completion(**request)
+        if request.get("stream"):
+            return self._arecord_stream(request, response, t0)
+        self._write("chat", request, response.to_dict_recursive(), time.time() - t0)
+        return response
+
+    async def _arecord_stream(self, request, response, t0: float):
+        pieces = []
+        async for chunk in response:
+            pieces.append(chunk.choices[0].delta.get("content") or "")
+            yield chunk
+        self._write("chat", request, completion("".join(pieces)), time.time() - t0)
+
+    async def aembedding(self, **request):
+        t0 = time.time()
+        response = await self.inner.aembedding(**request)
+        seconds = time.time() - t0
+        self._write("embedding", request, response.to_dict_recursive(), seconds)
+        return response
+
+
+class SyntheticBackend:
+    """Answers every request deterministically, without a network call.
+
+    Args:
+        latency: The seconds every response takes.
+        command: The command of the synthetic agent replies.
+    """
+
+    name = "synthetic"
+    remote = False
+
+    def __init__(
+        self, latency: float = 0, command: str = LLM_SYNTHETIC_COMMAND
+    ) -> None:
+        self.latency = latency
+        self.command = command
+
+    def reply(self, request: Dict[str, Any]) -> str:
+        """Return the reply the call site of a chat request expects"""
+        digest = request_key("chat", request)[:8]
+        site = current_call_site()
+        if site in ("chat_with_ai", "fix_json"):
+            return json.dumps(
+                {
+                    "thoughts": {
+                        "text": f"Synthetic thought {digest}",
+                        "reasoning": "Synthetic reasoning",
+                        "plan": "- synthetic\n- plan",
+                        "criticism": "Synthetic criticism",
+                        "speak": f"Synthetic thought {digest}",
+                        "relevant_goal": 1,
+                    },
+                    "command": {"name": self.command, "args": {}},
+                }
+            )
+        if site == "subgoals":
+            return "\n".join(f"{i}. Synthetic subtask {digest}-{i}" for i in (1, 2, 3))
+        if site == "task_name":
+            return f"Synthetic task {digest}."
+        return f"Synthetic reply {digest}."
+
+    def _completion(self, request: Dict[str, Any], content: str):
+        prompt_tokens = sum(len(m["content"]) for m in request["messages"]) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+        }
+        return convert_to_openai_object(completion(content, usage))
+
+    def chat_completion(self, **request):
+        content = self.reply(request)
+        time.sleep(self.latency)
+        if request.get("stream"):
+            return stream_chunks(content)
+        return self._completion(request, content)
+
+    async def achat_completion(self, **request):
+        content = self.reply(request)
+        await asyncio.sleep(self.latency)
+        if request.get("stream"):
+            return astream_chunks(content)
+        return self._completion(request, content)
+
+    def _embedding(self, request: Dict[str, Any]):
+        data = []
+        for index, text in enumerate(request["input"]):
+            seed = int(hashlib.sha256(text.encode()).hexdigest()[:16], 16)
+            vector = np.random.default_rng(seed).standard_normal(EMBED_DIM)
+            vector /= np.linalg.norm(vector)
+            embedding = vector.astype(np.float32).tolist()
+            data.append({"index": index, "embedding": embedding})
+        tokens = sum(len(text) for text in request["input"]) // 4
+        return convert_to_openai_object(
+            {"data": data, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+        )
+
+    def embedding(self, **request):
+        response = self._embedding(request)
+        time.sleep(self.latency)
+        return response
+
+    async def aembedding(self, **request):
+        response = self._embedding(request)
+        await asyncio.sleep(self.latency)
+        return response
+
+
+class ReplayBackend:
+    """Answers requests from a recording.
+
+    Args:
+        path: The recording, as written by RecordingBackend.
+        latency: The seconds every response takes, or None for the recorded
+            duration.
+        fallback: Answers the requests that were not recorded; they raise
+            ReplayMiss without one.
+    """
+
+    name = "replay"
+    remote = False
+
+    def __init__(
+        self,
+        path: str = LLM_RECORD_PATH,
+        latency: Optional[float] = 0,
+        fallback: Optional[SyntheticBackend] = None,
+    ) -> None:
+        self.latency = latency
+        self.fallback = fallback
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, kind: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(request_key(kind, request))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None and self.fallback is None:
+            model = request.get("model")
+            raise ReplayMiss(f"No recorded {kind} response from {model}")
+        return entry
+
+    def _delay(self, entry: Dict[str, Any]) -> float:
+        return entry["seconds"] if self.latency is None else self.latency
+
+    def chat_completion(self, **request):
+        entry = self._lookup("chat", request)
+        if entry is None:
+            return self.fallback.chat_completion(**request)
+        time.sleep(self._delay(entry))
+        if request.get("stream"):
+            return stream_chunks(completion_content(entry["response"]))
+        return convert_to_openai_object(entry["response"])
+
+    def embedding(self, **request):
+        entry = self._lookup("embedding", request)
+        if entry is None:
+            return self.fallback.embedding(**request)
+        time.sleep(self._delay(entry))
+        return convert_to_openai_object(entry["response"])
+
+    async def achat_completion(self, **request):
+        entry = self._lookup("chat", request)
+        if entry is None:
+            return await self.fallback.achat_completion(**request)
+        await asyncio.sleep(self._delay(entry))
+        if request.get("stream"):
+            return astream_chunks(completion_content(entry["response"]))
+        return convert_to_openai_object(entry["response"])
+
+    async def aembedding(self, **request):
+        entry = self._lookup("embedding", request)
+        if entry is None:
+            return await self.fallback.aembedding(**request)
+        await asyncio.sleep(self._delay(entry))
+        return convert_to_openai_object(entry["response"])
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of recorded responses, hits and misses"""
+        with self._lock:
+            return {
+                "recorded": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def build_backend(name: str = LLM_BACKEND) -> Any:
+    """Build the backend selected by LLM_BACKEND"""
+    recorded = LLM_BACKEND_LATENCY == "recorded"
+    latency = 0.0 if recorded else float(LLM_BACKEND_LATENCY)
+    if name == "openai":
+        return OpenAIBackend()
+    if name == "record":
+        return RecordingBackend(OpenAIBackend())
+    if name == "replay":
+        fallback = SyntheticBackend(latency) if LLM_REPLAY_MISS == "synthetic" else None
+        return ReplayBackend(latency=None if recorded else latency, fallback=fallback)
+    if name == "synthetic":
+        return SyntheticBackend(latency)
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+backend = build_backend()
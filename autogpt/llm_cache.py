@@ -0,0 +1,259 @@
+"""Cache of chat completions for calls that are pure functions of their input.
+
+Call sites opt in with ``create_chat_completion(..., cache=True)``. Completions
+are keyed on a canonical hash of the model, messages, temperature and max
+tokens, not on the API key, so identical requests from any user or worker cost
+one model call. Lookups go through the tiers in order (in-process LRU, Redis,
+disk) and a hit in a slower tier is copied into the faster ones.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from autogpt.config import Config
+
+LLM_CACHE_TIERS = os.getenv("LLM_CACHE_TIERS", "memory,redis")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 10000))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "/tmp/godmode-llm-cache")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# seconds to connect to and wait on the Redis of the caches, so an unreachable
+# Redis costs a cache miss rather than stalling the call
+LLM_CACHE_REDIS_TIMEOUT = float(os.getenv("LLM_CACHE_REDIS_TIMEOUT", 0.5))
+REDIS_PREFIX = "llm-cache:"
+
+
+def cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+) -> str:
+    """Return the canonical hash of a chat completion request"""
+    request = {
+        "model": model,
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class MemoryTier:
+    """In-process LRU of completions, bounded by entries and age."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, ttl: int = LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class RedisTier:
+    """Completions shared by all workers, expired by Redis."""
+
+    name = "redis"
+
+    def __init__(self, client, ttl: int = LLM_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(REDIS_PREFIX + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def put(self, key: str, value: str) -> None:
+        self.client.set(REDIS_PREFIX + key, value, ex=self.ttl)
+
+
+class DiskTier:
+    """Completions kept in files, bounded by total size and age."""
+
+    name = "disk"
+
+    def __init__(
+        self,
+        directory: str = LLM_CACHE_DIR,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        ttl: int = LLM_CACHE_TTL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._files())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _files(self) -> List[Tuple[float, str, int]]:
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return sorted(files)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, so readers never see a partial file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(value.encode())
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        files = self._files()
+        self._size = sum(size for _, _, size in files)
+        # down to 90% so every put does not rescan
+        while files and self._size > self.max_bytes * 0.9:
+            _, path, size = files.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+class CompletionCache:
+    """Looks completions up through tiers, fastest first, and counts hits.
+
+    Args:
+        tiers: The tiers, fastest first. A failing tier is treated as a miss.
+    """
+
+    def __init__(self, tiers: List[Any]) -> None:
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"misses": 0, "errors": 0}
+        for tier in tiers:
+            self.counters[f"{tier.name}_hits"] = 0
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached completion, or None"""
+        for index, tier in enumerate(self.tiers):
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                self._count("errors")
+                print("Completion cache read failed", tier.name, e)
+                continue
+            if value is not None:
+                self._count(f"{tier.name}_hits")
+                for faster in self.tiers[:index]:
+                    self._put(faster, key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def _put(self, tier, key: str, value: str) -> None:
+        try:
+            tier.put(key, value)
+        except Exception as e:
+            self._count("errors")
+            print("Completion cache write failed", tier.name, e)
+
+    def put(self, key: str, value: str) -> None:
+        """Store a completion in every tier"""
+        for tier in self.tiers:
+            self._put(tier, key, value)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hits per tier, misses and tier errors"""
+        with self._lock:
+            return dict(self.counters)
+
+
+def build_redis_client(timeout: float = LLM_CACHE_REDIS_TIMEOUT):
+    """Return a client of the configured Redis for a cache, or None without one
+
+    Args:
+        timeout (float): The seconds to connect and to wait for a reply
+    """
+    cfg = Config()
+    if not cfg.redis_host:
+        return None
+    import redis
+
+    return redis.Redis(
+        host=cfg.redis_host,
+        port=int(cfg.redis_port),
+        password=cfg.redis_password,
+        socket_timeout=timeout,
+        socket_connect_timeout=timeout,
+    )
+
+
+def build_completion_cache(tiers: str = LLM_CACHE_TIERS) -> CompletionCache:
+    """Build the cache from a comma separated list of tiers
+
+    The Redis tier is skipped when no Redis host is configured.
+    """
+    built: List[Any] = []
+    for name in [t.strip() for t in tiers.split(",") if t.strip()]:
+        if name == "memory":
+            built.append(MemoryTier())
+        elif name == "redis":
+            redis_client = build_redis_client()
+            if redis_client is not None:
+                built.append(RedisTier(redis_client))
+        elif name == "disk":
+            built.append(DiskTier())
+        else:
+            raise ValueError(f"Unknown completion cache tier: {name}")
+    return CompletionCache(built)
+
+
+completion_cache = build_completion_cache()
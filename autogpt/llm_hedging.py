@@ -0,0 +1,235 @@
+"""Hedged chat completions: a second request when the first one is slow.
+
+Opt-in per call site with LLM_HEDGE_SITES, e.g. ``chat_with_ai``. When a
+completion has not answered after the LLM_HEDGE_PERCENTILE of the recent latency
+of its model (and at least LLM_HEDGE_MIN_DELAY seconds), the same request is
+sent to the next model or deployment the router planned, or to the same one if
+there is no other. The first response wins and the other is discarded: a
+streamed one is closed, a complete one can no longer be stopped and its tokens
+are counted as the cost of hedging, and charged to the usage of the caller.
+Async calls (``Hedger.acall``) cancel the
+losing request instead.
+
+Hedging at the p95 fires a duplicate for about 5% of the calls and cuts the
+tail of the latency to about the p95 plus the latency of the hedge.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from autogpt.metrics import observe_hedge
+from autogpt.model_router import ModelRouter, Route, model_router
+from autogpt.usage import UsageLedger, current_ledger, record_usage
+
+# the call sites whose chat completions are hedged, comma separated
+LLM_HEDGE_SITES = os.getenv("LLM_HEDGE_SITES", "")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 2))
+# threads running the hedged requests and their duplicates
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", 64))
+
+
+def response_tokens(response: Any, estimate: int) -> int:
+    """Return the tokens a response used, or the estimate if it has no usage"""
+    usage = response.get("usage") if hasattr(response, "get") else None
+    return (usage or {}).get("total_tokens", estimate)
+
+
+class Hedger:
+    """Sends a duplicate of the slow chat completions of some call sites.
+
+    Args:
+        router: Plans the routes and knows their recent latency.
+        sites: The call sites that are hedged.
+        percentile: The percentile of the recent latency after which a call
+            is hedged.
+        min_delay: The minimum seconds before a call is hedged.
+        workers: The threads running hedged calls.
+    """
+
+    def __init__(
+        self,
+        router: ModelRouter,
+        sites: Set[str],
+        percentile: float = LLM_HEDGE_PERCENTILE,
+        min_delay: float = LLM_HEDGE_MIN_DELAY,
+        workers: int = LLM_HEDGE_WORKERS,
+    ) -> None:
+        self.router = router
+        self.sites = sites
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "extra_tokens": 0,
+        }
+
+    def delay(self, route: Route) -> Optional[float]:
+        """Return the seconds after which a call to a route is hedged
+
+        None until the route has enough recent calls to know its latency.
+        """
+        latency = self.router.latency(route, self.percentile)
+        return None if latency is None else max(self.min_delay, latency)
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="llm-hedge"
+                )
+            executor = self._executor
+        # the call site and latency budget go with the request
+        return executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def call(
+        self,
+        site: str,
+        routes: List[Route],
+        call: Callable[[List[Route]], Tuple[Route, Any]],
+        tokens: int,
+    ) -> Tuple[Route, Any]:
+        """Make a call, and a duplicate of it if it is slow
+
+        Args:
+            site (str): The call site
+            routes (list): The routes, as planned
+            call (Callable): Makes the call on some routes, failing over
+                between them, and returns the route that answered and its
+                response
+            tokens (int): The estimated tokens of the call, counted for a
+                discarded response without usage
+
+        Returns:
+            tuple: The route that answered first and its response
+        """
+        delay = self.delay(routes[0]) if site in self.sites else None
+        if delay is None:
+            return call(routes)
+        with self._lock:
+            self.counters["calls"] += 1
+        # the loser may finish after the caller moved on to another ledger
+        ledger = current_ledger()
+        primary = self._submit(call, routes)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+
+        hedge = self._submit(call, routes[1:] or routes)
+        with self._lock:
+            self.counters["hedged"] += 1
+        print(f"HEDGING AFTER {delay:.2f} SECONDS", routes[0].name)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    continue
+                loser = hedge if future is primary else primary
+                won = future is hedge
+                loser.add_done_callback(
+                    lambda f: self._discard(
+                        f, site, routes[0].model, won, tokens, ledger
+                    )
+                )
+                if won:
+                    with self._lock:
+                        self.counters["hedge_wins"] += 1
+                return future.result()
+        # both failed: raise the error of the original request
+        return primary.result()
+
+    async def acall(
+        self,
+        site: str,
+        routes: List[Route],
+        call: Callable[[List[Route]], Awaitable[Tuple[Route, Any]]],
+        tokens: int,
+    ) -> Tuple[Route, Any]:
+        """Make an async call, and a duplicate of it if it is slow, like call
+
+        The request that loses is cancelled, so it costs no tokens beyond
+        what the provider counted before the connection was closed.
+        """
+        delay = self.delay(routes[0]) if site in self.sites else None
+        if delay is None:
+            return await call(routes)
+        with self._lock:
+            self.counters["calls"] += 1
+        primary = asyncio.ensure_future(call(routes))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge = asyncio.ensure_future(call(routes[1:] or routes))
+            tasks.append(hedge)
+            with self._lock:
+                self.counters["hedged"] += 1
+            print(f"HEDGING AFTER {delay:.2f} SECONDS", routes[0].name)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    won = task is hedge
+                    if won:
+                        with self._lock:
+                            self.counters["hedge_wins"] += 1
+                    observe_hedge(routes[0].model, site, won, 0)
+                    return task.result()
+            # both failed: raise the error of the original request
+            return primary.result()
+        finally:
+            # the loser, or both when the caller is cancelled
+            for task in tasks:
+                task.cancel()
+
+    def _discard(
+        self,
+        future: Future,
+        site: str,
+        model: str,
+        won: bool,
+        tokens: int,
+        ledger: Optional[UsageLedger],
+    ) -> None:
+        extra = 0
+        if future.exception() is None:
+            route, response = future.result()
+            extra = response_tokens(response, tokens)
+            # a streamed response is closed instead of read
+            if hasattr(response, "close"):
+                response.close()
+            usage = response.get("usage") if hasattr(response, "get") else None
+            record_usage(route.model, usage, tokens, ledger=ledger)
+        with self._lock:
+            self.counters["extra_tokens"] += extra
+        observe_hedge(model, site, won, extra)
+
+    def stats(self) -> Dict[str, float]:
+        """Return the hedged calls, hedges, hedges that won and tokens discarded"""
+        with self._lock:
+            return dict(self.counters)
+
+
+hedger = Hedger(
+    model_router, {site.strip() for site in LLM_HEDGE_SITES.split(",") if site.strip()}
+)
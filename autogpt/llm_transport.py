@@ -0,0 +1,333 @@
+"""Pooled HTTP sessions and explicit credentials for OpenAI calls.
+
+The openai SDK keeps one ``requests.Session`` per thread, so every new thread
+(e.g. one per streamed request) pays a new TLS handshake, and it reads the API
+key from the ``openai.api_key`` global, which the server shares between
+requests. Calls made through this module pass their credentials explicitly and
+use a keep-alive session shared by all threads, one per API key and endpoint.
+
+The async calls (``acreate``) share an aiohttp session per event loop instead,
+set up with ``async_http_session``. Synchronous code runs them on ``loop_thread``,
+an event loop kept on a thread of its own with one session for the process.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Optional,
+    TypeVar,
+)
+
+import aiohttp
+import openai
+import requests
+from openai import api_requestor
+
+from autogpt.green import gevent_patched
+
+LLM_POOL_SESSIONS = int(os.getenv("LLM_POOL_SESSIONS", 256))
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", 64))
+# seconds an OpenAI call may take; a call failed over to two more models still
+# fits in the default STEP_DEADLINE (autogpt/step_pipeline.py)
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 90))
+
+T = TypeVar("T")
+
+
+class Credentials(NamedTuple):
+    """Where and as whom an OpenAI call is made."""
+
+    api_key: Optional[str]
+    api_base: str
+    api_type: str
+    api_version: Optional[str]
+
+    def as_kwargs(self) -> Dict[str, Any]:
+        """The keyword arguments passing these credentials to an openai call"""
+        return self._asdict()
+
+    def is_server_key(self) -> bool:
+        """Whether the call is made with the server's own API key, not a user's"""
+        return not self.api_key or self.api_key == openai.api_key
+
+    def fingerprint(self) -> str:
+        """Identifies the key and endpoint, hashed so logs and keys never show it"""
+        return hashlib.sha256(
+            f"{self.api_key or ''}@{self.api_base}".encode()
+        ).hexdigest()[:32]
+
+
+def credentials_for(cfg) -> Credentials:
+    """Return the credentials of a config, OpenAI or Azure"""
+    if cfg.use_azure:
+        return Credentials(
+            cfg.openai_api_key,
+            cfg.openai_api_base,
+            cfg.openai_api_type,
+            cfg.openai_api_version,
+        )
+    return Credentials(cfg.openai_api_key, openai.api_base, "open_ai", None)
+
+
+class SessionPool:
+    """Keep-alive HTTP sessions, one per API key and endpoint, shared by all threads.
+
+    Args:
+        max_sessions: The maximum number of sessions; the least recently used is
+            closed beyond that.
+        pool_maxsize: The maximum number of connections kept open per session.
+    """
+
+    def __init__(
+        self, max_sessions: int = LLM_POOL_SESSIONS, pool_maxsize: int = LLM_POOL_MAXSIZE
+    ) -> None:
+        self.max_sessions = max_sessions
+        self.pool_maxsize = pool_maxsize
+        self._sessions: OrderedDict[tuple, requests.Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.evictions = 0
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=self.pool_maxsize,
+            max_retries=api_requestor.MAX_CONNECTION_RETRIES,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, credentials: Credentials) -> requests.Session:
+        """Return the session of some credentials, creating it if needed"""
+        # the key is hashed so stats and debugging never show it
+        key = (
+            hashlib.sha256((credentials.api_key or "").encode()).hexdigest(),
+            credentials.api_base,
+        )
+        with self._lock:
+            self.calls += 1
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session()
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+                self.evictions += 1
+            return session
+
+    @contextlib.contextmanager
+    def use(self, credentials: Credentials) -> Iterator[requests.Session]:
+        """Make the openai calls of this thread use the pooled session
+
+        openai 0.27 has no parameter for the session, it takes the one it keeps
+        per thread, so the pooled session is swapped in for the duration.
+        """
+        session = self.get(credentials)
+        context = api_requestor._thread_context
+        previous = getattr(context, "session", None)
+        context.session = session
+        try:
+            yield session
+        finally:
+            if previous is None:
+                del context.session
+            else:
+                context.session = previous
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of sessions, calls, connections opened and requests sent
+
+        Requests per connection above 1 means connections were reused.
+        """
+        connections = requests_sent = 0
+        with self._lock:
+            sessions = list(self._sessions.values())
+            stats = {
+                "sessions": len(sessions),
+                "calls": self.calls,
+                "evictions": self.evictions,
+            }
+        for session in sessions:
+            # the same adapter is mounted for http and https
+            for adapter in {id(a): a for a in session.adapters.values()}.values():
+                for pool in list(adapter.poolmanager.pools._container.values()):
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+        return {**stats, "connections": connections, "requests": requests_sent}
+
+
+session_pool = SessionPool()
+
+
+@contextlib.contextmanager
+def openai_call(cfg) -> Iterator[Dict[str, Any]]:
+    """Set up an openai call for a config
+
+    Yields:
+        dict: The credentials to pass to the openai call
+    """
+    credentials = credentials_for(cfg)
+    with session_pool.use(credentials):
+        yield credentials.as_kwargs()
+
+
+@contextlib.asynccontextmanager
+async def async_http_session() -> AsyncIterator[aiohttp.ClientSession]:
+    """Make the async openai calls of a block share one keep-alive session
+
+    Without it openai 0.27 opens a new session, and connection, per call. The
+    session belongs to the running event loop and is closed with the block.
+    """
+    if openai.aiosession.get() is not None:
+        yield openai.aiosession.get()
+        return
+    connector = aiohttp.TCPConnector(limit=LLM_POOL_MAXSIZE)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
+
+
+def _result(future: concurrent.futures.Future, timeout: Optional[float] = None) -> Any:
+    """Wait for the result of a future set on another thread
+
+    Under gevent the waiting greenlet yields to the others, woken by the hub.
+
+    Raises:
+        concurrent.futures.TimeoutError: If the timeout passed
+    """
+    if not gevent_patched():
+        return future.result(timeout)
+    import gevent
+    import gevent.event
+
+    # a cross-thread wake-up the hub keeps waiting for, unlike a lock's
+    watcher = gevent.get_hub().loop.async_()
+    done = gevent.event.Event()
+    watcher.start(done.set)
+    future.add_done_callback(lambda _: watcher.send())
+    try:
+        done.wait(timeout)
+        return future.result(0)
+    finally:
+        watcher.stop()
+
+
+class LoopThread:
+    """An event loop on a thread of its own, for the async calls of sync code.
+
+    The loop and its keep-alive aiohttp session are started on first use and
+    kept for the life of the process, so each gunicorn worker has its own after
+    the fork. Under gevent the loop runs on a native thread, as it cannot run
+    on a greenlet.
+
+    Args:
+        pool_maxsize: The maximum number of connections the session keeps open.
+    """
+
+    def __init__(self, pool_maxsize: int = LLM_POOL_MAXSIZE) -> None:
+        self.pool_maxsize = pool_maxsize
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        # only used on the loop
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # a loop and its thread do not survive a fork
+            if self._loop is None or self._pid != os.getpid():
+                started: concurrent.futures.Future = concurrent.futures.Future()
+                if gevent_patched():
+                    from gevent import monkey
+
+                    # a native thread, not a greenlet
+                    start_new_thread = monkey.get_original(
+                        "_thread", "start_new_thread"
+                    )
+                    start_new_thread(self._run, (started,))
+                else:
+                    threading.Thread(
+                        target=self._run, args=(started,), name="llm-loop", daemon=True
+                    ).start()
+                self._loop, self._pid, self._session = _result(started), os.getpid(), None
+            return self._loop
+
+    @staticmethod
+    def _run(started: concurrent.futures.Future) -> None:
+        # created on its thread, as under gevent the selector of the loop waits
+        # on the hub of the thread creating it
+        loop = asyncio.new_event_loop()
+        if gevent_patched():
+            import gevent
+
+            # the hub gives up when it has nothing else to wait for
+            keepalive = gevent.get_hub().loop.timer(3600, 3600)
+            keepalive.start(lambda: None)
+        started.set_result(loop)
+        loop.run_forever()
+
+    def _use_session(self) -> None:
+        """Make the openai calls of the running task use the session of the loop"""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize)
+            self._session = aiohttp.ClientSession(connector=connector)
+        openai.aiosession.set(self._session)
+
+    def run(self, step: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Run a coroutine on the loop and wait for its result
+
+        The coroutine runs in a copy of the caller's context. It can be called
+        from any thread but the loop's own, including one running another event
+        loop, which is blocked meanwhile.
+
+        Args:
+            step (Awaitable): The coroutine
+            timeout (float, optional): The seconds it may take, after which it
+                is cancelled. Defaults to None, no timeout.
+
+        Raises:
+            asyncio.TimeoutError: If the timeout passed
+        """
+        loop = self._start()
+        if asyncio._get_running_loop() is loop:
+            raise RuntimeError("Cannot wait for the LLM event loop on itself")
+
+        async def main() -> T:
+            self._use_session()
+            return await asyncio.wait_for(step, timeout)
+
+        future = asyncio.run_coroutine_threadsafe(main(), loop)
+        try:
+            # the loop cancels the coroutine at the timeout, this only gives up
+            # on a loop that is blocked
+            return _result(future, None if timeout is None else timeout + 1)
+        except concurrent.futures.TimeoutError:
+            if future.done():
+                raise
+            future.cancel()
+            raise asyncio.TimeoutError() from None
+        except BaseException:
+            # e.g. the greenlet waiting was killed
+            future.cancel()
+            raise
+
+
+loop_thread = LoopThread()
@@ -1,35 +1,108 @@
 from __future__ import annotations
+import asyncio
+import math
+import os
 import time
-from typing import List, Dict, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
-import openai
 from openai.error import APIError, RateLimitError
 from colorama import Fore
 
-def call_ai_function(
-    function: str, args: List[str], description: str, cfg: object, model: str | None = None
-) -> str:
-    """Call an AI function
+from autogpt.embedding_cache import EMBEDDING_MODEL, embedding_cache, embedding_key
+from autogpt.llm_backend import backend
+from autogpt.llm_cache import cache_key, completion_cache
+from autogpt.llm_hedging import hedger
+from autogpt.llm_transport import (
+    LLM_REQUEST_TIMEOUT,
+    credentials_for,
+    loop_thread,
+    openai_call,
+)
+from autogpt.metrics import current_call_site, observe_request
+from autogpt.model_router import Route, model_router
+from autogpt.rate_limiter import estimate_tokens, rate_limiter
+from autogpt.singleflight import singleflight
+from autogpt.step_pipeline import phase_timeout
+from autogpt.token_counter import count_strings_tokens
+from autogpt.usage import calibration, record_usage
 
-    This is a magic function that can do anything with no-code. See
-    https://github.com/Torantulino/AI-Functions for more info.
+# the embeddings endpoint takes at most 2048 inputs per request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 2048))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 100000))
+
+T = TypeVar("T")
+
+
+class Completion(NamedTuple):
+    """A chat completion and the tokens it used"""
+
+    content: str
+    model: str
+    # as reported by OpenAI, or estimated for streamed completions (see
+    # autogpt.usage.record_usage); empty for cached completions
+    usage: Dict[str, Any]
+    cached: bool = False
+
+
+def _send(
+    api_key: Optional[str], model: str, tokens: int, create: Callable[[], T]
+) -> T:
+    """Make a request through the LLM backend, within the rate limits of OpenAI"""
+    if not backend.remote:
+        return create()
+    return rate_limiter.call(api_key, model, tokens, create)
+
+
+async def _asend(
+    api_key: Optional[str],
+    model: str,
+    tokens: int,
+    create: Callable[[], Awaitable[T]],
+) -> T:
+    """Make an async request through the LLM backend, within the rate limits"""
+    if not backend.remote:
+        return await create()
+    return await rate_limiter.acall(api_key, model, tokens, create)
+
+
+def run_sync(step: Awaitable[T], deadline: float | None = None) -> T:
+    """Run async LLM calls from synchronous code, on the event loop of the worker
+
+    The calls run on ``loop_thread`` and share its keep-alive HTTP session. Within
+    a step they are cancelled at the step deadline at the latest.
 
     Args:
-        function (str): The function to call
-        args (list): The arguments to pass to the function
-        description (str): The description of the function
-        model (str, optional): The model to use. Defaults to None.
+        step (Awaitable): The calls, e.g. a coroutine gathering them
+        deadline (float, optional): The seconds the calls may take, after which
+            they are cancelled. Defaults to None, no deadline.
 
-    Returns:
-        str: The response from the function
+    Raises:
+        asyncio.TimeoutError: If the deadline passed
     """
-    if model is None:
-        model = cfg.smart_llm_model
+    deadline = phase_timeout(math.inf if deadline is None else deadline)
+    return loop_thread.run(step, None if math.isinf(deadline) else deadline)
+
+
+def _ai_function_messages(
+    function: str, args: List[str], description: str
+) -> List[Dict[str, str]]:
     # For each arg, if any are None, convert to "None":
     args = [str(arg) if arg is not None else "None" for arg in args]
     # parse args to comma separated string
     sargs = ", ".join(args)
-    messages = [
+    return [
         {
             "role": "system",
             "content": f"You are now the following python function: ```# {description}"
@@ -38,7 +111,177 @@ def call_ai_function(
         {"role": "user", "content": sargs},
     ]
 
-    return create_chat_completion(model=model, messages=messages, temperature=0, cfg=cfg)
+
+def call_ai_function(
+    function: str, args: List[str], description: str, cfg: object, model: str | None = None
+) -> str:
+    """Call an AI function
+
+    This is a magic function that can do anything with no-code. See
+    https://github.com/Torantulino/AI-Functions for more info.
+
+    Args:
+        function (str): The function to call
+        args (list): The arguments to pass to the function
+        description (str): The description of the function
+        model (str, optional): The model to use. Defaults to None, routed by
+            the call site.
+
+    Returns:
+        str: The response from the function
+    """
+    messages = _ai_function_messages(function, args, description)
+    return create_chat_completion(
+        model=model, messages=messages, temperature=0, cfg=cfg, cache=True
+    )
+
+
+async def acall_ai_function(
+    function: str,
+    args: List[str],
+    description: str,
+    cfg: object,
+    model: str | None = None,
+    deadline: float | None = None,
+) -> str:
+    """Call an AI function like call_ai_function, asynchronously
+
+    Args:
+        deadline (float, optional): The seconds the call may take. Defaults to
+            None, no deadline.
+    """
+    messages = _ai_function_messages(function, args, description)
+    return await acreate_chat_completion(
+        model=model,
+        messages=messages,
+        temperature=0,
+        cfg=cfg,
+        cache=True,
+        deadline=deadline,
+    )
+
+
+class _ChatCall:
+    """The planning, caching and bookkeeping around a chat completion request,
+    shared by the sync and async API."""
+
+    def __init__(
+        self,
+        messages: List[Dict[str, str]],
+        cfg,
+        model: str | None,
+        temperature: float | None,
+        max_tokens: int | None,
+        stream: bool,
+        cache: bool,
+    ) -> None:
+        self.t0 = time.time()
+        self.cfg = cfg
+        self.messages = messages
+        self.temperature = cfg.temperature if temperature is None else temperature
+        self.max_tokens = max_tokens
+        self.stream = stream
+        texts = [m["content"] for m in messages]
+        self.prompt_estimate = estimate_tokens(texts)
+        self.site = current_call_site()
+        self.routes = model_router.plan(
+            cfg, model, self.site, self.prompt_estimate, max_tokens
+        )
+        self.model = self.routes[0].model
+        self.budget = model_router.budget(self.site)
+        # a rate limited call of a user's key does not fail over to another model
+        self.server_key = credentials_for(cfg).is_server_key()
+        # corrected by the prompt tokens OpenAI reported for the model so far
+        self.tokens = calibration.estimate(
+            "chars", self.model, self.prompt_estimate
+        ) + (max_tokens or 0)
+        self.key = None
+        if cache and not stream:
+            self.key = cache_key(self.model, messages, self.temperature, max_tokens)
+
+    def flight_key(self) -> str:
+        """Identifies identical requests made with the same credentials"""
+        return f"chat:{credentials_for(self.cfg).fingerprint()}:{self.key}"
+
+    def lookup(self) -> Optional[Completion]:
+        """Return the cached response, without recording it"""
+        cached = completion_cache.get(self.key) if self.key is not None else None
+        return None if cached is None else Completion(cached, self.model, {}, True)
+
+    def cached(self) -> Optional[Completion]:
+        """Return the cached response, if the call is cached"""
+        cached = self.lookup()
+        if cached is not None:
+            observe_request("chat", self.model, None, outcome="cached")
+            return cached
+        if self.cfg.debug_mode:
+            print(
+                Fore.GREEN
+                + f"Creating chat completion with model {self.model},"
+                f" temperature {self.temperature}, max_tokens {self.max_tokens}"
+                + Fore.RESET
+            )
+        return None
+
+    def request(self, route: Route, timeout: float) -> Dict[str, Any]:
+        """Return the request to a route, without credentials"""
+        request = dict(
+            model=route.model,
+            messages=self.messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=self.stream,
+            request_timeout=phase_timeout(timeout),
+        )
+        if route.deployment_id:
+            request["deployment_id"] = route.deployment_id
+        return request
+
+    def failed(self, e: Exception) -> None:
+        """Record a call that failed on every route"""
+        seconds = time.time() - self.t0
+        if isinstance(e, RateLimitError):
+            observe_request("chat", self.model, seconds, outcome="rate_limited")
+            print("RATE LIMIT ERROR", e)
+            if self.cfg.debug_mode:
+                print(
+                    Fore.RED + "Error: ",
+                    f"Reached rate limit, passing..." + Fore.RESET,
+                )
+            return
+        observe_request("chat", self.model, seconds, outcome="error")
+        if isinstance(e, APIError):
+            print("API ERROR", e)
+
+    def complete(self, route: Route, response) -> Completion:
+        """Record a complete response and return it"""
+        if response is None:
+            raise RuntimeError(f"Failed to get response from model {route.model}")
+        seconds = time.time() - self.t0
+        print(f"CHAT COMPLETION TOOK {seconds} SECONDS", route.model)
+        observe_request("chat", route.model, seconds, usage=response.get("usage"))
+        content = response.choices[0].message["content"]  # type: ignore
+        usage = record_usage(
+            route.model,
+            response.get("usage"),
+            self.prompt_estimate,
+            len(content) // 4,
+        )
+        if self.key is not None:
+            # after a failover the response is that of another model
+            key = cache_key(route.model, self.messages, self.temperature, self.max_tokens)
+            completion_cache.put(key, content)
+        return Completion(content, route.model, usage)
+
+    def coalesced(self, completion: Completion) -> Completion:
+        """Record the response of an identical request another caller made"""
+        observe_request("chat", completion.model, None, outcome="coalesced")
+        # its tokens were spent by the caller that made the request
+        return completion._replace(usage={}, cached=True)
+
+    def streamed(self, model: str, chars: int) -> None:
+        """Record the estimated usage of a streamed response"""
+        record_usage(model, None, self.prompt_estimate, chars // 4)
 
 
 # Overly simple abstraction until we create something better
@@ -46,90 +289,435 @@ def call_ai_function(
 def create_chat_completion(
     messages: List[Dict[str, str]],
     cfg,
-    model: str | None = "gpt-3.5-turbo",
+    model: str | None = None,
     temperature: float | None = None,
     max_tokens: int | None = None,
-) -> str:
+    stream: bool = False,
+    cache: bool = False,
+) -> str | Iterator[str]:
     """Create a chat completion using the OpenAI API
 
+    Without a model, the model is chosen by the model router from the call site,
+    the size of the prompt and the recent latency and errors of the models, and
+    the request fails over to the next model on timeouts. The call sites in
+    LLM_HEDGE_SITES send a duplicate request when a response is slow.
+
     Args:
         messages (list[dict[str, str]]): The messages to send to the chat completion
-        model (str, optional): The model to use. Defaults to None.
+        model (str, optional): The model to use. Defaults to None, routed.
         temperature (float, optional): The temperature to use. Defaults to 0.9.
         max_tokens (int, optional): The max tokens to use. Defaults to None.
+        stream (bool, optional): Yield the response in pieces as it is generated.
+            Defaults to False.
+        cache (bool, optional): Reuse the response to an identical earlier request.
+            Only for calls that are pure functions of their input. Ignored when
+            streaming. Defaults to False.
 
     Returns:
-        str: The response from the chat completion
+        str: The response from the chat completion, or an iterator over the
+            pieces of the response if stream is True
     """
-    if model is None:
-        model = cfg.fast_llm_model
-    t0 = time.time()
-    if temperature is None:
-        temperature = cfg.temperature
-    response = None
-    if cfg.debug_mode:
-        print(
-            Fore.GREEN
-            + f"Creating chat completion with model {model}, temperature {temperature},"
-            f" max_tokens {max_tokens}" + Fore.RESET
+    if not stream:
+        return create_chat_completion_with_usage(
+            messages, cfg, model, temperature, max_tokens, cache
+        ).content
+    call = _ChatCall(messages, cfg, model, temperature, max_tokens, True, False)
+    route, response = _chat(call)
+    return _stream_chat_completion(response, route.model, call)
+
+
+def create_chat_completion_with_usage(
+    messages: List[Dict[str, str]],
+    cfg,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    cache: bool = False,
+) -> Completion:
+    """Create a chat completion like create_chat_completion, with its usage
+
+    Returns:
+        Completion: The response, the model that answered it and the tokens
+            OpenAI reported for it
+    """
+    call = _ChatCall(messages, cfg, model, temperature, max_tokens, False, cache)
+    cached = call.cached()
+    if cached is not None:
+        return cached
+    if call.key is None:
+        return call.complete(*_chat(call))
+
+    # concurrent identical requests, within or across workers, share one call
+    led = []
+
+    def lead() -> Completion:
+        led.append(True)
+        return call.complete(*_chat(call))
+
+    completion = singleflight.do(call.flight_key(), lead, call.lookup)
+    return completion if led else call.coalesced(completion)
+
+
+def _chat(call: _ChatCall) -> Tuple[Route, Any]:
+    """Send a chat completion request on its routes"""
+
+    def attempt(route: Route, timeout: float):
+        request = call.request(route, timeout)
+        with openai_call(call.cfg) as credentials:
+            return _send(
+                credentials["api_key"],
+                route.model,
+                call.tokens,
+                lambda: backend.chat_completion(**request, **credentials),
+            )
+
+    try:
+        return hedger.call(
+            call.site,
+            call.routes,
+            lambda routes: model_router.call(
+                routes, attempt, call.budget, call.server_key
+            ),
+            call.tokens,
+        )
+    except Exception as e:
+        call.failed(e)
+        raise e
+
+
+async def acreate_chat_completion(
+    messages: List[Dict[str, str]],
+    cfg,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    stream: bool = False,
+    cache: bool = False,
+    deadline: float | None = None,
+) -> str | AsyncIterator[str]:
+    """Create a chat completion like create_chat_completion, asynchronously
+
+    The request runs on the event loop (aiohttp) and is cancelled with the task
+    awaiting it, or when the deadline passes.
+
+    Args:
+        deadline (float, optional): The seconds the call may take, until the
+            response starts when streaming. Defaults to None, no deadline.
+
+    Returns:
+        str: The response from the chat completion, or an async iterator over
+            the pieces of the response if stream is True
+
+    Raises:
+        asyncio.TimeoutError: If the deadline passed
+    """
+    if not stream:
+        completion = await acreate_chat_completion_with_usage(
+            messages, cfg, model, temperature, max_tokens, cache, deadline
+        )
+        return completion.content
+    call = _ChatCall(messages, cfg, model, temperature, max_tokens, True, False)
+    route, response = await _achat(call, deadline)
+    return _astream_chat_completion(response, route.model, call)
+
+
+async def acreate_chat_completion_with_usage(
+    messages: List[Dict[str, str]],
+    cfg,
+    model: str | None = None,
+    temperature: float | None = None,
+    max_tokens: int | None = None,
+    cache: bool = False,
+    deadline: float | None = None,
+) -> Completion:
+    """Create a chat completion like acreate_chat_completion, with its usage"""
+    call = _ChatCall(messages, cfg, model, temperature, max_tokens, False, cache)
+    cached = call.cached()
+    if cached is not None:
+        return cached
+    if call.key is None:
+        return call.complete(*await _achat(call, deadline))
+    led = []
+
+    async def lead() -> Completion:
+        led.append(True)
+        return call.complete(*await _achat(call, deadline))
+
+    completion = await singleflight.ado(call.flight_key(), lead, call.lookup)
+    return completion if led else call.coalesced(completion)
+
+
+async def _achat(call: _ChatCall, deadline: float | None) -> Tuple[Route, Any]:
+    """Send a chat completion request on its routes, asynchronously"""
+    credentials = credentials_for(call.cfg).as_kwargs()
+
+    async def attempt(route: Route, timeout: float):
+        request = call.request(route, timeout)
+        return await _asend(
+            credentials["api_key"],
+            route.model,
+            call.tokens,
+            lambda: backend.achat_completion(**request, **credentials),
         )
 
     try:
-        if cfg.use_azure:
-            response = openai.ChatCompletion.create(
-                deployment_id=cfg.get_azure_deployment_id_for_model(model), # type: ignore
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-            )
-        else:
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                api_key=cfg.openai_api_key,
-            )
-    except RateLimitError as e:
-        print("RATE LIMIT ERROR", e)
-        if cfg.debug_mode:
-            print(
-                Fore.RED + "Error: ",
-                f"Reached rate limit, passing..." + Fore.RESET,
-            )
+        return await asyncio.wait_for(
+            hedger.acall(
+                call.site,
+                call.routes,
+                lambda routes: model_router.acall(
+                    routes, attempt, call.budget, call.server_key
+                ),
+                call.tokens,
+            ),
+            deadline,
+        )
+    except Exception as e:
+        call.failed(e)
         raise e
-    except APIError as e:
-        print("API ERROR", e)
+
+
+def _stream_chat_completion(response, model: str, call: _ChatCall) -> Iterator[str]:
+    """Yield the content deltas of a streamed chat completion
+
+    Streamed responses carry no usage, so it is estimated from the prompt and
+    the content streamed, even when the stream is not read to its end.
+    """
+    chars = 0
+    try:
+        for chunk in response:
+            content = chunk.choices[0].delta.get("content")
+            if content:
+                chars += len(content)
+                yield content
+    except Exception as e:
+        observe_request("chat", model, time.time() - call.t0, outcome="error")
         raise e
-    
-    if response is None:
-        raise RuntimeError(f"Failed to get response from model {model}")
-    
-    print(f"CHAT COMPLETION TOOK {time.time() - t0} SECONDS", model)
+    finally:
+        call.streamed(model, chars)
+    print(f"CHAT COMPLETION TOOK {time.time() - call.t0} SECONDS", model)
+    observe_request("chat", model, time.time() - call.t0)
 
-    return response.choices[0].message["content"] # type: ignore
+
+async def _astream_chat_completion(
+    response, model: str, call: _ChatCall
+) -> AsyncIterator[str]:
+    """Yield the content deltas of a streamed chat completion, asynchronously"""
+    chars = 0
+    try:
+        async for chunk in response:
+            content = chunk.choices[0].delta.get("content")
+            if content:
+                chars += len(content)
+                yield content
+    except Exception as e:
+        observe_request("chat", model, time.time() - call.t0, outcome="error")
+        raise e
+    finally:
+        call.streamed(model, chars)
+    print(f"CHAT COMPLETION TOOK {time.time() - call.t0} SECONDS", model)
+    observe_request("chat", model, time.time() - call.t0)
 
 
 def create_embedding_with_ada(text: str, cfg: Config) -> Optional[List]:
-    """Create a embedding with text-ada-002 using the OpenAI SDK"""
+    """Create a embedding with text-ada-002 using the OpenAI SDK
+
+    Embeddings are cached by content, so the same text is only embedded once,
+    and concurrent requests for the same text share one call.
+    """
+    key = embedding_key(text)
+    return embedding_cache.get_or_create(
+        text,
+        lambda normalized: singleflight.do(
+            _embedding_flight_key(key, cfg),
+            lambda: _create_embedding(normalized, cfg),
+            lambda: _cached_embedding(key),
+        ),
+    )
+
+
+async def acreate_embedding_with_ada(
+    text: str, cfg: Config, deadline: float | None = None
+) -> List[float]:
+    """Create an embedding like create_embedding_with_ada, asynchronously
+
+    Args:
+        deadline (float, optional): The seconds the call may take. Defaults to
+            None, no deadline.
+
+    Raises:
+        asyncio.TimeoutError: If the deadline passed
+    """
+
+    key = embedding_key(text)
+
+    async def create(normalized: str) -> List[float]:
+        async def request() -> List[float]:
+            return (await _arequest_embeddings([normalized], cfg))[0]
+
+        return await singleflight.ado(
+            _embedding_flight_key(key, cfg), request, lambda: _cached_embedding(key)
+        )
+
+    return await asyncio.wait_for(embedding_cache.aget_or_create(text, create), deadline)
+
+
+def _embedding_flight_key(key: str, cfg: Config) -> str:
+    """Identifies identical embedding requests made with the same credentials"""
+    return f"embedding:{credentials_for(cfg).fingerprint()}:{key}"
+
+
+def _cached_embedding(key: str) -> Optional[List[float]]:
+    """Return the embedding another worker stored, once its request is done"""
+    vector = embedding_cache.get(key)
+    return None if vector is None else vector.tolist()
+
+
+def create_embeddings_batch(texts: List[str], cfg: Config) -> List[List[float]]:
+    """Create the embeddings of many texts with as few requests as possible
+
+    Cached texts are not sent again, and the rest are sent in batches of at most
+    EMBEDDING_BATCH_SIZE texts and EMBEDDING_BATCH_TOKENS tokens.
+
+    Args:
+        texts (list): The texts to embed
+        cfg (Config): The config of the caller
+
+    Returns:
+        list: The embeddings, in the order of the texts
+    """
+    return embedding_cache.get_many_or_create(
+        texts, lambda normalized: _create_embeddings(normalized, cfg)
+    )
+
+
+async def acreate_embeddings_batch(
+    texts: List[str], cfg: Config, deadline: float | None = None
+) -> List[List[float]]:
+    """Create the embeddings of many texts like create_embeddings_batch, with the
+    batches sent concurrently
+
+    Raises:
+        asyncio.TimeoutError: If the deadline passed
+    """
+
+    async def create_many(normalized: List[str]) -> List[List[float]]:
+        batches = embedding_batches(
+            normalized, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS
+        )
+        results = await asyncio.gather(
+            *[_arequest_embeddings(batch, cfg) for batch in batches]
+        )
+        return [embedding for result in results for embedding in result]
+
+    return await asyncio.wait_for(
+        embedding_cache.aget_many_or_create(texts, create_many), deadline
+    )
+
+
+def embedding_batches(
+    texts: List[str],
+    max_items: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_TOKENS,
+) -> Iterator[List[str]]:
+    """Split texts into the batches of one embedding request each
+
+    A text longer than max_tokens is sent on its own.
+    """
+    batch: List[str] = []
+    batch_tokens = 0
+    for text, tokens in zip(texts, count_strings_tokens(texts, EMBEDDING_MODEL)):
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _create_embeddings(texts: List[str], cfg: Config) -> List[List[float]]:
+    embeddings: List[List[float]] = []
+    for batch in embedding_batches(texts, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS):
+        embeddings.extend(_request_embeddings(batch, cfg))
+    return embeddings
+
+
+def _create_embedding(text: str, cfg: Config) -> List[float]:
+    return _request_embeddings([text], cfg)[0]
+
+
+def _embedding_target(cfg: Config) -> Dict[str, str]:
+    if cfg.use_azure:
+        return {"engine": cfg.get_azure_deployment_id_for_model(EMBEDDING_MODEL)}
+    return {"model": EMBEDDING_MODEL}
+
+
+def _embedding_failed(e: Exception, t0: float) -> None:
+    if isinstance(e, RateLimitError):
+        observe_request(
+            "embedding", EMBEDDING_MODEL, time.time() - t0, outcome="rate_limited"
+        )
+        print("RATE LIMIT ERROR", e)
+        return
+    observe_request("embedding", EMBEDDING_MODEL, time.time() - t0, outcome="error")
+    if isinstance(e, APIError):
+        print("API ERROR", e)
+
+
+def _embeddings(response, texts: List[str], t0: float) -> List[List[float]]:
+    observe_request(
+        "embedding",
+        EMBEDDING_MODEL,
+        time.time() - t0,
+        usage=response.get("usage"),
+        vectors=len(texts),
+    )
+    record_usage(EMBEDDING_MODEL, response.get("usage"), estimate_tokens(texts))
+    # the API does not promise to keep the order of the inputs
+    data = sorted(response["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in data]
+
+
+def _request_embeddings(texts: List[str], cfg: Config) -> List[List[float]]:
+    target = _embedding_target(cfg)
+    t0 = time.time()
     try:
-        if cfg.use_azure:
-            return openai.Embedding.create(
-                input=[text], # type: ignore
-                engine=cfg.get_azure_deployment_id_for_model(
-                    "text-embedding-ada-002"
+        with openai_call(cfg) as credentials:
+            response = _send(
+                credentials["api_key"],
+                EMBEDDING_MODEL,
+                estimate_tokens(texts),
+                lambda: backend.embedding(
+                    input=texts, # type: ignore
+                    request_timeout=phase_timeout(LLM_REQUEST_TIMEOUT),
+                    **target,
+                    **credentials,
                 ),
-            )["data"][0]["embedding"]
-        else:
-            return openai.Embedding.create(
-                input=[text], # type: ignore
-                model="text-embedding-ada-002",
-                api_key=cfg.openai_api_key,
-            )["data"][0]["embedding"]
-    except RateLimitError as e:
-        print("RATE LIMIT ERROR", e)
+            )
+    except Exception as e:
+        _embedding_failed(e, t0)
         raise e
-    except APIError as e:
-        print("API ERROR", e)
+    return _embeddings(response, texts, t0)
+
+
+async def _arequest_embeddings(texts: List[str], cfg: Config) -> List[List[float]]:
+    target = _embedding_target(cfg)
+    credentials = credentials_for(cfg).as_kwargs()
+    t0 = time.time()
+    try:
+        response = await _asend(
+            credentials["api_key"],
+            EMBEDDING_MODEL,
+            estimate_tokens(texts),
+            lambda: backend.aembedding(
+                input=texts,
+                request_timeout=phase_timeout(LLM_REQUEST_TIMEOUT),
+                **target,
+                **credentials,
+            ),
+        )
+    except Exception as e:
+        _embedding_failed(e, t0)
         raise e
+    return _embeddings(response, texts, t0)
@@ -0,0 +1,303 @@
+"""Buffered shipping of agent step logs to object storage.
+
+Step logs are queued in memory and a background thread uploads them in batches,
+one gzip-compressed NDJSON segment per agent and flush. Segments that fail to
+upload (or time out) are spooled to local disk and retried on later flushes.
+Once an upload fails, or the flush has taken LOG_FLUSH_BUDGET, the rest of the
+flush is spooled without trying, so an unavailable bucket costs one upload
+timeout per flush. The workers of a host share the spool: a worker claims a
+segment by renaming it before uploading it, so every segment is uploaded once.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 5))
+# seconds a flush may spend uploading; the segments left are spooled
+LOG_FLUSH_BUDGET = float(os.getenv("LOG_FLUSH_BUDGET", 20))
+LOG_SPOOL_DIR = os.getenv("LOG_SPOOL_DIR", "/tmp/godmode-log-spool")
+LOG_SPOOL_MAX_BYTES = int(os.getenv("LOG_SPOOL_MAX_BYTES", 256 * 1024 * 1024))
+LOG_PREFIX = "godmode-logs"
+# spooled segments being uploaded are renamed to <segment>.<pid>.claim
+CLAIM_SUFFIX = ".claim"
+
+
+class LogShipper:
+    """Batches log entries per agent and uploads them from a background thread.
+
+    Args:
+        upload: Called as ``upload(object_name, data)`` with a gzip-compressed
+            NDJSON segment. Raising marks the upload as failed.
+        max_queue: The maximum number of queued entries; more are dropped.
+        batch_size: Flush as soon as this many entries are buffered.
+        flush_interval: Flush buffered entries at least this often, in seconds.
+        flush_budget: The seconds a flush may spend uploading.
+        spool_dir: Where segments that failed to upload are kept.
+        spool_max_bytes: The maximum size of the spool; older segments are dropped.
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str, bytes], None],
+        max_queue: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        flush_budget: float = LOG_FLUSH_BUDGET,
+        spool_dir: str = LOG_SPOOL_DIR,
+        spool_max_bytes: int = LOG_SPOOL_MAX_BYTES,
+    ) -> None:
+        self.upload = upload
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_budget = flush_budget
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._buffer: Dict[str, List[dict]] = defaultdict(list)
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = threading.Event()
+        self.counters = {
+            "dropped": 0,
+            "shipped_entries": 0,
+            "shipped_segments": 0,
+            "spooled_segments": 0,
+            "failed_uploads": 0,
+        }
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += n
+
+    def _ensure_started(self) -> None:
+        # threads do not survive a fork, so start one per process
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="log-shipper", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, agent_id: str, text: str) -> bool:
+        """Queue a log entry without blocking
+
+        Returns:
+            bool: False if the queue was full and the entry was dropped
+        """
+        self._ensure_started()
+        entry = {"timestamp": time.time(), "agent_id": agent_id, "text": text}
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        return True
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while not self._stopping.is_set():
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                    if entry is not None:
+                        self._add(entry)
+                except queue.Empty:
+                    pass
+                with self._lock:
+                    full = self._buffered >= self.batch_size
+                if full or time.monotonic() - last_flush >= self.flush_interval:
+                    last_flush = time.monotonic()
+                    self.flush()
+            except Exception as e:
+                # the thread must outlive a failed flush, or logs pile up as dropped
+                print("Log shipper flush failed", e)
+
+    def _add(self, entry: dict) -> None:
+        with self._lock:
+            self._buffer[entry["agent_id"]].append(entry)
+            self._buffered += 1
+
+    def flush(self) -> None:
+        """Upload everything that is queued or buffered, and retry the spool
+
+        Stops uploading at the first failure or once the flush budget is spent,
+        and spools the segments left.
+        """
+        with self._flush_lock:
+            while True:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is not None:
+                    self._add(entry)
+            with self._lock:
+                buffer, self._buffer = self._buffer, defaultdict(list)
+                self._buffered = 0
+
+            deadline = time.monotonic() + self.flush_budget
+            available = self._retry_spool(deadline)
+            for agent_id, entries in buffer.items():
+                name = (
+                    f"{LOG_PREFIX}/{agent_id}/"
+                    f"{int(entries[0]['timestamp'] * 1000)}-{uuid.uuid4().hex[:8]}"
+                    ".ndjson.gz"
+                )
+                data = gzip.compress(
+                    "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+                )
+                available = available and time.monotonic() < deadline
+                if available and self._upload(name, data):
+                    self._count("shipped_entries", len(entries))
+                else:
+                    available = False
+                    self._spool(name, data)
+
+    def _upload(self, name: str, data: bytes) -> bool:
+        try:
+            self.upload(name, data)
+        except Exception as e:
+            self._count("failed_uploads")
+            print("Log upload failed, spooling segment", name, e)
+            return False
+        self._count("shipped_segments")
+        return True
+
+    def _spool_files(self) -> List[str]:
+        """Return the spooled segments no worker is uploading, oldest first
+
+        The segments claimed by a process that is gone are released.
+        """
+        files = []
+        for root, _, names in os.walk(self.spool_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(CLAIM_SUFFIX):
+                    path = self._release_dead_claim(path)
+                    if path is None:
+                        continue
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except OSError:
+                    # uploaded and deleted by another worker meanwhile
+                    continue
+        return [path for _, path in sorted(files)]
+
+    @staticmethod
+    def _release_dead_claim(path: str) -> Optional[str]:
+        """Rename a claimed segment back if its process is gone, else return None"""
+        segment, pid, _ = path.rsplit(".", 2)
+        try:
+            os.kill(int(pid), 0)
+            return None
+        except ProcessLookupError:
+            pass
+        except (OSError, ValueError):
+            return None
+        try:
+            os.rename(path, segment)
+        except OSError:
+            return None
+        return segment
+
+    def _spool(self, name: str, data: bytes) -> None:
+        try:
+            path = os.path.join(self.spool_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            self._count("spooled_segments")
+
+        except OSError as e:
+            self._count("dropped")
+            print("Failed to spool log segment", name, e)
+            return
+
+        sizes = []
+        for file in self._spool_files():
+            try:
+                sizes.append((file, os.path.getsize(file)))
+            except OSError:
+                continue
+        total = sum(size for _, size in sizes)
+        for oldest, size in sizes:
+            if total <= self.spool_max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(oldest)
+                self._count("dropped")
+            except OSError:
+                # claimed or removed by another worker
+                pass
+
+    def _retry_spool(self, deadline: float) -> bool:
+        """Upload the spooled segments until one fails or the deadline passes
+
+        Returns:
+            bool: False if the uploads stopped before the spool was empty
+        """
+        for path in self._spool_files():
+            if time.monotonic() >= deadline:
+                return False
+            claimed = f"{path}.{os.getpid()}{CLAIM_SUFFIX}"
+            try:
+                os.rename(path, claimed)
+                with open(claimed, "rb") as f:
+                    data = f.read()
+            except OSError:
+                # claimed by another worker
+                continue
+            name = os.path.relpath(path, self.spool_dir).replace(os.sep, "/")
+            uploaded = self._upload(name, data)
+            try:
+                if uploaded:
+                    os.remove(claimed)
+                else:
+                    os.rename(claimed, path)
+            except OSError as e:
+                print("Failed to release spooled log segment", name, e)
+            if not uploaded:
+                # still unavailable, keep the rest for the next flush
+                return False
+        return True
+
+    def close(self, timeout: float = 10) -> None:
+        """Stop the background thread and flush what is left"""
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                # wake the thread up
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the queue depth and the shipping counters"""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "buffered": self._buffered,
+                **self.counters,
+            }
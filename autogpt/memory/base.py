@@ -1,24 +1,31 @@
 """Base class for memory providers."""
 import abc
 
-import openai
-
 from autogpt.config import AbstractSingleton, Config
+from autogpt.llm_utils import (
+    acreate_embedding_with_ada,
+    acreate_embeddings_batch,
+    create_embedding_with_ada,
+    create_embeddings_batch,
+)
 
 cfg = Config()
 
 
 def get_ada_embedding(text):
-    text = text.replace("\n", " ")
-    if cfg.use_azure:
-        return openai.Embedding.create(
-            input=[text],
-            engine=cfg.get_azure_deployment_id_for_model("text-embedding-ada-002"),
-        )["data"][0]["embedding"]
-    else:
-        return openai.Embedding.create(input=[text], model="text-embedding-ada-002")[
-            "data"
-        ][0]["embedding"]
+    return create_embedding_with_ada(text, cfg)
+
+
+def get_ada_embeddings(texts):
+    return create_embeddings_batch(texts, cfg)
+
+
+async def aget_ada_embedding(text, deadline=None):
+    return await acreate_embedding_with_ada(text, cfg, deadline)
+
+
+async def aget_ada_embeddings(texts, deadline=None):
+    return await acreate_embeddings_batch(texts, cfg, deadline)
 
 
 class MemoryProvider():
@@ -26,6 +33,17 @@ class MemoryProvider():
     def add(self, data):
         pass
 
+    def add_many(self, texts):
+        """Add many texts to memory; providers override this to batch the writes
+
+        Args:
+            texts (list): The texts to add
+
+        Returns:
+            list: The message of each add
+        """
+        return [self.add(text) for text in texts]
+
     @abc.abstractmethod
     def get(self, data):
         pass
@@ -8,7 +8,7 @@ import numpy as np
 import orjson
 
 from autogpt.memory.base import MemoryProvider
-from autogpt.llm_utils import create_embedding_with_ada
+from autogpt.llm_utils import create_embedding_with_ada, create_embeddings_batch
 
 EMBED_DIM = 1536
 SAVE_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SERIALIZE_DATACLASS
@@ -38,6 +38,7 @@ class LocalCache(MemoryProvider):
         Returns:
             None
         """
+        self.cfg = cfg
         self.filename = f"{cfg.memory_index}.json"
         if os.path.exists(self.filename):
             try:
@@ -73,7 +74,7 @@ class LocalCache(MemoryProvider):
             return ""
         self.data.texts.append(text)
 
-        embedding = create_embedding_with_ada(text)
+        embedding = create_embedding_with_ada(text, self.cfg)
 
         vector = np.array(embedding).astype(np.float32)
         vector = vector[np.newaxis, :]
@@ -90,6 +91,33 @@ class LocalCache(MemoryProvider):
             f.write(out)
         return text
 
+    def add_many(self, texts: list[str]) -> list[str]:
+        """
+        Add texts with one batch of embeddings, growing the embeddings-matrix
+            and saving the file once
+
+        Args:
+            texts: list[str]
+
+        Returns: The texts added, "" for the ones skipped
+        """
+        added = [text for text in texts if "Command Error:" not in text]
+        if added:
+            embeddings = create_embeddings_batch(added, self.cfg)
+            self.data.texts.extend(added)
+            self.data.embeddings = np.concatenate(
+                [
+                    self.data.embeddings,
+                    np.array(embeddings).astype(np.float32),
+                ],
+                axis=0,
+            )
+
+            with open(self.filename, "wb") as f:
+                out = orjson.dumps(self.data, option=SAVE_OPTIONS)
+                f.write(out)
+        return ["" if "Command Error:" in text else text for text in texts]
+
     def clear(self) -> str:
         """
         Clears the redis server.
@@ -121,7 +149,7 @@ class LocalCache(MemoryProvider):
 
         Returns: List[str]
         """
-        embedding = create_embedding_with_ada(text)
+        embedding = create_embedding_with_ada(text, self.cfg)
 
         scores = np.dot(self.data.embeddings, embedding)
 
@@ -7,7 +7,7 @@ from pymilvus import (
     Collection,
 )
 
-from autogpt.memory.base import MemoryProvider, get_ada_embedding
+from autogpt.memory.base import MemoryProvider, get_ada_embedding, get_ada_embeddings
 
 
 class MilvusMemory(MemoryProvider):
@@ -62,6 +62,22 @@ class MilvusMemory(MemoryProvider):
         )
         return _text
 
+    def add_many(self, texts) -> list:
+        """Add the embeddings of many texts into memory with one insert.
+
+        Args:
+            texts (list): The raw texts to construct embedding indexes.
+
+        Returns:
+            list: The log of each insert.
+        """
+        embeddings = get_ada_embeddings(texts)
+        result = self.collection.insert([embeddings, texts])
+        return [
+            f"Inserting data into memory at primary key: {key}:\n data: {data}"
+            for key, data in zip(result.primary_keys, texts)
+        ]
+
     def get(self, data):
         """Return the most relevant data in memory.
         Args:
@@ -4,11 +4,13 @@ from autogpt.api_utils import CRITICAL, ERROR, print_log
 
 from autogpt.logs import logger
 from autogpt.memory.base import MemoryProvider
-from autogpt.llm_utils import create_embedding_with_ada
+from autogpt.llm_utils import create_embedding_with_ada, create_embeddings_batch
 from autogpt.config import Config
 
 global_config = Config()
 
+PINECONE_UPSERT_BATCH = 100
+
 pinecone_api_key = global_config.pinecone_api_key
 pinecone_region = global_config.pinecone_region
 if pinecone_api_key and pinecone_region:
@@ -61,6 +63,30 @@ class PineconeMemory(MemoryProvider):
         self.vec_num += 1
         return _text
 
+    def add_many(self, texts):
+        vectors = create_embeddings_batch(texts, self.cfg)
+        first = self.vec_num
+        data = [
+            (str(first + i), vector, {"raw_text": text})
+            for i, (text, vector) in enumerate(zip(texts, vectors))
+        ]
+        namespace = self.cfg.agent_id
+        try:
+            # upserts are limited in size, 100 vectors is what Pinecone recommends
+            for start in range(0, len(data), PINECONE_UPSERT_BATCH):
+                self.index.upsert(
+                    data[start : start + PINECONE_UPSERT_BATCH],
+                    namespace=namespace,
+                )
+        except Exception as e:
+            print_log("Pinecone upsert error", severity=CRITICAL, errorMsg=e, pine_namespace=namespace)
+            raise e
+        self.vec_num += len(data)
+        return [
+            f"Inserting data into memory at index: {first + i}:\n data: {text}"
+            for i, text in enumerate(texts)
+        ]
+
     def get(self, data):
         return self.get_relevant(data, 1)
 
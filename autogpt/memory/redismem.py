@@ -12,7 +12,7 @@ from redis.commands.search.query import Query
 
 from autogpt.logs import logger
 from autogpt.memory.base import MemoryProvider
-from autogpt.llm_utils import create_embedding_with_ada
+from autogpt.llm_utils import create_embedding_with_ada, create_embeddings_batch
 
 SCHEMA = [
     TextField("data"),
@@ -88,7 +88,7 @@ class RedisMemory(MemoryProvider):
         """
         if "Command Error:" in data:
             return ""
-        vector = create_embedding_with_ada(data)
+        vector = create_embedding_with_ada(data, self.cfg)
         vector = np.array(vector).astype(np.float32).tobytes()
         data_dict = {b"data": data, "embedding": vector}
         pipe = self.redis.pipeline()
@@ -101,6 +101,38 @@ class RedisMemory(MemoryProvider):
         pipe.execute()
         return _text
 
+    def add_many(self, texts: list[str]) -> list[str]:
+        """
+        Adds data points to the memory with one batch of embeddings and one
+        pipeline.
+
+        Args:
+            texts: The data to add.
+
+        Returns: The message of each add, "" for the ones skipped.
+        """
+        added = [data for data in texts if "Command Error:" not in data]
+        if not added:
+            return ["" for _ in texts]
+        vectors = iter(create_embeddings_batch(added, self.cfg))
+        messages = []
+        pipe = self.redis.pipeline()
+        for data in texts:
+            if "Command Error:" in data:
+                messages.append("")
+                continue
+            vector = np.array(next(vectors)).astype(np.float32).tobytes()
+            data_dict = {b"data": data, "embedding": vector}
+            pipe.hset(f"{self.cfg.memory_index}:{self.vec_num}", mapping=data_dict)
+            messages.append(
+                f"Inserting data into memory at index: {self.vec_num}:\n"
+                f"data: {data}"
+            )
+            self.vec_num += 1
+        pipe.set(f"{self.cfg.memory_index}-vec_num", self.vec_num)
+        pipe.execute()
+        return messages
+
     def get(self, data: str) -> list[Any] | None:
         """
         Gets the data from the memory that is most relevant to the given data.
@@ -130,7 +162,7 @@ class RedisMemory(MemoryProvider):
 
         Returns: A list of the most relevant data.
         """
-        query_embedding = create_embedding_with_ada(data)
+        query_embedding = create_embedding_with_ada(data, self.cfg)
         base_query = f"*=>[KNN {num_relevant} @embedding $vector AS vector_score]"
         query = (
             Query(base_query)
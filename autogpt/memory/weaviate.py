@@ -1,5 +1,5 @@
 from autogpt.config import Config
-from autogpt.memory.base import MemoryProvider, get_ada_embedding
+from autogpt.memory.base import MemoryProvider, get_ada_embedding, get_ada_embeddings
 import uuid
 import weaviate
 from weaviate import Client
@@ -71,6 +71,23 @@ class WeaviateMemory(MemoryProvider):
 
         return f"Inserting data into memory at uuid: {doc_uuid}:\n data: {data}"
 
+    def add_many(self, texts):
+        vectors = get_ada_embeddings(texts)
+        messages = []
+
+        with self.client.batch as batch:
+            for data, vector in zip(texts, vectors):
+                doc_uuid = generate_uuid5(data, self.index)
+                batch.add_data_object(
+                    uuid=doc_uuid,
+                    data_object={'raw_text': data},
+                    class_name=self.index,
+                    vector=vector
+                )
+                messages.append(f"Inserting data into memory at uuid: {doc_uuid}:\n data: {data}")
+
+        return messages
+
     def get(self, data):
         return self.get_relevant(data, 1)
 
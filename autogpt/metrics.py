@@ -0,0 +1,243 @@
+"""Prometheus metrics of LLM calls and of the server's caches and pools.
+
+Every chat completion and embedding request is recorded with its model and
+call site: latency, prompt and completion tokens (from ``response.usage``),
+vectors per embedding request, and its outcome (ok, cached, rate_limited or
+error). The ``stats()`` of the caches, pools and queues are exported as gauges.
+
+The call site is a context variable set with ``call_site``, as a context
+manager or a decorator, so it reaches the embeddings made deep in the memory
+providers and the phases the step pipeline runs on other threads.
+
+prometheus_client is optional; without it recording is a no-op.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+VECTOR_BUCKETS = (1, 2, 4, 8, 16, 64, 256, 1024, 2048)
+
+_call_site: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "llm_call_site", default="other"
+)
+
+
+@contextlib.contextmanager
+def call_site(name: str) -> Iterator[None]:
+    """Label the LLM calls made within a block or function with a call site
+
+    Use as ``with call_site("subgoals"):`` or as a decorator.
+    """
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+
+def current_call_site() -> str:
+    """Return the call site of the LLM calls made here"""
+    return _call_site.get()
+
+
+class _Noop:
+    """Stands in for a metric when prometheus_client is not installed."""
+
+    def labels(self, *args, **kwargs) -> "_Noop":
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+
+def _metric(kind: str, name: str, documentation: str, labels, **kwargs):
+    if prometheus_client is None:
+        return _Noop()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+LLM_REQUESTS = _metric(
+    "Counter",
+    "llm_requests_total",
+    "LLM requests by outcome: ok, cached, rate_limited or error",
+    ["kind", "model", "call_site", "outcome"],
+)
+LLM_LATENCY = _metric(
+    "Histogram",
+    "llm_request_seconds",
+    "Duration of LLM requests, to the end of the stream for streamed completions",
+    ["kind", "model", "call_site"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_PROMPT_TOKENS = _metric(
+    "Histogram",
+    "llm_prompt_tokens",
+    "Prompt tokens per LLM request",
+    ["kind", "model", "call_site"],
+    buckets=TOKEN_BUCKETS,
+)
+LLM_COMPLETION_TOKENS = _metric(
+    "Histogram",
+    "llm_completion_tokens",
+    "Completion tokens per chat completion",
+    ["model", "call_site"],
+    buckets=TOKEN_BUCKETS,
+)
+LLM_EMBEDDING_VECTORS = _metric(
+    "Histogram",
+    "llm_embedding_vectors",
+    "Texts embedded per embedding request",
+    ["model", "call_site"],
+    buckets=VECTOR_BUCKETS,
+)
+LLM_RETRIES = _metric(
+    "Counter",
+    "llm_retries_total",
+    "LLM requests retried after a 429",
+    ["model", "call_site"],
+)
+LLM_RATE_LIMIT_WAIT = _metric(
+    "Histogram",
+    "llm_rate_limit_wait_seconds",
+    "Time LLM requests waited for the client-side rate limiter",
+    ["model", "call_site"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_HEDGES = _metric(
+    "Counter",
+    "llm_hedges_total",
+    "Hedged chat completions by outcome: won if the hedge answered first, else lost",
+    ["model", "call_site", "outcome"],
+)
+LLM_HEDGE_TOKENS = _metric(
+    "Counter",
+    "llm_hedge_extra_tokens_total",
+    "Tokens of the hedged chat completions whose response was discarded",
+    ["model", "call_site"],
+)
+
+
+def observe_request(
+    kind: str,
+    model: str,
+    seconds: Optional[float],
+    usage: Optional[Dict[str, Any]] = None,
+    outcome: str = "ok",
+    vectors: Optional[int] = None,
+) -> None:
+    """Record an LLM request
+
+    Args:
+        kind (str): "chat" or "embedding"
+        model (str): The model called
+        seconds (float, optional): The duration of the request, None if it was
+            not sent (e.g. cached)
+        usage (dict, optional): The usage of the response
+        outcome (str): "ok", "cached", "coalesced", "rate_limited" or "error"
+        vectors (int, optional): The number of texts of an embedding request
+    """
+    site = current_call_site()
+    LLM_REQUESTS.labels(kind, model, site, outcome).inc()
+    if seconds is not None:
+        LLM_LATENCY.labels(kind, model, site).observe(seconds)
+    if usage:
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        LLM_PROMPT_TOKENS.labels(kind, model, site).observe(prompt_tokens)
+        if kind == "chat":
+            LLM_COMPLETION_TOKENS.labels(model, site).observe(
+                usage.get("completion_tokens", 0)
+            )
+    if vectors is not None:
+        LLM_EMBEDDING_VECTORS.labels(model, site).observe(vectors)
+
+
+def observe_retry(model: str) -> None:
+    """Record an LLM request retried after a 429"""
+    LLM_RETRIES.labels(model, current_call_site()).inc()
+
+
+def observe_rate_limit_wait(model: str, seconds: float) -> None:
+    """Record the time an LLM request waited for the rate limiter"""
+    LLM_RATE_LIMIT_WAIT.labels(model, current_call_site()).observe(seconds)
+
+
+def observe_hedge(model: str, site: str, won: bool, extra_tokens: int) -> None:
+    """Record a hedged chat completion and the tokens of its discarded response"""
+    LLM_HEDGES.labels(model, site, "won" if won else "lost").inc()
+    LLM_HEDGE_TOKENS.labels(model, site).inc(extra_tokens)
+
+
+_stats_sources: Dict[str, Callable[[], Dict[str, float]]] = {}
+_stats_lock = threading.Lock()
+
+
+def register_stats(name: str, stats: Callable[[], Dict[str, float]]) -> None:
+    """Export the values of a stats() method as gauges named godmode_<name>_<key>"""
+    with _stats_lock:
+        _stats_sources[name] = stats
+
+
+def collect_stats() -> Dict[str, float]:
+    """Return the values of all the registered stats, as {gauge name: value}"""
+    with _stats_lock:
+        sources = list(_stats_sources.items())
+    values = {}
+    for name, stats in sources:
+        try:
+            for key, value in stats().items():
+                if isinstance(value, (int, float)):
+                    values[f"godmode_{name}_{key}"] = value
+        except Exception as e:
+            print("Stats collection failed", name, e)
+    return values
+
+
+class StatsCollector:
+    """Collects the registered stats at scrape time."""
+
+    def collect(self):
+        for name, value in collect_stats().items():
+            yield GaugeMetricFamily(name, f"{name} of this worker", value=value)
+
+
+def render() -> Tuple[bytes, str]:
+    """Return the metrics in the Prometheus text format, and its content type
+
+    With PROMETHEUS_MULTIPROC_DIR set (as gunicorn workers need) the request
+    metrics of all workers are aggregated; the stats gauges are always those of
+    the worker that serves the scrape.
+    """
+    if prometheus_client is None:
+        return b"# prometheus_client is not installed\n", "text/plain; charset=utf-8"
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    stats_registry = prometheus_client.CollectorRegistry()
+    stats_registry.register(StatsCollector())
+    payload = prometheus_client.generate_latest(registry)
+    payload += prometheus_client.generate_latest(stats_registry)
+    return payload, prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the metric files of a dead worker (gunicorn's child_exit hook)"""
+    if prometheus_client is not None and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
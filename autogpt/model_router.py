@@ -0,0 +1,389 @@
+"""Choosing the model of every chat completion, and failing over between models.
+
+Calls to ``create_chat_completion`` without a model are routed by a policy:
+
+- The call site (``autogpt.metrics.call_site``) picks a class from LLM_ROUTES:
+  ``light`` sites (naming a task, listing subgoals, fixing JSON, summarizing)
+  use LLM_LIGHT_MODEL, ``fast`` sites the ``fast_llm_model`` of the config and
+  ``smart`` sites its ``smart_llm_model``. The other configured models follow as
+  alternates, then those of LLM_ROUTE_FALLBACKS, and on Azure the fallback
+  deployments of each model.
+- Models whose context window cannot hold the prompt and the completion are
+  skipped.
+- Models that failed more than LLM_ROUTE_MAX_ERROR_RATE of their recent calls,
+  or whose recent p95 latency is over the latency budget of the call, go last.
+
+A call that times out, cannot connect or finds the service unavailable is sent
+to the next model. A call that stays rate limited is too, but only when it is
+made with the server's own API key: the limits belong to the key, so the call
+of a user's key would meet them again, and they say nothing of the model's
+health. With a latency budget (LLM_ROUTE_BUDGETS
+by call site, or ``latency_budget``) every model but the last one gets the
+budget as its timeout, so a slow model costs the budget rather than
+LLM_REQUEST_TIMEOUT.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterator, List, NamedTuple
+from typing import Optional, Tuple, TypeVar
+
+from openai.error import (
+    APIConnectionError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+from autogpt.llm_transport import LLM_REQUEST_TIMEOUT
+
+T = TypeVar("T")
+
+# the class of every call site, "light", "fast" or "smart"; "other" is the default
+LLM_ROUTES = os.getenv(
+    "LLM_ROUTES",
+    "task_name=light,subgoals=light,fix_json=light,summarize_text=light,"
+    "chat_with_ai=fast,other=smart",
+)
+LLM_LIGHT_MODEL = os.getenv("LLM_LIGHT_MODEL", "gpt-3.5-turbo")
+# latency budgets in seconds by call site, e.g. "task_name=10,subgoals=20"
+LLM_ROUTE_BUDGETS = os.getenv("LLM_ROUTE_BUDGETS", "task_name=15,subgoals=30")
+# more alternates by model prefix, e.g. "gpt-4=gpt-4-0314|gpt-3.5-turbo"
+LLM_ROUTE_FALLBACKS = os.getenv("LLM_ROUTE_FALLBACKS", "")
+# the recent calls the latency and error rate of a model are measured over
+LLM_ROUTE_WINDOW = int(os.getenv("LLM_ROUTE_WINDOW", 100))
+LLM_ROUTE_MIN_CALLS = int(os.getenv("LLM_ROUTE_MIN_CALLS", 5))
+LLM_ROUTE_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTE_MAX_ERROR_RATE", 0.5))
+
+# tokens of prompt and completion, by model prefix
+CONTEXT_WINDOWS = {
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo": 4096,
+}
+
+# errors after which the next model is tried, counted against the health of the
+# model; rate limits are handled apart (see ModelRouter.call)
+FAILOVER_ERRORS = (Timeout, APIConnectionError, ServiceUnavailableError)
+
+_budget: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "llm_latency_budget", default=None
+)
+
+
+class Route(NamedTuple):
+    """A model, and on Azure the deployment serving it."""
+
+    model: str
+    deployment_id: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.deployment_id or self.model
+
+
+def parse_mapping(mapping: str) -> Dict[str, str]:
+    """Parse "key=value,..." into {key: value}"""
+    parsed = {}
+    for entry in [e.strip() for e in mapping.split(",") if e.strip()]:
+        key, value = entry.split("=")
+        parsed[key.strip()] = value.strip()
+    return parsed
+
+
+def context_window(model: str) -> Optional[int]:
+    """Return the context window of the longest model prefix matching a model"""
+    matches = [prefix for prefix in CONTEXT_WINDOWS if model.startswith(prefix)]
+    return CONTEXT_WINDOWS[max(matches, key=len)] if matches else None
+
+
+@contextlib.contextmanager
+def latency_budget(seconds: Optional[float]) -> Iterator[None]:
+    """Set the latency budget of the chat completions made within a block"""
+    token = _budget.set(seconds)
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+
+
+class _Health:
+    def __init__(self, window: int) -> None:
+        self.calls: Deque[Tuple[float, bool]] = deque(maxlen=window)
+
+    def percentile(self, q: float) -> float:
+        latencies = sorted(seconds for seconds, _ in self.calls)
+        if not latencies:
+            return 0.0
+        return latencies[math.ceil(q / 100 * len(latencies)) - 1]
+
+    def error_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for _, ok in self.calls if not ok) / len(self.calls)
+
+
+class ModelRouter:
+    """Picks the models a chat completion is sent to, in order, and tries them.
+
+    Args:
+        routes: {call site: "light", "fast" or "smart"}.
+        light_model: The model of the light call sites.
+        budgets: {call site: latency budget in seconds}.
+        fallbacks: {model prefix: [alternate models]}.
+        window: The recent calls a model's health is measured over.
+        min_calls: The calls a model needs before its health is considered.
+        max_error_rate: The error rate beyond which a model goes last.
+        timeout: The timeout of the last model tried.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, str],
+        light_model: str = LLM_LIGHT_MODEL,
+        budgets: Optional[Dict[str, float]] = None,
+        fallbacks: Optional[Dict[str, List[str]]] = None,
+        window: int = LLM_ROUTE_WINDOW,
+        min_calls: int = LLM_ROUTE_MIN_CALLS,
+        max_error_rate: float = LLM_ROUTE_MAX_ERROR_RATE,
+        timeout: float = LLM_REQUEST_TIMEOUT,
+    ) -> None:
+        self.routes = routes
+        self.light_model = light_model
+        self.budgets = budgets or {}
+        self.fallbacks = fallbacks or {}
+        self.window = window
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.timeout = timeout
+        self._health: Dict[str, _Health] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "routed": 0,
+            "demoted": 0,
+            "failovers": 0,
+            "rate_limit_failovers": 0,
+        }
+
+    def budget(self, site: str) -> Optional[float]:
+        """Return the latency budget of a call: the one set, or its call site's"""
+        budget = _budget.get()
+        return budget if budget is not None else self.budgets.get(site)
+
+    def models(self, cfg, site: str) -> List[str]:
+        """Return the models of a call site by preference, without duplicates"""
+        fast, smart = cfg.fast_llm_model, cfg.smart_llm_model
+        route = self.routes.get(site, self.routes.get("other", "smart"))
+        if route == "light":
+            models = [self.light_model, fast, smart]
+        elif route == "fast":
+            models = [fast, smart]
+        else:
+            models = [smart, fast]
+        for model in list(models):
+            matches = [prefix for prefix in self.fallbacks if model.startswith(prefix)]
+            if matches:
+                models.extend(self.fallbacks[max(matches, key=len)])
+        return list(dict.fromkeys(models))
+
+    def plan(
+        self,
+        cfg,
+        model: Optional[str],
+        site: str,
+        prompt_tokens: int,
+        max_tokens: Optional[int] = None,
+    ) -> List[Route]:
+        """Return the routes a chat completion is tried on, in order
+
+        Args:
+            cfg (Config): The config of the caller
+            model (str): The model the caller asked for; it is the only one
+                tried, except for its Azure fallback deployments
+            site (str): The call site
+            prompt_tokens (int): The (estimated) tokens of the prompt
+            max_tokens (int, optional): The tokens reserved for the completion
+
+        Returns:
+            list: The routes, most preferred first
+
+        Raises:
+            ValueError: On Azure, if none of the models has a deployment
+        """
+        models = [model] if model is not None else self.models(cfg, site)
+        routes = []
+        for name in models:
+            if not cfg.use_azure:
+                routes.append(Route(name))
+                continue
+            deployments = [cfg.get_azure_deployment_id_for_model(name)]
+            deployments += cfg.get_azure_fallback_deployment_ids(name)
+            # a model without a deployment cannot be called on Azure
+            routes.extend(Route(name, d) for d in deployments if d)
+        if model is not None:
+            return routes or [Route(model)]
+        if not routes:
+            raise ValueError(
+                f"No Azure deployment for the models of {site}: {', '.join(models)}"
+            )
+
+        needed = prompt_tokens + (max_tokens or 0)
+        fitting = [r for r in routes if (context_window(r.model) or needed) >= needed]
+        routes = fitting or routes[:1]
+
+        budget = self.budget(site)
+        demoted = [self._demoted(route, budget) for route in routes]
+        ordered = [r for r, d in zip(routes, demoted) if not d]
+        ordered += [r for r, d in zip(routes, demoted) if d]
+        with self._lock:
+            self.counters["routed"] += 1
+            if ordered[0] != routes[0]:
+                self.counters["demoted"] += 1
+        return ordered
+
+    def _demoted(self, route: Route, budget: Optional[float]) -> bool:
+        with self._lock:
+            health = self._health.get(route.name)
+            if health is None or len(health.calls) < self.min_calls:
+                return False
+            if health.error_rate() > self.max_error_rate:
+                return True
+            return budget is not None and health.percentile(95) > budget
+
+    def latency(self, route: Route, q: float) -> Optional[float]:
+        """Return the q-th percentile of the recent latency of a route
+
+        None until the route has made min_calls calls.
+        """
+        with self._lock:
+            health = self._health.get(route.name)
+            if health is None or len(health.calls) < self.min_calls:
+                return None
+            return health.percentile(q)
+
+    def observe(self, route: Route, seconds: float, ok: bool) -> None:
+        """Record the latency and outcome of a call to a route"""
+        with self._lock:
+            health = self._health.get(route.name)
+            if health is None:
+                health = self._health[route.name] = _Health(self.window)
+            health.calls.append((seconds, ok))
+
+    def call(
+        self,
+        routes: List[Route],
+        attempt: Callable[[Route, float], T],
+        budget: Optional[float] = None,
+        rate_limit_failover: bool = True,
+    ) -> Tuple[Route, T]:
+        """Try the routes in order until one answers
+
+        Args:
+            routes (list): The routes, as planned
+            attempt (Callable): Sends the request to a route with a timeout
+            budget (float, optional): The timeout of every route but the last
+            rate_limit_failover (bool): Try the next route when a route stays
+                rate limited. Only for the server's own API key; the limits of
+                a user's key are the same on every model.
+
+        Returns:
+            tuple: The route that answered and its response
+
+        Raises:
+            The error of the last route, or the first error that is not a
+                timeout, a connection error, an outage or a rate limit to fail
+                over from
+        """
+        for i, route in enumerate(routes):
+            t0 = time.time()
+            try:
+                response = attempt(route, self._timeout(routes, i, budget))
+            except FAILOVER_ERRORS as e:
+                self._failed(routes, i, time.time() - t0, e)
+                continue
+            except RateLimitError as e:
+                self._rate_limited(routes, i, e, rate_limit_failover)
+                continue
+            self.observe(route, time.time() - t0, ok=True)
+            return route, response
+        raise ValueError("No route to call")
+
+    async def acall(
+        self,
+        routes: List[Route],
+        attempt: Callable[[Route, float], Awaitable[T]],
+        budget: Optional[float] = None,
+        rate_limit_failover: bool = True,
+    ) -> Tuple[Route, T]:
+        """Try the routes in order until one answers, like call, for async attempts"""
+        for i, route in enumerate(routes):
+            t0 = time.time()
+            try:
+                response = await attempt(route, self._timeout(routes, i, budget))
+            except FAILOVER_ERRORS as e:
+                self._failed(routes, i, time.time() - t0, e)
+                continue
+            except RateLimitError as e:
+                self._rate_limited(routes, i, e, rate_limit_failover)
+                continue
+            self.observe(route, time.time() - t0, ok=True)
+            return route, response
+        raise ValueError("No route to call")
+
+    def _timeout(self, routes: List[Route], i: int, budget: Optional[float]) -> float:
+        last = i == len(routes) - 1
+        return self.timeout if last or budget is None else budget
+
+    def _failed(
+        self, routes: List[Route], i: int, seconds: float, e: Exception
+    ) -> None:
+        self.observe(routes[i], seconds, ok=False)
+        if i == len(routes) - 1:
+            raise e
+        print("FAILING OVER", routes[i].name, "->", routes[i + 1].name, e)
+        with self._lock:
+            self.counters["failovers"] += 1
+
+    def _rate_limited(
+        self, routes: List[Route], i: int, e: Exception, failover: bool
+    ) -> None:
+        # the limits are those of the API key, not a failure of the model
+        if not failover or i == len(routes) - 1:
+            raise e
+        print("RATE LIMITED, FAILING OVER", routes[i].name, "->", routes[i + 1].name)
+        with self._lock:
+            self.counters["failovers"] += 1
+            self.counters["rate_limit_failovers"] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Return the routing counters and the p95 and error rate of every route"""
+        with self._lock:
+            stats: Dict[str, float] = dict(self.counters)
+            for name, health in self._health.items():
+                key = re.sub(r"\W", "_", name)
+                stats[f"{key}_p95_seconds"] = round(health.percentile(95), 3)
+                stats[f"{key}_error_rate"] = round(health.error_rate(), 3)
+            return stats
+
+
+def build_router() -> ModelRouter:
+    """Build the router configured by the LLM_ROUTE* environment variables"""
+    fallbacks = {
+        prefix: [model for model in models.split("|") if model]
+        for prefix, models in parse_mapping(LLM_ROUTE_FALLBACKS).items()
+    }
+    budgets = {
+        site: float(seconds) for site, seconds in parse_mapping(LLM_ROUTE_BUDGETS).items()
+    }
+    return ModelRouter(parse_mapping(LLM_ROUTES), budgets=budgets, fallbacks=fallbacks)
+
+
+model_router = build_router()
@@ -1,9 +1,11 @@
 """Text processing functions"""
+import asyncio
 from typing import Generator, Optional, Dict
 # from selenium.webdriver.remote.webdriver import WebDriver
 from autogpt.memory import get_memory
 from autogpt.config import Config
-from autogpt.llm_utils import create_chat_completion
+from autogpt.llm_utils import acreate_chat_completion, create_chat_completion, run_sync
+from autogpt.metrics import call_site
 
 def split_text(text: str, max_length: int = 8192) -> Generator[str, None, None]:
     """Split text into chunks of a maximum length
@@ -35,6 +37,7 @@ def split_text(text: str, max_length: int = 8192) -> Generator[str, None, None]:
         yield "\n".join(current_chunk)
 
 
+@call_site("summarize_text")
 def summarize_text(
     url: str, text: str, question: str, cfg: Config, driver: None = None
 ) -> str:
@@ -55,35 +58,42 @@ def summarize_text(
     text_length = len(text)
     print(f"Text length: {text_length} characters")
 
-    summaries = []
     chunks = list(split_text(text))
-    scroll_ratio = 1 / len(chunks)
 
-    for i, chunk in enumerate(chunks):
-        # if driver:
-        #     scroll_to_percentage(driver, scroll_ratio * i)
-        print(f"Adding chunk {i + 1} / {len(chunks)} to memory")
-
-        memory_to_add = f"Source: {url}\n" f"Raw content part#{i + 1}: {chunk}"
-
-        MEMORY = get_memory(cfg)
-        MEMORY.add(memory_to_add)
-
-        print(f"Summarizing chunk {i + 1} / {len(chunks)}")
-        messages = [create_message(chunk, question)]
+    # the chunks and their summaries are embedded in one batch each
+    print(f"Adding {len(chunks)} chunks to memory")
+    MEMORY = get_memory(cfg)
+    MEMORY.add_many(
+        [
+            f"Source: {url}\n" f"Raw content part#{i + 1}: {chunk}"
+            for i, chunk in enumerate(chunks)
+        ]
+    )
 
-        summary = create_chat_completion(
-            model=cfg.fast_llm_model,
-            messages=messages,
-            max_tokens=cfg.browse_summary_max_token,
-            cfg=cfg,
+    # the chunks are summarized concurrently, on one event loop
+    print(f"Summarizing {len(chunks)} chunks")
+
+    async def summarize_chunks():
+        return await asyncio.gather(
+            *[
+                acreate_chat_completion(
+                    messages=[create_message(chunk, question)],
+                    max_tokens=cfg.browse_summary_max_token,
+                    cfg=cfg,
+                )
+                for chunk in chunks
+            ]
         )
-        summaries.append(summary)
-        print(f"Added chunk {i + 1} summary to memory")
 
-        memory_to_add = f"Source: {url}\n" f"Content summary part#{i + 1}: {summary}"
+    summaries = run_sync(summarize_chunks())
 
-        MEMORY.add(memory_to_add)
+    MEMORY.add_many(
+        [
+            f"Source: {url}\n" f"Content summary part#{i + 1}: {summary}"
+            for i, summary in enumerate(summaries)
+        ]
+    )
+    print(f"Added {len(summaries)} chunk summaries to memory")
 
     print(f"Summarized {len(chunks)} chunks.")
 
@@ -91,7 +101,6 @@ def summarize_text(
     messages = [create_message(combined_summary, question)]
 
     return create_chat_completion(
-        model=cfg.fast_llm_model,
         messages=messages,
         max_tokens=cfg.browse_summary_max_token,
         cfg=cfg,
@@ -0,0 +1,337 @@
+"""Client-side rate limiting of OpenAI calls.
+
+Every API key has its own requests-per-minute and tokens-per-minute quota per
+model, and all the users of the server key share it. Calls reserve capacity in
+a pair of token buckets per key and model before they are sent, waiting briefly
+when a burst exceeds the quota instead of failing. A 429 that still gets through
+pauses the key and model for its ``Retry-After`` (or a jittered exponential
+backoff) and the call is retried, so throughput against a known quota is
+predictable and a burst costs latency rather than failed steps.
+
+The buckets are kept in each worker process, so a worker is limited to its
+share of the quota: the limits divided by the number of workers.
+
+``RateLimiter.acall`` does the same for async calls, waiting without blocking
+the event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from openai.error import RateLimitError
+
+from autogpt.metrics import observe_rate_limit_wait, observe_retry
+
+T = TypeVar("T")
+
+# requests and tokens per minute per API key, by model prefix, e.g.
+# "gpt-4=200/40000,gpt-3.5-turbo=3500/90000"
+LLM_RATE_LIMITS = os.getenv(
+    "LLM_RATE_LIMITS",
+    "gpt-4=200/40000,gpt-3.5-turbo=3500/90000,text-embedding-ada-002=3000/1000000",
+)
+# the worker processes sharing the limits, each limited to its share; gunicorn
+# sets WEB_CONCURRENCY to its workers (gunicorn.conf.py). Set this to the workers
+# of all the replicas when several servers use the same keys.
+LLM_RATE_LIMIT_WORKERS = int(
+    os.getenv("LLM_RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", 1))
+)
+# seconds a call may spend waiting for capacity and backing off, in total
+LLM_RATE_LIMIT_WAIT = float(os.getenv("LLM_RATE_LIMIT_WAIT", 30))
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", 4))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 1))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20))
+LLM_RATE_LIMIT_KEYS = int(os.getenv("LLM_RATE_LIMIT_KEYS", 1024))
+
+
+def parse_limits(limits: str, workers: int = 1) -> Dict[str, Tuple[int, int]]:
+    """Parse "model=rpm/tpm,..." into {model: (rpm, tpm)}, the share of one of
+    `workers` processes"""
+    workers = max(1, workers)
+    parsed = {}
+    for entry in [e.strip() for e in limits.split(",") if e.strip()]:
+        model, quota = entry.split("=")
+        rpm, tpm = quota.split("/")
+        parsed[model.strip()] = (
+            max(1, int(rpm) // workers),
+            max(1, int(tpm) // workers),
+        )
+    return parsed
+
+
+def estimate_tokens(texts: List[str], max_tokens: Optional[int] = None) -> int:
+    """Estimate the tokens a request counts against the quota
+
+    OpenAI counts about 4 characters per token of input, plus max_tokens for
+    the completion, before the request runs.
+    """
+    return sum(len(text) for text in texts) // 4 + (max_tokens or 0)
+
+
+def retry_after(error: RateLimitError) -> Optional[float]:
+    """Return the Retry-After of a 429 in seconds, if it has one"""
+    headers = error.headers or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """A bucket refilled continuously with `per_minute` units a minute.
+
+    Reservations may take the bucket below zero; the caller then waits for the
+    deficit to be refilled, so waiting callers are served in order.
+    """
+
+    def __init__(self, per_minute: float, now: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount from the bucket and return the seconds until it is covered"""
+        self._refill(now)
+        # a request larger than the bucket waits for a full bucket
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float, now: float) -> None:
+        """Give back a reservation that was not used"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + min(amount, self.capacity))
+
+
+class _Quota:
+    def __init__(self, limits: Optional[Tuple[int, int]], now: float) -> None:
+        self.requests = TokenBucket(limits[0], now) if limits else None
+        self.tokens = TokenBucket(limits[1], now) if limits else None
+        self.paused_until = 0.0
+
+
+class RateLimiter:
+    """Request and token buckets per API key and model, with backoff on 429s.
+
+    Args:
+        limits: {model prefix: (requests, tokens) per minute}. Models without
+            limits are only backed off on 429s.
+        max_wait: The seconds a call may wait in total before giving up.
+        retries: The number of retries of a call that got a 429.
+        clock: Returns the current time in seconds (for tests).
+        sleep: Sleeps for a number of seconds (for tests).
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[int, int]],
+        max_wait: float = LLM_RATE_LIMIT_WAIT,
+        retries: int = LLM_RATE_LIMIT_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        max_keys: int = LLM_RATE_LIMIT_KEYS,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.limits = limits
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_keys = max_keys
+        self.clock = clock
+        self.sleep = sleep
+        self._quotas: OrderedDict[Tuple[str, str], _Quota] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "rate_limited": 0,
+            "retries": 0,
+            "rejected": 0,
+        }
+
+    def limits_for(self, model: str) -> Optional[Tuple[int, int]]:
+        """Return the limits of the longest model prefix matching a model"""
+        matches = [prefix for prefix in self.limits if model.startswith(prefix)]
+        return self.limits[max(matches, key=len)] if matches else None
+
+    def _quota(self, api_key: Optional[str], model: str) -> _Quota:
+        # the key is hashed so it is never kept in memory in clear
+        key = (hashlib.sha256((api_key or "").encode()).hexdigest(), model)
+        quota = self._quotas.get(key)
+        if quota is None:
+            quota = _Quota(self.limits_for(model), self.clock())
+            self._quotas[key] = quota
+        self._quotas.move_to_end(key)
+        while len(self._quotas) > self.max_keys:
+            self._quotas.popitem(last=False)
+        return quota
+
+    def acquire(
+        self, api_key: Optional[str], model: str, tokens: int, max_wait: float
+    ) -> float:
+        """Reserve one request and some tokens, waiting for them if needed
+
+        Returns:
+            float: The seconds waited
+
+        Raises:
+            RateLimitError: If the capacity is not available within max_wait
+        """
+        wait = self._reserve(api_key, model, tokens, max_wait)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    async def aacquire(
+        self, api_key: Optional[str], model: str, tokens: int, max_wait: float
+    ) -> float:
+        """Reserve one request and some tokens like acquire, waiting asynchronously"""
+        wait = self._reserve(api_key, model, tokens, max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def _reserve(
+        self, api_key: Optional[str], model: str, tokens: int, max_wait: float
+    ) -> float:
+        with self._lock:
+            now = self.clock()
+            quota = self._quota(api_key, model)
+            wait = max(0.0, quota.paused_until - now)
+            if quota.requests is not None:
+                wait = max(
+                    wait,
+                    quota.requests.reserve(1, now),
+                    quota.tokens.reserve(tokens, now),
+                )
+            if wait > max_wait:
+                if quota.requests is not None:
+                    quota.requests.refund(1, now)
+                    quota.tokens.refund(tokens, now)
+                self.counters["rejected"] += 1
+                raise RateLimitError(
+                    f"Rate limit of {model} would be exceeded for {wait:.1f} seconds"
+                )
+            if wait > 0:
+                self.counters["waits"] += 1
+                self.counters["wait_seconds"] += wait
+                self.counters["max_wait_seconds"] = max(
+                    self.counters["max_wait_seconds"], wait
+                )
+        return wait
+
+    def backoff(
+        self, api_key: Optional[str], model: str, attempt: int, after: Optional[float]
+    ) -> float:
+        """Pause a key and model after a 429 and return the pause in seconds
+
+        The pause is the Retry-After of the response when it has one, otherwise
+        an exponential backoff. Both are jittered so the callers that were paused
+        together do not retry together.
+        """
+        if after is None:
+            delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+            delay = random.uniform(delay / 2, delay)
+        else:
+            delay = after * random.uniform(1, 1.1)
+        with self._lock:
+            quota = self._quota(api_key, model)
+            quota.paused_until = max(quota.paused_until, self.clock() + delay)
+            self.counters["rate_limited"] += 1
+        return delay
+
+    def call(
+        self, api_key: Optional[str], model: str, tokens: int, fn: Callable[[], T]
+    ) -> T:
+        """Make a call within the limits of a key and model, retrying it on 429s
+
+        Args:
+            api_key (str): The API key the call is made with
+            model (str): The model called
+            tokens (int): The tokens the call counts against the quota
+            fn (Callable): Makes the call
+
+        Returns:
+            The result of fn
+
+        Raises:
+            RateLimitError: If the call is still limited after max_wait seconds
+                or the retries
+        """
+        deadline = self._start()
+        attempt = 0
+        while True:
+            waited = self.acquire(
+                api_key, model, tokens, max(0.0, deadline - self.clock())
+            )
+            self._waited(model, waited)
+            try:
+                return fn()
+            except RateLimitError as e:
+                self._retry(api_key, model, attempt, e)
+                attempt += 1
+
+    async def acall(
+        self,
+        api_key: Optional[str],
+        model: str,
+        tokens: int,
+        fn: Callable[[], Awaitable[T]],
+    ) -> T:
+        """Make an async call within the limits of a key and model, like call"""
+        deadline = self._start()
+        attempt = 0
+        while True:
+            waited = await self.aacquire(
+                api_key, model, tokens, max(0.0, deadline - self.clock())
+            )
+            self._waited(model, waited)
+            try:
+                return await fn()
+            except RateLimitError as e:
+                self._retry(api_key, model, attempt, e)
+                attempt += 1
+
+    def _start(self) -> float:
+        with self._lock:
+            self.counters["calls"] += 1
+        return self.clock() + self.max_wait
+
+    def _waited(self, model: str, waited: float) -> None:
+        if waited > 0:
+            print(f"RATE LIMITED, WAITED {waited:.2f} SECONDS", model)
+            observe_rate_limit_wait(model, waited)
+
+    def _retry(
+        self, api_key: Optional[str], model: str, attempt: int, e: RateLimitError
+    ) -> None:
+        if attempt >= self.retries:
+            raise e
+        self.backoff(api_key, model, attempt, retry_after(e))
+        with self._lock:
+            self.counters["retries"] += 1
+        observe_retry(model)
+
+    def stats(self) -> Dict[str, float]:
+        """Return the calls, waits, time waited, 429s, retries and rejections"""
+        with self._lock:
+            return {"keys": len(self._quotas), **self.counters}
+
+
+rate_limiter = RateLimiter(parse_limits(LLM_RATE_LIMITS, LLM_RATE_LIMIT_WORKERS))
@@ -0,0 +1,316 @@
+"""Per-user index of sessions, stored in Datastore.
+
+The sessions of a user are listed from a few ``SessionIndexPage`` entities under
+the ``User`` entity instead of querying every ``Agents`` entity. Each page holds
+up to ``SESSION_INDEX_PAGE_SIZE`` sessions, in the order they were created, and a
+``SessionIndex`` head entity records how many pages there are. Listing reads the
+head and the newest page, then one page per cursor.
+
+The page of a session is stored as ``index_page`` on its ``Agents`` entity, so it
+is only added to the index once and can be removed without a scan. The head also
+counts the sessions removed, so the workers that remember a session as indexed
+notice that it may have been removed by another. Users whose sessions predate
+the index are backfilled from the legacy query on first use.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.cloud import datastore
+
+SESSION_INDEX_KIND = "SessionIndex"
+SESSION_INDEX_PAGE_KIND = "SessionIndexPage"
+SESSION_INDEX_PAGE_SIZE = int(os.getenv("SESSION_INDEX_PAGE_SIZE", 100))
+SESSION_INDEX_CACHE_TTL = float(os.getenv("SESSION_INDEX_CACHE_TTL", 10))
+SESSION_INDEX_KNOWN_SIZE = int(os.getenv("SESSION_INDEX_KNOWN_SIZE", 10000))
+SESSION_FIELDS = ("agent_id", "ai_name", "ai_role", "created")
+
+
+def head_key(client: datastore.Client, user_id: str) -> datastore.Key:
+    return client.key("User", user_id, SESSION_INDEX_KIND, "head")
+
+
+def page_key(client: datastore.Client, user_id: str, page: int) -> datastore.Key:
+    return client.key("User", user_id, SESSION_INDEX_PAGE_KIND, page)
+
+
+def _new_page(client: datastore.Client, user_id: str, page: int) -> datastore.Entity:
+    entity = datastore.Entity(
+        key=page_key(client, user_id, page), exclude_from_indexes=("sessions",)
+    )
+    entity["sessions"] = []
+    return entity
+
+
+def _session_entry(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: session.get(field) for field in SESSION_FIELDS}
+
+
+def backfill_index(
+    client: datastore.Client,
+    user_id: str,
+    sessions: List[Dict[str, Any]],
+    page_size: int = SESSION_INDEX_PAGE_SIZE,
+) -> bool:
+    """Build the index of a user from their existing sessions, unless it exists
+
+    Returns:
+        bool: Whether the index was built
+    """
+    sessions = sorted(
+        sessions, key=lambda s: (s.get("created") is not None, s.get("created"))
+    )
+    with client.transaction():
+        if client.get(head_key(client, user_id)) is not None:
+            return False
+        pages = []
+        for start in range(0, len(sessions), page_size):
+            page = _new_page(client, user_id, len(pages) + 1)
+            page["sessions"] = [
+                _session_entry(s) for s in sessions[start : start + page_size]
+            ]
+            pages.append(page)
+        head = datastore.Entity(key=head_key(client, user_id))
+        head["pages"] = len(pages)
+        client.put_multi([head, *pages])
+    return True
+
+
+def find_session_page(
+    client: datastore.Client, user_id: str, agent_id: str
+) -> Optional[int]:
+    """Scan the index of a user for the page of a session, newest page first"""
+    head = client.get(head_key(client, user_id))
+    if head is None:
+        return None
+    for page in range(head.get("pages", 0), 0, -1):
+        entity = client.get(page_key(client, user_id, page))
+        if entity is not None and any(
+            s.get("agent_id") == agent_id for s in entity.get("sessions", [])
+        ):
+            return page
+    return None
+
+
+def add_session(
+    client: datastore.Client,
+    user_id: str,
+    session: Dict[str, Any],
+    page_size: int = SESSION_INDEX_PAGE_SIZE,
+) -> int:
+    """Add a session to the newest page of the index, starting a page if it is full
+
+    Returns:
+        int: The page the session was added to
+    """
+    entry = _session_entry(session)
+    with client.transaction():
+        head = client.get(head_key(client, user_id))
+        if head is None:
+            head = datastore.Entity(key=head_key(client, user_id))
+            head["pages"] = 0
+        last = head["pages"]
+        page = client.get(page_key(client, user_id, last)) if last else None
+        if page is not None:
+            for index, existing in enumerate(page["sessions"]):
+                if existing.get("agent_id") == entry["agent_id"]:
+                    page["sessions"][index] = entry
+                    client.put(page)
+                    return last
+        if page is None or len(page["sessions"]) >= page_size:
+            last += 1
+            head["pages"] = last
+            page = _new_page(client, user_id, last)
+        page["sessions"].append(entry)
+        client.put_multi([head, page])
+    return last
+
+
+def remove_session(
+    client: datastore.Client, user_id: str, agent_id: str, page: Optional[int]
+) -> None:
+    """Remove a session from a page of the index, or from wherever it is if unknown"""
+    if page is None:
+        page = find_session_page(client, user_id, agent_id)
+        if page is None:
+            return
+    with client.transaction():
+        entity = client.get(page_key(client, user_id, page))
+        if entity is None:
+            return
+        entity["sessions"] = [
+            s for s in entity.get("sessions", []) if s.get("agent_id") != agent_id
+        ]
+        head = client.get(head_key(client, user_id))
+        if head is None:
+            client.put(entity)
+            return
+        head["removals"] = head.get("removals", 0) + 1
+        client.put_multi([head, entity])
+
+
+def list_sessions(
+    client: datastore.Client, user_id: str, cursor: Optional[str] = None
+) -> Optional[Tuple[List[Dict[str, Any]], Optional[str]]]:
+    """Return a page of the sessions of a user, newest first
+
+    Args:
+        client: The Datastore client
+        user_id (str): The id of the user
+        cursor (str, optional): The cursor returned with the previous page
+
+    Returns:
+        tuple: The sessions and the cursor of the next page, or None on the last
+            page. None if the user has no index yet.
+    """
+    if cursor:
+        page = int(cursor)
+    else:
+        head = client.get(head_key(client, user_id))
+        if head is None:
+            return None
+        page = head.get("pages", 0)
+
+    sessions: List[Dict[str, Any]] = []
+    # skip pages emptied by deletes
+    while page > 0 and not sessions:
+        entity = client.get(page_key(client, user_id, page))
+        sessions = list(reversed((entity or {}).get("sessions", [])))
+        page -= 1
+    return sessions, str(page) if page > 0 else None
+
+
+class SessionIndex:
+    """Maintains the session index and caches it in process.
+
+    Args:
+        client: Returns the Datastore client.
+        legacy_sessions: Returns all the sessions of a user without the index,
+            used to backfill it.
+        cache_ttl: Seconds a listed page is served from the cache.
+        known_size: The number of sessions whose page is remembered, so steps
+            of an indexed session only read the head of the index.
+    """
+
+    def __init__(
+        self,
+        client: Callable[[], datastore.Client],
+        legacy_sessions: Callable[[str], List[Dict[str, Any]]],
+        cache_ttl: float = SESSION_INDEX_CACHE_TTL,
+        known_size: int = SESSION_INDEX_KNOWN_SIZE,
+    ) -> None:
+        self.client = client
+        self.legacy_sessions = legacy_sessions
+        self.cache_ttl = cache_ttl
+        self.known_size = known_size
+        self._pages: OrderedDict[
+            str, Dict[Optional[str], Tuple[float, Any]]
+        ] = OrderedDict()
+        # the page of a session and the removals of the index when it was seen
+        self._known: OrderedDict[Tuple[str, str], Tuple[int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.backfills = 0
+
+    def _invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._pages.pop(user_id, None)
+
+    def _remember(self, user_id: str, agent_id: str, page: int, removals: int) -> None:
+        with self._lock:
+            self._known[(user_id, agent_id)] = (page, removals)
+            self._known.move_to_end((user_id, agent_id))
+            while len(self._known) > self.known_size:
+                self._known.popitem(last=False)
+
+    def _backfill(self, user_id: str) -> None:
+        if backfill_index(self.client(), user_id, self.legacy_sessions(user_id)):
+            self.backfills += 1
+
+    def list_page(
+        self, user_id: str, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return a page of the sessions of a user, newest first, with the next cursor"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._pages.get(user_id, {}).get(cursor)
+            if cached is not None and cached[0] > now:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        result = list_sessions(self.client(), user_id, cursor)
+        if result is None:
+            self._backfill(user_id)
+            result = list_sessions(self.client(), user_id, cursor) or ([], None)
+
+        with self._lock:
+            self._pages.setdefault(user_id, {})[cursor] = (now + self.cache_ttl, result)
+            self._pages.move_to_end(user_id)
+            while len(self._pages) > self.known_size:
+                self._pages.popitem(last=False)
+        return result
+
+    def ensure(
+        self,
+        user_id: str,
+        session: Dict[str, Any],
+        stored: Callable[[], Optional[Dict[str, Any]]],
+    ) -> int:
+        """Add a session to the index unless it is already in it
+
+        Args:
+            user_id (str): The id of the user
+            session (dict): The agent_id, ai_name, ai_role and created of the session
+            stored (Callable): Returns the stored Agents entity of the session, or None
+
+        Returns:
+            int: The page of the session, to store as ``index_page`` on its entity
+        """
+        agent_id = session["agent_id"]
+        client = self.client()
+        head = client.get(head_key(client, user_id))
+        removals = (head or {}).get("removals", 0)
+        with self._lock:
+            known = self._known.get((user_id, agent_id))
+        # unless a session was removed since, by any worker, it is still indexed
+        if head is not None and known is not None and known[1] == removals:
+            return known[0]
+
+        entity = stored()
+        page = None
+        if entity is not None and not entity.get("deleted"):
+            page = entity.get("index_page")
+        if page is None:
+            if head is None:
+                self._backfill(user_id)
+            if entity is not None:
+                # created before the index, it may have been backfilled
+                page = find_session_page(client, user_id, agent_id)
+            if page is None:
+                page = add_session(client, user_id, session)
+                self._invalidate(user_id)
+        self._remember(user_id, agent_id, page, removals)
+        return page
+
+    def remove(self, user_id: str, agent_id: str, page: Optional[int] = None) -> None:
+        """Remove a session from the index"""
+        remove_session(self.client(), user_id, agent_id, page)
+        with self._lock:
+            self._known.pop((user_id, agent_id), None)
+        self._invalidate(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache hits and misses, and the number of backfilled users"""
+        with self._lock:
+            return {
+                "known": len(self._known),
+                "hits": self.hits,
+                "misses": self.misses,
+                "backfills": self.backfills,
+            }
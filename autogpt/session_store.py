@@ -0,0 +1,239 @@
+"""Server-side store for the message history of agent sessions.
+
+Clients used to send the whole message history with every step. The store
+keeps the history on the server, versioned per ``agent_id``, so clients only
+send the version they have and receive the messages appended since.
+
+With Redis (shared by the workers), Redis holds the current version of every
+session; the in-process LRU only saves reading the messages again when its copy
+has that version. Without Redis the LRU is used as long as it has the version
+the client expects. Sessions in neither are read by a loader, from the durable
+copy in Datastore. Writes are a compare-and-set on the version, so of two steps
+started from the same version only the first one is stored.
+"""
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1024))
+SESSION_REDIS_TTL = int(os.getenv("SESSION_REDIS_TTL", 60 * 60 * 24))
+SESSION_MAX_MESSAGES = 100
+
+# stores a session only if the stored version is the one the step started from
+PUT_SCRIPT = """
+local current = redis.call("hget", KEYS[1], "version")
+if current and tonumber(current) ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("hset", KEYS[1], "version", ARGV[2], "messages", ARGV[3])
+redis.call("expire", KEYS[1], ARGV[4])
+return 1
+"""
+
+
+@dataclasses.dataclass
+class Session:
+    """The message history of an agent and its version
+
+    The version is incremented by one for every step of the agent.
+    """
+
+    version: int
+    messages: List[Dict[str, str]] = dataclasses.field(default_factory=list)
+
+
+class HistoryVersionMismatch(Exception):
+    """The client's history version does not match the server's.
+
+    Also raised when a step is stored after another step of the same version.
+    """
+
+    def __init__(self, session: Optional[Session]) -> None:
+        super().__init__("Message history version mismatch")
+        self.session = session
+
+
+class SessionStore:
+    """Tiered, versioned store of agent message histories.
+
+    Args:
+        capacity: The maximum number of sessions kept in process.
+        redis_client: A redis client to share sessions between workers.
+        loader: Called with an agent id when the session is in neither cache,
+            returns the stored session or None.
+    """
+
+    def __init__(
+        self,
+        capacity: int = SESSION_CACHE_SIZE,
+        redis_client=None,
+        loader: Optional[Callable[[str], Optional[Session]]] = None,
+        redis_ttl: int = SESSION_REDIS_TTL,
+    ) -> None:
+        self.capacity = capacity
+        self.redis = redis_client
+        self.loader = loader
+        self.redis_ttl = redis_ttl
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _redis_key(agent_id: str) -> str:
+        return f"history:{agent_id}"
+
+    def _remember(self, agent_id: str, session: Session) -> None:
+        with self._lock:
+            cached = self._sessions.get(agent_id)
+            if cached is None or cached.version <= session.version:
+                self._sessions[agent_id] = session
+            self._sessions.move_to_end(agent_id)
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+
+    def _cached(self, agent_id: str, version: Optional[int]) -> Optional[Session]:
+        """Return the session in process if it has the version, or any without one"""
+        with self._lock:
+            session = self._sessions.get(agent_id)
+            if session is None or (version is not None and session.version != version):
+                return None
+            self._sessions.move_to_end(agent_id)
+            return session
+
+    def _shared(self, agent_id: str) -> Optional[Session]:
+        """Return the session in Redis, from the LRU when it has the same version"""
+        key = self._redis_key(agent_id)
+        version = self.redis.hget(key, "version")
+        if version is None:
+            return None
+        session = self._cached(agent_id, int(version))
+        if session is None:
+            # both at once, the session may have been written since
+            version, raw = self.redis.hmget(key, ["version", "messages"])
+            if version is None or raw is None:
+                return None
+            session = Session(int(version), json.loads(raw))
+        return session
+
+    def get(self, agent_id: str, version: Optional[int] = None) -> Optional[Session]:
+        """Return the session of an agent, or None if it is not stored anywhere
+
+        Args:
+            agent_id (str): The id of the agent
+            version (int, optional): The version the caller expects. Without
+                Redis, a session in process of another version, or any session
+                in process when no version is given, is read again by the loader.
+        """
+        session = None
+        if self.redis is not None:
+            try:
+                session = self._shared(agent_id)
+            except Exception as e:
+                print("Error reading session from Redis: ", e)
+        elif self.loader is None:
+            return self._cached(agent_id, None)
+        elif version is not None:
+            # another worker may have advanced a session of another version
+            session = self._cached(agent_id, version)
+            if session is not None:
+                return session
+
+        if session is None and self.loader is not None:
+            session = self.loader(agent_id)
+
+        if session is not None:
+            self._remember(agent_id, session)
+        return session
+
+    def put(
+        self, agent_id: str, session: Session, expected_version: Optional[int] = None
+    ) -> None:
+        """Store a session, keeping only the most recent messages
+
+        Args:
+            agent_id (str): The id of the agent
+            session (Session): The session after the step
+            expected_version (int, optional): The version the step started from.
+                Defaults to the version before the session's.
+
+        Raises:
+            HistoryVersionMismatch: If the stored version is not the expected one
+        """
+        if expected_version is None:
+            expected_version = session.version - 1
+        session = Session(session.version, session.messages[-SESSION_MAX_MESSAGES:])
+        if self.redis is not None:
+            try:
+                stored = self.redis.eval(
+                    PUT_SCRIPT,
+                    1,
+                    self._redis_key(agent_id),
+                    expected_version,
+                    session.version,
+                    json.dumps(session.messages),
+                    self.redis_ttl,
+                )
+            except Exception as e:
+                # the Datastore write is checked too; the next read falls back to it
+                print("Error writing session to Redis: ", e)
+                self.invalidate(agent_id)
+                return
+            if not stored:
+                raise HistoryVersionMismatch(self.get(agent_id))
+        else:
+            with self._lock:
+                cached = self._sessions.get(agent_id)
+            # an older copy is stale; the Datastore write was checked already
+            if cached is not None and cached.version > expected_version:
+                raise HistoryVersionMismatch(cached)
+        self._remember(agent_id, session)
+
+    def invalidate(self, agent_id: str) -> None:
+        """Forget the session of an agent, so the next read goes to the loader"""
+        with self._lock:
+            self._sessions.pop(agent_id, None)
+        if self.redis is not None:
+            try:
+                self.redis.delete(self._redis_key(agent_id))
+            except Exception as e:
+                print("Error deleting session from Redis: ", e)
+
+    def resolve(
+        self,
+        agent_id: str,
+        version: Optional[int],
+        delta: Optional[List[Dict[str, str]]] = None,
+        full_history: Optional[List[Dict[str, str]]] = None,
+    ) -> Session:
+        """Work out the history a step starts from
+
+        A client that sends a full history (the legacy protocol, or a resync)
+        replaces the stored history. Otherwise the client's version has to match
+        the stored one, and its new messages are appended.
+
+        Args:
+            agent_id (str): The id of the agent
+            version (int, optional): The history version the client has
+            delta (list, optional): Messages the client appended since that version
+            full_history (list, optional): The client's full message history
+
+        Returns:
+            Session: The history to run the step with
+
+        Raises:
+            HistoryVersionMismatch: If the client has to resync its history
+        """
+        if full_history is not None:
+            if version is None:
+                stored = self.get(agent_id)
+                version = stored.version if stored is not None else 0
+            return Session(version, list(full_history) + list(delta or []))
+
+        session = self.get(agent_id, version)
+        if session is None or version is None or session.version != version:
+            raise HistoryVersionMismatch(session)
+        return Session(session.version, session.messages + list(delta or []))
@@ -0,0 +1,320 @@
+"""Coalescing of concurrent identical LLM requests ("singleflight").
+
+When an identical deterministic request is already in flight, e.g. the
+embedding of the same memory text or the subgoals of a popular goal, callers
+wait for its result instead of sending their own request. Within a worker the
+waiting callers share the result of the call. Across workers, with Redis, the
+first worker takes a lock on the request; the others wait until it is released
+and then read the result from the shared cache the first worker stored it in.
+
+Only requests whose result is cached are coalesced: chat completions made with
+``cache=True`` and embeddings. Their keys include the credentials of the call,
+so a request is only made with the API key of the callers waiting for it, and
+only they see its errors.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from autogpt.llm_cache import build_redis_client
+
+# share the calls of all the workers through Redis locks
+LLM_SINGLEFLIGHT_REDIS = os.getenv("LLM_SINGLEFLIGHT_REDIS", "False") == "True"
+# the longest a worker holds the lock on a request, in seconds
+LLM_SINGLEFLIGHT_LOCK_TTL = float(os.getenv("LLM_SINGLEFLIGHT_LOCK_TTL", 120))
+# the longest a worker waits for the lock of another worker, in seconds
+LLM_SINGLEFLIGHT_WAIT = float(os.getenv("LLM_SINGLEFLIGHT_WAIT", 60))
+LLM_SINGLEFLIGHT_POLL = float(os.getenv("LLM_SINGLEFLIGHT_POLL", 0.05))
+REDIS_PREFIX = "singleflight:"
+
+# deletes the lock only if it is still ours
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """A call in flight and, once it is done, its result or error."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        # futures of the callers waiting on event loops, with their loops
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._lock = threading.Lock()
+
+    async def wait(self) -> None:
+        """Wait until the call is done, on the running event loop
+
+        Unlike waiting for the event on a thread, the wait is cancelled with the
+        task awaiting it.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.done.is_set():
+                return
+            self._waiters.append((loop, future))
+        await future
+
+    def finish(self) -> None:
+        """Mark the call done and wake up its callers"""
+        with self._lock:
+            self.done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # the loop of the caller is closed
+                pass
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """Makes one call for all the concurrent callers with the same key.
+
+    Args:
+        redis_client: Redis for the locks across workers, or None for calls
+            coalesced within the worker only.
+        lock_ttl: The longest a worker holds the lock on a call.
+        wait: The longest a worker waits for the lock of another worker before
+            it makes the call itself.
+        poll: The seconds between checks of the lock of another worker.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        lock_ttl: float = LLM_SINGLEFLIGHT_LOCK_TTL,
+        wait: float = LLM_SINGLEFLIGHT_WAIT,
+        poll: float = LLM_SINGLEFLIGHT_POLL,
+    ) -> None:
+        self.redis = redis_client
+        self.lock_ttl = lock_ttl
+        self.wait = wait
+        self.poll = poll
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0,
+            "coalesced": 0,
+            "remote_coalesced": 0,
+            "lock_waits_expired": 0,
+            "errors": 0,
+        }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _join(self, key: str) -> Tuple[_Flight, bool]:
+        """Return the flight of a key, and whether the caller makes the call"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.counters["coalesced"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key: str, flight: _Flight, result, error) -> None:
+        flight.result, flight.error = result, error
+        with self._lock:
+            del self._flights[key]
+        flight.finish()
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], T],
+        lookup: Optional[Callable[[], Optional[T]]] = None,
+    ) -> T:
+        """Call fn, unless an identical call is in flight, and return its result
+
+        Args:
+            key (str): Identifies identical calls made with the same credentials
+            fn (Callable): Makes the call, and stores its result where lookup
+                finds it
+            lookup (Callable, optional): Returns the stored result of an
+                identical call, or None. Without it calls are only coalesced
+                within the worker.
+
+        Returns:
+            The result of fn, or of the identical call
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            if flight.error is None:
+                return flight.result  # type: ignore
+            if isinstance(flight.error, Exception):
+                raise flight.error
+            # the call was cancelled or timed out with its caller, not failed
+            return self.do(key, fn, lookup)
+        try:
+            result = self._lead(key, fn, lookup)
+        except BaseException as e:
+            self._land(key, flight, None, e)
+            raise
+        self._land(key, flight, result, None)
+        return result
+
+    async def ado(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[T]],
+        lookup: Optional[Callable[[], Optional[T]]] = None,
+    ) -> T:
+        """Call fn like do, asynchronously"""
+        flight, leader = self._join(key)
+        if not leader:
+            # the call may be made by another thread or event loop
+            await flight.wait()
+            if flight.error is None:
+                return flight.result  # type: ignore
+            if isinstance(flight.error, Exception):
+                raise flight.error
+            return await self.ado(key, fn, lookup)
+        try:
+            result = await self._alead(key, fn, lookup)
+        except BaseException as e:
+            self._land(key, flight, None, e)
+            raise
+        self._land(key, flight, result, None)
+        return result
+
+    def _lead(self, key: str, fn: Callable[[], T], lookup) -> T:
+        """Make a call, or wait for the worker that holds its lock"""
+        if self.redis is None or lookup is None:
+            self._count("calls")
+            return fn()
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.wait
+        while True:
+            acquired = self._acquire(key, token)
+            if acquired is None or acquired:
+                try:
+                    # the other worker may have finished since the cache missed
+                    result = lookup() if acquired else None
+                    if result is not None:
+                        self._count("remote_coalesced")
+                        return result
+                    self._count("calls")
+                    return fn()
+                finally:
+                    if acquired:
+                        self._release(key, token)
+            while self._locked(key) and time.time() < deadline:
+                time.sleep(self.poll)
+            result = self._waited(lookup)
+            if result is not None:
+                return result
+            if time.time() >= deadline:
+                self._count("lock_waits_expired")
+                self._count("calls")
+                return fn()
+
+    async def _alead(self, key: str, fn: Callable[[], Awaitable[T]], lookup) -> T:
+        if self.redis is None or lookup is None:
+            self._count("calls")
+            return await fn()
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.wait
+        while True:
+            acquired = self._acquire(key, token)
+            if acquired is None or acquired:
+                try:
+                    result = lookup() if acquired else None
+                    if result is not None:
+                        self._count("remote_coalesced")
+                        return result
+                    self._count("calls")
+                    return await fn()
+                finally:
+                    if acquired:
+                        self._release(key, token)
+            while self._locked(key) and time.time() < deadline:
+                await asyncio.sleep(self.poll)
+            result = self._waited(lookup)
+            if result is not None:
+                return result
+            if time.time() >= deadline:
+                self._count("lock_waits_expired")
+                self._count("calls")
+                return await fn()
+
+    def _waited(self, lookup):
+        """Return the result of the other worker once its lock is gone, or None
+
+        None when it failed, or still holds the lock after the wait.
+        """
+        result = lookup()
+        if result is not None:
+            self._count("remote_coalesced")
+        return result
+
+    def _acquire(self, key: str, token: str) -> Optional[bool]:
+        """Take the lock on a call, None if Redis failed"""
+        try:
+            return bool(
+                self.redis.set(
+                    REDIS_PREFIX + key, token, nx=True, px=int(self.lock_ttl * 1000)
+                )
+            )
+        except Exception as e:
+            self._count("errors")
+            print("Singleflight lock failed", e)
+            return None
+
+    def _locked(self, key: str) -> bool:
+        try:
+            return bool(self.redis.exists(REDIS_PREFIX + key))
+        except Exception as e:
+            self._count("errors")
+            print("Singleflight lock check failed", e)
+            return False
+
+    def _release(self, key: str, token: str) -> None:
+        try:
+            self.redis.eval(RELEASE_SCRIPT, 1, REDIS_PREFIX + key, token)
+        except Exception as e:
+            self._count("errors")
+            print("Singleflight unlock failed", e)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the calls made and those saved within and across workers"""
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "saved": self.counters["coalesced"] + self.counters["remote_coalesced"],
+                **self.counters,
+            }
+
+
+def build_singleflight() -> SingleFlight:
+    """Build the coalescing layer from the environment
+
+    Calls are coalesced across workers when LLM_SINGLEFLIGHT_REDIS is True and
+    a Redis host is configured.
+    """
+    redis_client = build_redis_client() if LLM_SINGLEFLIGHT_REDIS else None
+    return SingleFlight(redis_client)
+
+
+singleflight = build_singleflight()
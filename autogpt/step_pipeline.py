@@ -0,0 +1,245 @@
+"""Helpers for running the phases of an agent step concurrently.
+
+The agent step is mostly waiting on the network (OpenAI, Pinecone, GCS,
+Datastore). Every blocking phase is run on a shared thread pool from an asyncio
+event loop so that independent phases overlap, and the time spent in each phase
+is recorded so the critical path of a step can be inspected.
+
+The step deadline also bounds the blocking calls of its phases: they take their
+timeouts from ``phase_timeout``, so a phase still running when the deadline
+passes gives its thread back shortly after instead of holding it.
+
+Under gevent (the gevent gunicorn worker) an asyncio event loop cannot run per
+greenlet, so phases run on greenlets instead and the step coroutine is driven
+directly, blocking its own greenlet only.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from autogpt.green import gevent_patched
+
+T = TypeVar("T")
+
+# seconds a step may take before the request fails, 0 for no deadline
+STEP_DEADLINE = float(os.getenv("STEP_DEADLINE", 300))
+# steps a worker runs at once, 0 for no cap; gunicorn.conf.py sets it to the
+# threads of a gthread worker
+MAX_CONCURRENT_STEPS = int(os.getenv("MAX_CONCURRENT_STEPS", 64))
+# seconds a request waits for a free step slot before being turned away
+STEP_SLOT_WAIT = float(os.getenv("STEP_SLOT_WAIT", 5))
+# phases of a step on the thread pool at once (memory_add, datastore_get and
+# chat_with_ai)
+PHASES_PER_STEP = 3
+# enough threads for every step the worker may run; without a cap, threads are
+# only started when needed
+STEP_PIPELINE_THREADS = PHASES_PER_STEP * (MAX_CONCURRENT_STEPS or 256)
+# the shortest timeout given to a call made after the deadline of its step
+MIN_PHASE_TIMEOUT = 1.0
+
+_executor = ThreadPoolExecutor(
+    max_workers=STEP_PIPELINE_THREADS, thread_name_prefix="step-phase"
+)
+
+# when the current step has to be done, in time.time() seconds
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "step_deadline", default=None
+)
+
+
+def phase_timeout(timeout: float) -> float:
+    """Return the timeout of a blocking call, cut to the deadline of its step
+
+    Args:
+        timeout (float): The timeout of the call outside of a step
+
+    Returns:
+        float: The timeout, at most the seconds left until the step deadline
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return timeout
+    return min(timeout, max(deadline - time.time(), MIN_PHASE_TIMEOUT))
+
+
+class PhaseTimer:
+    """Records the wall-clock duration of every phase of a step."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    async def run(self, name: str, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run a blocking function on the phase thread pool (or a greenlet) and time it
+
+        The current context is copied into the worker thread, so request-scoped
+        context variables (e.g. the Flask request) stay available.
+
+        Args:
+            name (str): The name of the phase
+            fn (Callable): The blocking function to run
+
+        Returns:
+            The return value of the function
+        """
+        if gevent_patched():
+            return await self.spawn(name, fn, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return await loop.run_in_executor(_executor, call)
+        finally:
+            self.phases[name] = round(time.perf_counter() - t0, 4)
+
+    def spawn(self, name: str, fn: Callable[..., T], *args, **kwargs) -> Awaitable[T]:
+        """Start a phase in the background and return its task"""
+        if gevent_patched():
+            return _GreenPhase(self, name, fn, *args, **kwargs)
+        return asyncio.ensure_future(self.run(name, fn, *args, **kwargs))
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the phase durations and the total step duration in seconds"""
+        return {
+            "phases": dict(self.phases),
+            "total": round(time.perf_counter() - self.started, 4),
+        }
+
+
+async def settle(*tasks: Awaitable, raise_error: bool = True) -> List[BaseException]:
+    """Wait for all tasks to finish, then re-raise the first failure, if any
+
+    Unlike a bare ``asyncio.gather`` this never leaves a side effect running in
+    the background when a sibling phase fails.
+
+    Args:
+        tasks: The tasks of the phases
+        raise_error (bool): Re-raise the first failure. While another error is
+            being raised, pass False so the failures do not replace it.
+
+    Returns:
+        list: The failures of the tasks
+    """
+    if gevent_patched():
+        results = [task.wait() for task in tasks]  # type: ignore
+    else:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors and raise_error:
+        raise errors[0]
+    return errors
+
+
+class _GreenPhase:
+    """A phase running on a greenlet, awaited by blocking the calling greenlet."""
+
+    def __init__(self, timer: PhaseTimer, name: str, fn: Callable, *args, **kwargs):
+        import gevent
+
+        ctx = contextvars.copy_context()
+        started = time.perf_counter()
+
+        def call():
+            try:
+                return ctx.run(fn, *args, **kwargs)
+            finally:
+                timer.phases[name] = round(time.perf_counter() - started, 4)
+
+        self.greenlet = gevent.spawn(call)
+
+    def wait(self) -> Any:
+        """Wait for the phase, returning its result or its exception"""
+        self.greenlet.join()
+        if self.greenlet.successful():
+            return self.greenlet.value
+        return self.greenlet.exception
+
+    def __await__(self):
+        self.greenlet.join()
+        return self.greenlet.get()
+        yield  # makes this a generator, it never actually suspends
+
+
+def _drive(step: Awaitable[T]) -> T:
+    """Run a coroutine whose awaits all block (green phases) to completion"""
+    try:
+        step.send(None)  # type: ignore
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("A green step suspended on a non-green awaitable")
+
+
+def run_with_deadline(step: Awaitable[T], deadline: float = STEP_DEADLINE) -> T:
+    """Run a step on a new event loop, cancelling it after a deadline
+
+    Phases already running on the thread pool finish in the background, but no
+    further phase of a cancelled step is started. Their calls time out with the
+    deadline (see phase_timeout).
+
+    Raises:
+        asyncio.TimeoutError: If the step did not finish in time
+    """
+    token = _deadline.set(time.time() + deadline if deadline > 0 else None)
+    try:
+        if gevent_patched():
+            import gevent
+
+            try:
+                with gevent.Timeout(deadline if deadline > 0 else None):
+                    return _drive(step)
+            except gevent.Timeout:
+                raise asyncio.TimeoutError() from None
+        if deadline > 0:
+            step = asyncio.wait_for(step, deadline)
+        return asyncio.run(step)
+    finally:
+        _deadline.reset(token)
+
+
+class StepSlots:
+    """Caps the number of steps a worker runs at once.
+
+    Args:
+        limit: The maximum number of concurrent steps, 0 for no cap.
+        wait: Seconds to wait for a free slot before giving up.
+    """
+
+    def __init__(
+        self, limit: int = MAX_CONCURRENT_STEPS, wait: float = STEP_SLOT_WAIT
+    ) -> None:
+        self.limit = limit
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(limit) if limit > 0 else None
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def acquire(self) -> bool:
+        """Take a slot, returns False if none freed up in time"""
+        if self._slots is not None and not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.active += 1
+        return True
+
+    def release(self) -> None:
+        """Give back a slot taken with acquire"""
+        with self._lock:
+            self.active -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cap, the steps running and the requests turned away"""
+        with self._lock:
+            return {"limit": self.limit, "active": self.active, "rejected": self.rejected}
@@ -0,0 +1,176 @@
+"""Append-only log of the tasks an agent has run, stored in Datastore.
+
+Every task is its own ``Task`` entity under the ``Agent`` entity, keyed by its
+position in the log, so a step writes one small entity and updates the previous
+one by key instead of rewriting an ever-growing list.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from google.cloud import datastore
+
+TASK_KIND = "Task"
+TASK_PAGE_SIZE = 50
+MAX_TASK_PAGE_SIZE = 200
+# Datastore accepts at most 500 entities per commit
+PUT_BATCH_SIZE = 500
+TASK_EXCLUDE_FROM_INDEXES = ("result", "arguments")
+
+
+def task_key(client: datastore.Client, agent_id: str, index: int) -> datastore.Key:
+    """Return the key of the task at a position of the log (0-based)"""
+    # numeric ids must be positive
+    return client.key("Agent", agent_id, TASK_KIND, index + 1)
+
+
+def new_task(
+    client: datastore.Client, agent_id: str, index: int, fields: Dict[str, Any]
+) -> datastore.Entity:
+    """Create the entity of a task"""
+    task = datastore.Entity(
+        key=task_key(client, agent_id, index),
+        exclude_from_indexes=TASK_EXCLUDE_FROM_INDEXES,
+    )
+    task.update(fields)
+    return task
+
+
+def embedded_task_entities(
+    client: datastore.Client, agent_id: str, tasks: List[Dict[str, Any]]
+) -> List[datastore.Entity]:
+    """Create the entities of the tasks of an agent stored as a list on its entity"""
+    return [
+        new_task(client, agent_id, index, dict(task)) for index, task in enumerate(tasks)
+    ]
+
+
+def migrate_embedded_tasks(
+    client: datastore.Client, agent_id: str, tasks: List[Dict[str, Any]]
+) -> int:
+    """Move the tasks of an agent stored as a list on its entity into the log
+
+    Returns:
+        int: The number of tasks in the log
+    """
+    entities = embedded_task_entities(client, agent_id, tasks)
+    for start in range(0, len(entities), PUT_BATCH_SIZE):
+        client.put_multi(entities[start : start + PUT_BATCH_SIZE])
+    return len(entities)
+
+
+def task_entities(
+    client: datastore.Client,
+    agent_id: str,
+    index: int,
+    fields: Dict[str, Any],
+    previous_updates: Optional[Dict[str, Any]] = None,
+    fill_pending_name=None,
+    unsaved: Sequence[datastore.Entity] = (),
+) -> List[datastore.Entity]:
+    """Return the entities to put to add a task to the log and update the task
+    before it. Call it in the transaction that puts them.
+
+    Args:
+        client: The Datastore client
+        agent_id (str): The id of the agent
+        index (int): The position of the new task
+        fields (dict): The properties of the new task
+        previous_updates (dict, optional): Properties to set on the previous task
+        fill_pending_name (Callable, optional): Called with the previous task if its
+            name is still a placeholder, returns the real name or None
+        unsaved (list, optional): Tasks put in the same commit; the previous task
+            is updated in place if it is one of them, and not returned
+
+    Returns:
+        list: The new task, after the previous one if it has to be put
+    """
+    task = new_task(client, agent_id, index, fields)
+    if index == 0 or not previous_updates:
+        return [task]
+
+    previous_key = task_key(client, agent_id, index - 1)
+    previous = next((entity for entity in unsaved if entity.key == previous_key), None)
+    entities = [task]
+    if previous is None:
+        previous = client.get(previous_key)
+        if previous is None:
+            return entities
+        entities.insert(0, previous)
+
+    previous.update(previous_updates)
+    if previous.get("task_name_pending") and fill_pending_name is not None:
+        name = fill_pending_name(previous)
+        if name:
+            previous.update({"task_name": name, "task_name_pending": False})
+    return entities
+
+
+def append_task(
+    client: datastore.Client,
+    agent_id: str,
+    index: int,
+    fields: Dict[str, Any],
+    previous_updates: Optional[Dict[str, Any]] = None,
+    fill_pending_name=None,
+) -> None:
+    """Add a task to the log and update the task before it
+
+    Takes the arguments of task_entities.
+    """
+    with client.transaction():
+        client.put_multi(
+            task_entities(
+                client, agent_id, index, fields, previous_updates, fill_pending_name
+            )
+        )
+
+
+def set_task_name(
+    client: datastore.Client, agent_id: str, index: int, task_name: str
+) -> None:
+    """Replace the placeholder name of a task"""
+    with client.transaction():
+        task = client.get(task_key(client, agent_id, index))
+        if task is None or not task.get("task_name_pending"):
+            return
+        task.update({"task_name": task_name, "task_name_pending": False})
+        client.put(task)
+
+
+def list_tasks(
+    client: datastore.Client,
+    agent_id: str,
+    limit: int = TASK_PAGE_SIZE,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return a page of the task log, oldest first
+
+    Args:
+        client: The Datastore client
+        agent_id (str): The id of the agent
+        limit (int): The maximum number of tasks to return
+        cursor (str, optional): The cursor returned with the previous page
+
+    Returns:
+        tuple: The tasks and the cursor of the next page, or None on the last page
+    """
+    limit = max(1, min(limit, MAX_TASK_PAGE_SIZE))
+    query = client.query(kind=TASK_KIND, ancestor=client.key("Agent", agent_id))
+    query.order = ["__key__"]
+    iterator = query.fetch(
+        limit=limit, start_cursor=cursor.encode() if cursor else None
+    )
+    page = next(iterator.pages, [])
+    tasks = []
+    for entity in page:
+        task = dict(entity)
+        task["index"] = entity.key.id - 1
+        tasks.append(task)
+
+    next_cursor = iterator.next_page_token
+    if len(tasks) < limit or not next_cursor:
+        return tasks, None
+    if isinstance(next_cursor, bytes):
+        next_cursor = next_cursor.decode()
+    return tasks, next_cursor
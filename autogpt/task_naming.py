@@ -0,0 +1,168 @@
+"""Background generation of the short task names shown for each agent step.
+
+Naming a task costs a full LLM round trip, so it is kept off the request path:
+the step is stored with a cached or placeholder name, and a worker pool asks the
+model for the real name and patches the stored task once it is known.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+TASK_NAMING_THREADS = int(os.getenv("TASK_NAMING_THREADS", 4))
+TASK_NAME_CACHE_SIZE = int(os.getenv("TASK_NAME_CACHE_SIZE", 4096))
+PLACEHOLDER_MAX_LENGTH = 80
+
+
+def _normalize_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {str(k): _normalize_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(v) for v in value]
+    return value
+
+
+def normalize_task(command_name: str, arguments: Any) -> str:
+    """Return the cache key of a task
+
+    Command names and string arguments are compared case- and
+    whitespace-insensitively, and argument order does not matter.
+
+    Args:
+        command_name (str): The name of the command
+        arguments (Any): The arguments of the command, as a dict or a JSON string
+
+    Returns:
+        str: The normalized key
+    """
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except json.JSONDecodeError:
+            pass
+    return json.dumps(
+        [_normalize_value(command_name or ""), _normalize_value(arguments)],
+        sort_keys=True,
+        default=str,
+    )
+
+
+def placeholder_task_name(command_name: str, arguments: Any) -> str:
+    """Build a readable task name without asking the model"""
+    if isinstance(arguments, dict) and arguments:
+        detail = ", ".join(str(v) for v in arguments.values())
+    else:
+        detail = str(arguments or "")
+    name = f"{command_name}: {detail}" if detail else str(command_name)
+    if len(name) > PLACEHOLDER_MAX_LENGTH:
+        name = name[: PLACEHOLDER_MAX_LENGTH - 3] + "..."
+    return name
+
+
+class TaskNamer:
+    """Names tasks on a background worker pool, caching names by normalized task.
+
+    Args:
+        name_fn: Called as ``name_fn(cfg, command_name, arguments)`` and returns
+            the task name, or None if naming failed.
+        max_workers: The number of naming threads.
+        cache_size: The maximum number of cached names.
+    """
+
+    def __init__(
+        self,
+        name_fn: Callable[[Any, str, Any], Optional[str]],
+        max_workers: int = TASK_NAMING_THREADS,
+        cache_size: int = TASK_NAME_CACHE_SIZE,
+    ) -> None:
+        self.name_fn = name_fn
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._pending: Dict[str, List[Callable[[str], None]]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="task-naming"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, command_name: str, arguments: Any) -> Optional[str]:
+        """Return the cached name of a task, if there is one"""
+        key = normalize_task(command_name, arguments)
+        with self._lock:
+            name = self._cache.get(key)
+            if name is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return name
+
+    def submit(
+        self,
+        cfg,
+        command_name: str,
+        arguments: Any,
+        on_named: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """Name a task in the background
+
+        Identical tasks that are already being named share the same model call.
+
+        Args:
+            cfg: The config to call the model with
+            command_name (str): The name of the command
+            arguments (Any): The arguments of the command
+            on_named (Callable, optional): Called with the name once it is known
+        """
+        key = normalize_task(command_name, arguments)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                callbacks = self._pending.get(key)
+                if callbacks is not None:
+                    if on_named is not None:
+                        callbacks.append(on_named)
+                    return
+                self._pending[key] = [on_named] if on_named is not None else []
+        if cached is not None:
+            if on_named is not None:
+                on_named(cached)
+            return
+        self._executor.submit(self._name, key, cfg, command_name, arguments)
+
+    def _name(self, key: str, cfg, command_name: str, arguments: Any) -> None:
+        name = None
+        try:
+            name = self.name_fn(cfg, command_name, arguments)
+        finally:
+            with self._lock:
+                callbacks = self._pending.pop(key, [])
+                if name:
+                    self._cache[key] = name
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        if not name:
+            return
+        for callback in callbacks:
+            try:
+                callback(name)
+            except Exception as e:
+                print("Failed to store task name", e)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache size, hit and miss counts and pending namings"""
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "pending": len(self._pending),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,10 +1,117 @@
-"""Functions for counting the number of tokens in a message or string."""
+"""Functions for counting the number of tokens in a message or string.
+
+The encodings of the models used last are kept. The batch functions count
+many messages or strings in one call, encoded by tiktoken on several threads.
+"""
 from __future__ import annotations
 
+import functools
+import os
+import threading
+from typing import Dict, List, Set, Tuple
+
 import tiktoken
 
 from autogpt.logs import logger
 
+# threads encoding the texts of a batch, at most one per CPU
+TOKEN_COUNTER_THREADS = int(os.getenv("TOKEN_COUNTER_THREADS", 8))
+
+# models that may change over time, counted as the snapshot they pointed to
+MODEL_ALIASES = {
+    "gpt-3.5-turbo": "gpt-3.5-turbo-0301",
+    "gpt-4": "gpt-4-0314",
+}
+# tokens per message and per name, by model prefix; see
+# https://github.com/openai/openai-python/blob/main/chatml.md
+MESSAGE_OVERHEADS: Dict[str, Tuple[int, int]] = {
+    # every message follows <|start|>{role/name}\n{content}<|end|>\n, and if
+    # there's a name, the role is omitted
+    "gpt-3.5-turbo-0301": (4, -1),
+    "gpt-3.5-turbo": (3, 1),
+    "gpt-4": (3, 1),
+}
+# the overheads of the models not listed, as the current chat models
+DEFAULT_MESSAGE_OVERHEAD = (3, 1)
+# the encoding of the models tiktoken does not know
+DEFAULT_ENCODING = "cl100k_base"
+# the models whose encoding is kept; the names come from clients
+ENCODING_CACHE_SIZE = 64
+# every reply is primed with <|start|>assistant<|message|>
+REPLY_TOKENS = 3
+
+_lock = threading.Lock()
+# the models warned about, once each
+_unknown_models: Set[str] = set()
+
+
+@functools.lru_cache(maxsize=ENCODING_CACHE_SIZE)
+def encoding_for(model: str, fallback: str | None = None) -> tiktoken.Encoding:
+    """
+    Returns the encoding of a model, kept for the models used last.
+
+    Args:
+        model (str): The name of the model.
+        fallback (str, optional): The encoding of models tiktoken does not know.
+
+    Returns:
+        Encoding: The encoding.
+
+    Raises:
+        KeyError: If tiktoken does not know the model and there is no fallback.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        if fallback is None:
+            raise
+        logger.warn(f"Warning: model not found. Using {fallback} encoding.")
+        return tiktoken.get_encoding(fallback)
+
+
+def _encode_lengths(encoding: tiktoken.Encoding, texts: List[str]) -> List[int]:
+    """Return the number of tokens of every text
+
+    tiktoken encodes without the GIL, so the texts are encoded on several
+    threads when there are several CPUs.
+    """
+    threads = min(TOKEN_COUNTER_THREADS, os.cpu_count() or 1, len(texts))
+    if threads <= 1:
+        return [len(encoding.encode(text)) for text in texts]
+    batch = encoding.encode_batch(texts, num_threads=threads)
+    return [len(tokens) for tokens in batch]
+
+
+def message_overhead(model: str) -> Tuple[int, int]:
+    """
+    Returns the tokens every message and every name cost on top of their text.
+
+    Models whose message format is not known are counted as the current chat
+    models, with a warning.
+
+    Args:
+        model (str): The name of the model.
+
+    Returns:
+        tuple: The tokens per message and the tokens per name.
+    """
+    model = MODEL_ALIASES.get(model, model)
+    prefixes = [prefix for prefix in MESSAGE_OVERHEADS if model.startswith(prefix)]
+    if not prefixes:
+        with _lock:
+            # the names come from clients, so only so many are remembered
+            warn = model not in _unknown_models and len(_unknown_models) < 100
+            if warn:
+                _unknown_models.add(model)
+        if warn:
+            logger.warn(
+                f"Warning: message format of model {model} not known. Counting"
+                f" {DEFAULT_MESSAGE_OVERHEAD[0]} tokens per message, see"
+                " https://github.com/openai/openai-python/blob/main/chatml.md"
+            )
+        return DEFAULT_MESSAGE_OVERHEAD
+    return MESSAGE_OVERHEADS[max(prefixes, key=len)]
+
 
 def count_message_tokens(
     messages: list[dict[str, str]], model: str = "gpt-3.5-turbo-0301"
@@ -21,32 +128,8 @@ def count_message_tokens(
     Returns:
         int: The number of tokens used by the list of messages.
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.warn("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo":
-        # !Note: gpt-3.5-turbo may change over time.
-        # Returning num tokens assuming gpt-3.5-turbo-0301.")
-        return count_message_tokens(messages, model="gpt-3.5-turbo-0301")
-    elif model == "gpt-4":
-        # !Note: gpt-4 may change over time. Returning num tokens assuming gpt-4-0314.")
-        return count_message_tokens(messages, model="gpt-4-0314")
-    elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = (
-            4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        )
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model == "gpt-4-0314":
-        tokens_per_message = 3
-        tokens_per_name = 1
-    else:
-        raise NotImplementedError(
-            f"num_tokens_from_messages() is not implemented for model {model}.\n"
-            " See https://github.com/openai/openai-python/blob/main/chatml.md for"
-            " information on how messages are converted to tokens."
-        )
+    tokens_per_message, tokens_per_name = message_overhead(model)
+    encoding = encoding_for(MODEL_ALIASES.get(model, model), DEFAULT_ENCODING)
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
@@ -54,10 +137,39 @@ def count_message_tokens(
             num_tokens += len(encoding.encode(value))
             if key == "name":
                 num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    num_tokens += REPLY_TOKENS
     return num_tokens
 
 
+def count_each_message_tokens(
+    messages: list[dict[str, str]], model: str = "gpt-3.5-turbo-0301"
+) -> List[int]:
+    """
+    Returns the number of tokens of every message of a list, in one batch.
+
+    Args:
+        messages (list): A list of messages.
+        model (str): The name of the model to use for tokenization.
+
+    Returns:
+        list: The tokens of every message, as count_message_tokens([message])
+            counts them.
+    """
+    tokens_per_message, tokens_per_name = message_overhead(model)
+    encoding = encoding_for(MODEL_ALIASES.get(model, model), DEFAULT_ENCODING)
+    values = [value for message in messages for value in message.values()]
+    lengths = iter(_encode_lengths(encoding, values))
+    counts = []
+    for message in messages:
+        num_tokens = tokens_per_message + REPLY_TOKENS
+        for key in message:
+            num_tokens += next(lengths)
+            if key == "name":
+                num_tokens += tokens_per_name
+        counts.append(num_tokens)
+    return counts
+
+
 def count_string_tokens(string: str, model_name: str) -> int:
     """
     Returns the number of tokens in a text string.
@@ -69,5 +181,18 @@ def count_string_tokens(string: str, model_name: str) -> int:
     Returns:
         int: The number of tokens in the text string.
     """
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(string))
+    return len(encoding_for(model_name).encode(string))
+
+
+def count_strings_tokens(strings: List[str], model_name: str) -> List[int]:
+    """
+    Returns the number of tokens of every text string of a list, in one batch.
+
+    Args:
+        strings (list): The text strings.
+        model_name (str): The name of the encoding to use. (e.g., "gpt-3.5-turbo")
+
+    Returns:
+        list: The number of tokens of every text string.
+    """
+    return _encode_lengths(encoding_for(model_name), strings)
@@ -0,0 +1,302 @@
+"""Token usage and cost of LLM calls, per step, agent and user.
+
+Every chat completion and embedding records the usage OpenAI reported for it,
+or an estimate when there is none (streamed completions), into the ledger of
+the block it runs in (``track_usage``). The API tracks every step this way: the
+usage of the step is added to the running total stored with the Agent entity,
+charged against the daily token quota of the user and returned in the response.
+
+The reported prompt tokens also calibrate the local estimates: the ratio of the
+reported tokens to the 4-characters-per-token estimate the rate limiter and the
+model router use, and to the tiktoken counts ``chat_with_ai`` makes, is tracked
+per model, so the estimates are corrected and their drift is visible.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import datetime
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# USD per 1000 prompt/completion tokens, by model prefix
+LLM_PRICES = os.getenv(
+    "LLM_PRICES",
+    "gpt-4-32k=0.06/0.12,gpt-4=0.03/0.06,gpt-3.5-turbo=0.0015/0.002,"
+    "text-embedding-ada-002=0.0001/0",
+)
+# tokens a user may spend a day on the server's API key, 0 for no quota
+LLM_USER_DAILY_TOKENS = int(os.getenv("LLM_USER_DAILY_TOKENS", 0))
+# weight of a new sample in the calibration ratios
+LLM_CALIBRATION_WEIGHT = float(os.getenv("LLM_CALIBRATION_WEIGHT", 0.1))
+
+USAGE_KEYS = (
+    "requests",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "estimated_tokens",
+    "cost",
+)
+
+
+def parse_prices(prices: str) -> Dict[str, Tuple[float, float]]:
+    """Parse "model=prompt/completion,..." into {model: (prompt, completion)}"""
+    parsed = {}
+    for entry in [e.strip() for e in prices.split(",") if e.strip()]:
+        model, price = entry.split("=")
+        prompt, completion = price.split("/")
+        parsed[model.strip()] = (float(prompt), float(completion))
+    return parsed
+
+
+PRICES = parse_prices(LLM_PRICES)
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Return the price in USD of some tokens of a model, 0 for unknown models"""
+    matches = [prefix for prefix in PRICES if model.startswith(prefix)]
+    if not matches:
+        return 0.0
+    prompt, completion = PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt + completion_tokens * completion) / 1000
+
+
+def add_usage(total: Optional[Dict[str, Any]], usage: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the sum of two usage records, either of which may lack keys"""
+    total = total or {}
+    summed = {key: total.get(key, 0) + usage.get(key, 0) for key in USAGE_KEYS}
+    summed["cost"] = round(summed["cost"], 6)
+    return summed
+
+
+class UsageLedger:
+    """The usage of the LLM calls made within a block.
+
+    Args:
+        parent: The ledger of the enclosing block, which is charged too.
+    """
+
+    def __init__(self, parent: Optional["UsageLedger"] = None) -> None:
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.totals: Dict[str, Any] = {key: 0 for key in USAGE_KEYS}
+
+    def record(self, usage: Dict[str, Any]) -> None:
+        """Add the usage of a call"""
+        with self._lock:
+            self.totals = add_usage(self.totals, usage)
+        if self.parent is not None:
+            self.parent.record(usage)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.totals)
+
+
+_ledger: contextvars.ContextVar[Optional[UsageLedger]] = contextvars.ContextVar(
+    "llm_usage_ledger", default=None
+)
+
+
+@contextlib.contextmanager
+def track_usage() -> Iterator[UsageLedger]:
+    """Record the usage of the LLM calls made within a block, and its threads"""
+    ledger = UsageLedger(_ledger.get())
+    token = _ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _ledger.reset(token)
+
+
+def current_ledger() -> Optional[UsageLedger]:
+    return _ledger.get()
+
+
+class Calibration:
+    """The ratio of the prompt tokens OpenAI reports to a local estimate.
+
+    Kept per source of estimates (``chars`` or ``tiktoken``) and model, as a
+    moving average.
+    """
+
+    def __init__(self, weight: float = LLM_CALIBRATION_WEIGHT) -> None:
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._ratios: Dict[Tuple[str, str], float] = {}
+        self._samples: Dict[Tuple[str, str], int] = {}
+
+    def observe(self, source: str, model: str, estimated: int, reported: int) -> None:
+        """Record the reported tokens of a prompt and their local estimate"""
+        if estimated <= 0 or reported <= 0:
+            return
+        key = (source, model)
+        ratio = reported / estimated
+        with self._lock:
+            previous = self._ratios.get(key)
+            self._ratios[key] = (
+                ratio
+                if previous is None
+                else previous + self.weight * (ratio - previous)
+            )
+            self._samples[key] = self._samples.get(key, 0) + 1
+
+    def ratio(self, source: str, model: str) -> float:
+        with self._lock:
+            return self._ratios.get((source, model), 1.0)
+
+    def estimate(self, source: str, model: str, estimated: int) -> int:
+        """Return an estimate corrected by the reported tokens so far"""
+        return round(estimated * self.ratio(source, model))
+
+    def stats(self) -> Dict[str, float]:
+        """Return the ratio and samples of every source and model"""
+        with self._lock:
+            stats: Dict[str, float] = {}
+            for (source, model), ratio in self._ratios.items():
+                key = re.sub(r"\W", "_", f"{source}_{model}")
+                stats[f"{key}_ratio"] = round(ratio, 4)
+                stats[f"{key}_samples"] = self._samples[(source, model)]
+            return stats
+
+
+calibration = Calibration()
+
+
+def record_usage(
+    model: str,
+    reported: Optional[Dict[str, Any]],
+    prompt_estimate: int,
+    completion_estimate: int = 0,
+    ledger: Optional[UsageLedger] = None,
+) -> Dict[str, Any]:
+    """Record the usage of a call into a ledger, the current one by default
+
+    Args:
+        model (str): The model called
+        reported (dict, optional): The usage OpenAI reported
+        prompt_estimate (int): The 4-characters-per-token estimate of the
+            prompt, calibrated against the reported tokens
+        completion_estimate (int): The estimate of the completion, used
+            without a reported usage
+        ledger (UsageLedger, optional): The ledger charged, for a call that
+            finishes after its caller moved on
+
+    Returns:
+        dict: The usage recorded
+    """
+    if reported:
+        prompt_tokens = reported.get("prompt_tokens", 0)
+        completion_tokens = reported.get("completion_tokens", 0)
+        calibration.observe("chars", model, prompt_estimate, prompt_tokens)
+        estimated = 0
+    else:
+        prompt_tokens = calibration.estimate("chars", model, prompt_estimate)
+        completion_tokens = completion_estimate
+        estimated = prompt_tokens + completion_tokens
+    usage = {
+        "requests": 1,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated_tokens": estimated,
+        "cost": cost(model, prompt_tokens, completion_tokens),
+    }
+    if ledger is None:
+        ledger = _ledger.get()
+    if ledger is not None:
+        ledger.record(usage)
+    return usage
+
+
+class UsageQuota:
+    """Tokens spent per user per day (UTC), against a daily quota.
+
+    Kept in Redis when there is one, so all workers share it, else in process.
+
+    Args:
+        redis_client: The Redis client, or None.
+        daily_tokens: The tokens a user may spend a day, 0 for no quota.
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        daily_tokens: int = LLM_USER_DAILY_TOKENS,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.redis = redis_client
+        self.daily_tokens = daily_tokens
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._used: Dict[Tuple[str, str], int] = {}
+        self.counters = {"charges": 0, "exceeded": 0, "errors": 0}
+
+    def _day(self) -> str:
+        return datetime.datetime.utcfromtimestamp(self.clock()).strftime("%Y-%m-%d")
+
+    def add(self, user_id: str, tokens: int) -> None:
+        """Charge some tokens to a user"""
+        day = self._day()
+        with self._lock:
+            self.counters["charges"] += 1
+        if self.redis is not None:
+            try:
+                key = f"usage:{user_id}:{day}"
+                pipeline = self.redis.pipeline()
+                pipeline.incrby(key, tokens)
+                pipeline.expire(key, 2 * 24 * 3600)
+                pipeline.execute()
+                return
+            except Exception as e:
+                with self._lock:
+                    self.counters["errors"] += 1
+                print("Usage quota write failed", e)
+        with self._lock:
+            # the days before today are not needed anymore
+            for key in [key for key in self._used if key[1] != day]:
+                del self._used[key]
+            self._used[(user_id, day)] = self._used.get((user_id, day), 0) + tokens
+
+    def used(self, user_id: str) -> int:
+        """Return the tokens a user spent today"""
+        day = self._day()
+        if self.redis is not None:
+            try:
+                return int(self.redis.get(f"usage:{user_id}:{day}") or 0)
+            except Exception as e:
+                with self._lock:
+                    self.counters["errors"] += 1
+                print("Usage quota read failed", e)
+        with self._lock:
+            return self._used.get((user_id, day), 0)
+
+    def exceeded(self, user_id: str) -> bool:
+        """Whether a user spent their tokens for today"""
+        if self.daily_tokens <= 0:
+            return False
+        exceeded = self.used(user_id) >= self.daily_tokens
+        if exceeded:
+            with self._lock:
+                self.counters["exceeded"] += 1
+        return exceeded
+
+    def status(self, user_id: str) -> Dict[str, Optional[int]]:
+        """Return the quota of a user, the tokens spent today and those left"""
+        used = self.used(user_id)
+        if self.daily_tokens <= 0:
+            return {"daily_tokens": None, "used": used, "remaining": None}
+        return {
+            "daily_tokens": self.daily_tokens,
+            "used": used,
+            "remaining": max(0, self.daily_tokens - used),
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Return the charges, quota rejections and storage errors"""
+        with self._lock:
+            return {"users": len(self._used), **self.counters}
@@ -0,0 +1,51 @@
+"""Measure how long a fresh worker takes to import the app and create its clients.
+
+Each run uses a new interpreter, like a freshly spawned gunicorn worker.
+
+    python -m benchmark.cold_start --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MEASURE = """
+import json, time
+t0 = time.perf_counter()
+import autogpt.api
+imported = time.perf_counter() - t0
+from autogpt.cloud_clients import registry
+try:
+    clients = registry.warmup()
+except Exception as e:
+    clients = {"error": str(e)}
+print(json.dumps({"import": round(imported, 4), "clients": clients}))
+"""
+
+
+def measure_once() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    imports = [run["import"] for run in runs]
+    print(f"import autogpt.api: median {statistics.median(imports):.3f}s, max {max(imports):.3f}s")
+    for name in runs[0]["clients"]:
+        times = [run["clients"].get(name) for run in runs]
+        if all(isinstance(t, float) for t in times):
+            print(f"{name}: median {statistics.median(times):.3f}s, max {max(times):.3f}s")
+        else:
+            print(f"{name}: {times[0]}")
+
+
+if __name__ == "__main__":
+    main()
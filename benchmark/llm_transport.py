@@ -0,0 +1,115 @@
+"""Measure what pooled keep-alive sessions save on OpenAI calls.
+
+Serves a fake chat completions endpoint over TLS on localhost, then makes the
+same calls the way the server does, each from a new thread: once with the openai
+SDK's per-thread sessions, once through autogpt.llm_transport.
+
+    python -m benchmark.llm_transport --calls 200
+"""
+import argparse
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import openai
+
+from autogpt.llm_transport import openai_call, session_pool
+
+COMPLETION = json.dumps(
+    {
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hi"}}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_tls(directory: str) -> ThreadingHTTPServer:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", key, "-out", cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["REQUESTS_CA_BUNDLE"] = cert
+    return server
+
+
+def call(cfg, pooled: bool) -> float:
+    kwargs = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hi"}]}
+    t0 = time.perf_counter()
+    if pooled:
+        with openai_call(cfg) as credentials:
+            openai.ChatCompletion.create(**kwargs, **credentials)
+    else:
+        openai.ChatCompletion.create(
+            **kwargs, api_key=cfg.openai_api_key, api_base=openai.api_base
+        )
+    return time.perf_counter() - t0
+
+
+def measure(cfg, pooled: bool, calls: int) -> list:
+    latencies = []
+    for _ in range(calls):
+        # a new thread per call, like a streamed request or a short-lived worker
+        thread = threading.Thread(target=lambda: latencies.append(call(cfg, pooled)))
+        thread.start()
+        thread.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = serve_tls(directory)
+        openai.api_base = f"https://127.0.0.1:{server.server_address[1]}/v1"
+        cfg = SimpleNamespace(use_azure=False, openai_api_key="sk-bench")
+
+        for name, pooled in (("per-thread sessions", False), ("pooled sessions", True)):
+            latencies = sorted(measure(cfg, pooled, args.calls))
+            print(
+                f"{name}: mean {statistics.mean(latencies) * 1000:.2f}ms,"
+                f" p50 {statistics.median(latencies) * 1000:.2f}ms,"
+                f" p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f}ms"
+            )
+        print("pool", session_pool.stats())
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
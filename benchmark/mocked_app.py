@@ -0,0 +1,103 @@
+"""The API app with every backend replaced by a fake with a fixed latency.
+
+Used by server_throughput.py to compare gunicorn worker models on the same
+workload. The latencies mimic a step: a command, a long LLM call and a few
+Datastore round trips. Configure them with BENCH_LLM_LATENCY,
+BENCH_COMMAND_LATENCY and BENCH_DATASTORE_LATENCY (seconds).
+
+With LLM_BACKEND=synthetic or replay the agent's real think phase runs instead
+of the fixed LLM latency: chat_with_ai, JSON parsing, task naming and the
+memory embeddings (in a local, in-process memory) go through the offline LLM
+backend, whose latency is LLM_BACKEND_LATENCY.
+"""
+import contextlib
+import os
+import time
+
+from google.cloud import datastore
+
+from autogpt import api
+from autogpt.cloud_clients import registry
+from autogpt.llm_backend import backend
+from autogpt.memory.local import LocalCache
+
+LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", 0.5))
+COMMAND_LATENCY = float(os.getenv("BENCH_COMMAND_LATENCY", 0.1))
+DATASTORE_LATENCY = float(os.getenv("BENCH_DATASTORE_LATENCY", 0.02))
+
+
+class FakeDatastore:
+    def __init__(self):
+        self.entities = {}
+
+    def key(self, *path):
+        return datastore.Key(*path, project="bench")
+
+    def get(self, key, **kwargs):
+        time.sleep(DATASTORE_LATENCY)
+        return self.entities.get(key.flat_path)
+
+    def put(self, entity):
+        time.sleep(DATASTORE_LATENCY)
+        self.entities[entity.key.flat_path] = entity
+
+    def put_multi(self, entities):
+        time.sleep(DATASTORE_LATENCY)
+        for entity in entities:
+            self.entities[entity.key.flat_path] = entity
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+class FakeFirestore:
+    """Answers the legacy sessions query with no sessions."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def stream(self):
+        time.sleep(DATASTORE_LATENCY)
+        return iter([])
+
+
+class FakeMemory:
+    def add(self, data):
+        time.sleep(DATASTORE_LATENCY)
+
+    def get_relevant(self, data, num_relevant=5):
+        return []
+
+    def clear(self):
+        pass
+
+
+def execute_step(self, command_name, arguments):
+    time.sleep(COMMAND_LATENCY)
+    self.full_message_history.append({"role": "system", "content": "result"})
+    return "result", "memory", "log"
+
+
+def think(self, on_delta=None):
+    time.sleep(LLM_LATENCY)
+    self.full_message_history.append({"role": "assistant", "content": "reply"})
+    self.command_name, self.arguments = "google", {"input": "query"}
+    return {"text": "thought"}, "log"
+
+
+registry.override("datastore", FakeDatastore())
+registry.override("firestore", FakeFirestore())
+api.limiter.enabled = False
+api.cert_warmer.fetch = lambda: None
+api.token_cache.verify_fn = lambda token: {"user_id": token, "exp": time.time() + 3600}
+api.upload_log = lambda text, agent_id: None
+api.Agent.execute_step = execute_step
+if backend.remote:
+    api.get_memory = lambda cfg, init=False: FakeMemory()
+    api.task_namer.name_fn = lambda *args, **kwargs: "task"
+    api.Agent.think = think
+else:
+    api.get_memory = lambda cfg, init=False: LocalCache(cfg)
+
+app = api.app
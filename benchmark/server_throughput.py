@@ -0,0 +1,132 @@
+"""Compare the throughput of gunicorn worker models on mocked backends.
+
+Starts gunicorn with gunicorn.conf.py and benchmark.mocked_app for each worker
+class, then keeps a fixed number of clients posting steps to /api for a while.
+
+    python -m benchmark.server_throughput --concurrency 200 --duration 20
+
+Results for the setup in docs/server-concurrency.md.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_up(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def step_body() -> dict:
+    return {
+        "command": "start",
+        "arguments": {},
+        "ai_name": "bench",
+        "ai_description": "benchmark agent",
+        "ai_goals": ["benchmark"],
+        "agent_id": str(uuid.uuid4()),
+        "message_history": [],
+    }
+
+
+def drive(url: str, concurrency: int, duration: float) -> dict:
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client(n: int) -> None:
+        session = requests.Session()
+        headers = {"Authorization": f"Bearer user-{n}"}
+        while time.monotonic() < stop:
+            t0 = time.perf_counter()
+            try:
+                status = session.post(
+                    f"{url}/api", json=step_body(), headers=headers, timeout=60
+                ).status_code
+            except requests.RequestException:
+                status = "error"
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "throughput": round(statuses.get(200, 0) / duration, 1),
+        "p50": round(statistics.median(latencies), 3),
+        "p95": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "statuses": statuses,
+    }
+
+
+def run(worker_class: str, args) -> dict:
+    port = args.port
+    env = {
+        **os.environ,
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_WORKERS": str(args.workers),
+        "GUNICORN_THREADS": str(args.threads),
+        "GUNICORN_WORKER_CONNECTIONS": str(args.worker_connections),
+        "MAX_CONCURRENT_STEPS": str(args.max_concurrent_steps),
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+            "-b", f"127.0.0.1:{port}", "--log-level", "warning",
+            "benchmark.mocked_app:app",
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        wait_until_up(url)
+        drive(url, min(args.concurrency, 10), 2)  # warm up
+        return drive(url, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--worker-classes", default="gthread,gevent")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--worker-connections", type=int, default=1000)
+    parser.add_argument("--max-concurrent-steps", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+
+    for worker_class in args.worker_classes.split(","):
+        print(worker_class, json.dumps(run(worker_class, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
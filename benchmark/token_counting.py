@@ -0,0 +1,106 @@
+"""Measure how long counting the tokens of a 100-message history takes.
+
+Compares the ways chat_with_ai has counted the history it fits into the context:
+resolving the encoding and encoding every message on every step, counting the
+messages one by one with the resolved encoding, counting them in one batch, and
+summing the counts cached on the messages. The batch is encoded on one thread
+per CPU, up to TOKEN_COUNTER_THREADS, so it only gains on several CPUs.
+
+    python -m benchmark.token_counting --messages 100 --runs 20
+"""
+import argparse
+import json
+import random
+import statistics
+import string
+import time
+
+import tiktoken
+
+from autogpt import token_counter
+from autogpt.chat import count_history_tokens, create_chat_message
+
+MODEL = "gpt-3.5-turbo"
+
+
+def make_history(messages: int, seed: int = 0) -> list:
+    """Return a history of messages of the lengths of agent steps"""
+    rng = random.Random(seed)
+    words = [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        for _ in range(2000)
+    ]
+    history = []
+    for i in range(messages):
+        role = ["user", "assistant", "system"][i % 3]
+        content = " ".join(rng.choice(words) for _ in range(rng.randint(20, 400)))
+        history.append(create_chat_message(role, content))
+    return history
+
+
+def count_unresolved(history: list) -> int:
+    """The counting before the encoders were kept: resolved on every call"""
+    total = 0
+    for message in history:
+        encoding = tiktoken.encoding_for_model(MODEL)
+        total += 4 + 3 + sum(len(encoding.encode(v)) for v in message.values())
+    return total
+
+
+def count_one_by_one(history: list) -> int:
+    return sum(token_counter.count_message_tokens([m], MODEL) for m in history)
+
+
+def count_batch(history: list) -> int:
+    return sum(token_counter.count_each_message_tokens(history, MODEL))
+
+
+def count_cached(history: list) -> int:
+    return sum(count_history_tokens(history, MODEL))
+
+
+def measure(count, history: list, runs: int) -> float:
+    """Return the median seconds of a count of the history"""
+    seconds = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        count(history)
+        seconds.append(time.perf_counter() - t0)
+    return statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    history = make_history(args.messages)
+    # load the encoding once, outside of the measurements
+    token_counter.count_message_tokens(history[:1], MODEL)
+    cached = make_history(args.messages)
+    count_history_tokens(cached, MODEL)
+
+    results = {
+        "unresolved": measure(count_unresolved, history, args.runs),
+        "one_by_one": measure(count_one_by_one, history, args.runs),
+        "batch": measure(count_batch, history, args.runs),
+        "cached": measure(count_cached, cached, args.runs),
+    }
+    baseline = results["unresolved"]
+    print(
+        json.dumps(
+            {
+                name: {
+                    "ms": round(seconds * 1000, 3),
+                    "speedup": round(baseline / seconds, 1) if seconds else None,
+                }
+                for name, seconds in results.items()
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 import argparse
 import logging
+import os
 
 from autogpt.config import Config
-from autogpt.commands.file_operations import ingest_file, search_files
+from autogpt.commands.file_operations import ingest_file
 from autogpt.memory import get_memory
 
 cfg = Config()
@@ -24,12 +25,15 @@ def ingest_directory(directory, memory, args):
     Ingest all files in a directory by calling the ingest_file function for each file.
 
     :param directory: The directory containing the files to ingest
-    :param memory: An object with an add() method to store the chunks in memory
+    :param memory: An object with an add_many() method to store the chunks in memory
     """
     try:
-        files = search_files(directory)
-        for file in files:
-            ingest_file(file, memory, args.max_length, args.overlap)
+        # search_files lists an agent's uploaded files, not a local directory
+        for root, _, files in os.walk(directory):
+            for file in files:
+                ingest_file(
+                    os.path.join(root, file), memory, args.max_length, args.overlap
+                )
     except Exception as e:
         print(f"Error while ingesting directory '{directory}': {str(e)}")
 
@@ -1,7 +1,64 @@
-workers = 4
-threads = 50
+import os
+
+# "gthread" (threads per worker) or "gevent" (greenlets per worker), see
+# docs/server-concurrency.md
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", 4))
+threads = int(os.getenv("GUNICORN_THREADS", 50))  # gthread only
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))  # gevent only
+if worker_class == "gthread":
+    # a gthread worker runs a step per thread at most; the step cap, and the
+    # phase thread pool sized from it (autogpt/step_pipeline.py), follow them
+    os.environ.setdefault("MAX_CONCURRENT_STEPS", str(threads))
+# the workers share the OpenAI rate limits (autogpt/rate_limiter.py)
+os.environ["WEB_CONCURRENCY"] = str(workers)
 bind = "0.0.0.0:8080"
 accesslog = "-"  # Log access logs to stdout
 errorlog = "-"   # Log error logs to stdout
 loglevel = "info"  # Choose an appropriate log level: debug, info, warning, error, or critical
-timeout = 0
+# Restart a worker whose main loop stops responding. Slow requests are bounded
+# by STEP_DEADLINE in the app instead.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+# On shutdown, let in-flight steps finish for this long
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 60))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+
+def _warmup(server):
+    from autogpt.cloud_clients import registry
+
+    try:
+        server.log.info("Cloud clients warmed up: %s", registry.warmup())
+    except Exception as e:
+        server.log.warning("Cloud client warmup failed, creating lazily: %s", e)
+
+
+def post_fork(server, worker):
+    # create the cloud clients in the worker, before it accepts requests. The
+    # gevent worker patches the standard library later, so it warms up in
+    # post_worker_init instead.
+    if worker_class != "gevent":
+        _warmup(server)
+
+
+def post_worker_init(worker):
+    if worker_class == "gevent":
+        # let gRPC (Datastore, Firestore) yield to other greenlets
+        import grpc.experimental.gevent
+
+        grpc.experimental.gevent.init_gevent()
+        _warmup(worker)
+
+
+def worker_exit(server, worker):
+    # ship the step logs that are still buffered in this worker
+    from autogpt.api_utils import log_shipper
+
+    log_shipper.close()
+
+
+def child_exit(server, worker):
+    # with PROMETHEUS_MULTIPROC_DIR set, drop the live gauges of the dead worker
+    from autogpt.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -2,10 +2,13 @@
 """Tests for LocalCache class"""
 import os
 import sys
+import tempfile
 import unittest
+from unittest.mock import patch
 
 import pytest
 
+from autogpt.embedding_cache import EmbeddingCache, SqliteStore
 from autogpt.memory.local import LocalCache
 
 
@@ -19,6 +22,8 @@ def mock_config() -> dict:
             "continuous_mode": False,
             "speak_mode": False,
             "memory_index": "auto-gpt",
+            "use_azure": False,
+            "openai_api_key": "sk-test",
         },
     )
 
@@ -29,8 +34,20 @@ class TestLocalCache(unittest.TestCase):
 
     def setUp(self) -> None:
         """Set up the test environment"""
+        # keep the memory and the embeddings out of the files the server uses
+        self.directory = tempfile.TemporaryDirectory()
         self.cfg = mock_config()
+        self.cfg.memory_index = os.path.join(self.directory.name, "auto-gpt")
         self.cache = LocalCache(self.cfg)
+        store = SqliteStore(os.path.join(self.directory.name, "embeddings.sqlite3"))
+        self.embedding_cache = patch(
+            "autogpt.llm_utils.embedding_cache", EmbeddingCache(store)
+        )
+        self.embedding_cache.start()
+
+    def tearDown(self) -> None:
+        self.embedding_cache.stop()
+        self.directory.cleanup()
 
     def test_add(self) -> None:
         """Test adding a text to the cache"""
@@ -1,6 +1,13 @@
 import unittest
 import tests.context
-from autogpt.token_counter import count_message_tokens, count_string_tokens
+from autogpt.token_counter import (
+    ENCODING_CACHE_SIZE,
+    count_each_message_tokens,
+    count_message_tokens,
+    count_string_tokens,
+    count_strings_tokens,
+    encoding_for,
+)
 
 
 class TestTokenCounter(unittest.TestCase):
@@ -50,13 +57,43 @@ class TestTokenCounter(unittest.TestCase):
             {"role": "user", "content": "Hello"},
             {"role": "assistant", "content": "Hi there!"},
         ]
-        with self.assertRaises(NotImplementedError):
-            count_message_tokens(messages, model="invalid_model")
+        # counted like the current chat models, with the cl100k_base encoding
+        self.assertEqual(
+            count_message_tokens(messages, model="invalid_model"),
+            count_message_tokens(messages, model="gpt-4-0314"),
+        )
 
     def test_count_string_tokens_gpt_4(self):
         string = "Hello, world!"
         self.assertEqual(count_string_tokens(string, model_name="gpt-4-0314"), 4)
 
+    def test_count_each_message_tokens(self):
+        messages = [
+            {"role": "user", "content": "Hello", "name": "John"},
+            {"role": "assistant", "content": "Hi there!"},
+        ]
+        self.assertEqual(
+            count_each_message_tokens(messages),
+            [count_message_tokens([message]) for message in messages],
+        )
+
+    def test_count_message_tokens_model_snapshots(self):
+        messages = [
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": "Hi there!"},
+        ]
+        self.assertEqual(count_message_tokens(messages, model="gpt-4-0613"), 15)
+        self.assertEqual(count_message_tokens(messages, model="gpt-4"), 15)
+
+    def test_count_strings_tokens(self):
+        strings = ["Hello, world!", ""]
+        self.assertEqual(count_strings_tokens(strings, model_name="gpt-4-0314"), [4, 0])
+
+    def test_encoding_cache_is_bounded(self):
+        for i in range(ENCODING_CACHE_SIZE + 10):
+            count_string_tokens("Hello", model_name=f"gpt-4-{i}")
+        self.assertEqual(encoding_for.cache_info().currsize, ENCODING_CACHE_SIZE)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,224 @@
+import contextlib
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.cloud import datastore
+
+from autogpt import api
+from autogpt.cloud_clients import registry
+from autogpt.session_store import HistoryVersionMismatch
+from autogpt.task_log import task_key
+
+
+class FakeDatastore:
+    """An in-memory Datastore whose transactions commit all their puts or none."""
+
+    def __init__(self):
+        self.entities = {}
+        self.pending = None
+        self.fail_commit = False
+
+    def key(self, *path):
+        return datastore.Key(*path, project="test")
+
+    def get(self, key, **kwargs):
+        return self.entities.get(key)
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        if self.pending is not None:
+            self.pending.extend(entities)
+            return
+        for entity in entities:
+            self.entities[entity.key] = entity
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.pending = []
+        try:
+            yield
+            if self.fail_commit:
+                raise TimeoutError("commit timed out")
+            for entity in self.pending:
+                self.entities[entity.key] = entity
+        finally:
+            self.pending = None
+
+
+def fake_agent(agent_id="agent"):
+    return SimpleNamespace(
+        ai_name="Bot",
+        ai_role="role",
+        ai_goals=["goal"],
+        agent_id=agent_id,
+        full_message_history=[],
+        command_name="google",
+        arguments={"input": "x"},
+        assistant_reply="{}",
+        agent_manager=SimpleNamespace(agents=[]),
+    )
+
+
+class TestPersistStep(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatastore()
+        registry.override("datastore", self.client)
+        self.key = self.client.key("Agent", "agent")
+
+    def tearDown(self):
+        registry.override("datastore", None)
+
+    def persist(self, prev, history_version, result="done"):
+        return api.persist_step(
+            self.key,
+            prev,
+            fake_agent(),
+            "google",
+            {"input": "x"},
+            {},
+            result,
+            "Search for x.",
+            False,
+            history_version,
+            {},
+        )
+
+    def store_agent(self, **fields):
+        entity = datastore.Entity(key=self.key)
+        entity.update(fields)
+        self.client.entities[self.key] = entity
+        return entity
+
+    # Tests that the tasks of an old agent are migrated in the commit of the step.
+    def test_migrates_with_the_step(self):
+        prev = self.store_agent(history_version=1, tasks=[{"command_name": "browse"}])
+
+        self.assertEqual(self.persist(prev, 2), 1)
+
+        self.assertEqual(self.client.entities[self.key]["task_count"], 2)
+        first = self.client.get(task_key(self.client, "agent", 0))
+        self.assertEqual((first["command_name"], first["result"]), ("browse", "done"))
+        self.assertEqual(
+            self.client.get(task_key(self.client, "agent", 1))["task_name"],
+            "Search for x.",
+        )
+
+    # Tests that a step losing the race to another writes no tasks.
+    def test_version_mismatch_writes_no_tasks(self):
+        prev = self.store_agent(history_version=1, tasks=[{"command_name": "browse"}])
+        self.store_agent(history_version=2, full_message_history=json.dumps([]))
+
+        with self.assertRaises(HistoryVersionMismatch):
+            self.persist(prev, 2)
+
+        self.assertEqual(list(self.client.entities), [self.key])
+
+    # Tests that a failed commit stores neither the agent nor its task, so the
+    # task count never points past the log.
+    def test_failed_commit_writes_nothing(self):
+        prev = self.store_agent(history_version=1, task_count=0)
+        self.client.fail_commit = True
+
+        with self.assertRaises(TimeoutError):
+            self.persist(prev, 2)
+
+        self.assertEqual(list(self.client.entities), [self.key])
+        self.assertEqual(self.client.entities[self.key]["task_count"], 0)
+
+        self.client.fail_commit = False
+        self.assertEqual(self.persist(prev, 2), 0)
+        self.assertEqual(self.client.entities[self.key]["task_count"], 1)
+        self.assertIsNotNone(self.client.get(task_key(self.client, "agent", 0)))
+
+
+def read_events(body):
+    """Split a Server-Sent Events stream into (event, data) pairs"""
+    events = []
+    for frame in body.split("\n\n")[:-1]:
+        event, data = frame.split("\n")
+        events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatastore()
+        registry.override("datastore", self.client)
+        api.limiter.enabled = False
+        self.app = api.app.test_client()
+        self.body = {
+            "command": "start",
+            "arguments": {},
+            "ai_name": "Bot",
+            "ai_description": "role",
+            "ai_goals": ["goal"],
+            "agent_id": "agent",
+            "message_history": [],
+            "openai_key": "sk-test",
+        }
+        for target in ["get_memory", "upload_log"]:
+            mock = patch.object(api, target)
+            mock.start()
+            self.addCleanup(mock.stop)
+
+    def tearDown(self):
+        api.limiter.enabled = True
+        registry.override("datastore", None)
+
+    def stream(self, interact):
+        with patch.object(api, "new_interact", interact):
+            response = self.app.post("/api/stream", json=self.body)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        body = response.get_data(as_text=True)
+        self.assertTrue(body.startswith("event: ") and body.endswith("\n\n"))
+        return read_events(body)
+
+    # Tests that the progress of a step is streamed, then the body /api returns.
+    def test_stream_step(self):
+        async def interact(emit, full_message_history, **kwargs):
+            emit("command_result", {"result": "found"})
+            emit("thoughts", '{"thoughts"')
+            history = full_message_history + [{"role": "assistant", "content": "{}"}]
+            return (
+                "google",
+                {"input": "x"},
+                {},
+                history,
+                "{}",
+                "found",
+                "Search.",
+                False,
+                {},
+                {},
+            )
+
+        events = self.stream(interact)
+
+        self.assertEqual(
+            [event for event, _ in events], ["command_result", "thoughts", "done"]
+        )
+        self.assertEqual(events[0][1], {"result": "found"})
+        self.assertEqual(events[1][1], '{"thoughts"')
+        done = events[-1][1]
+        self.assertEqual((done["command"], done["history_version"]), ("google", 1))
+        self.assertEqual(done["message_history"][-1]["role"], "assistant")
+
+    # Tests that a failed step ends the stream with an error event.
+    def test_stream_error(self):
+        async def interact(emit, **kwargs):
+            emit("command_result", {"result": "found"})
+            raise RuntimeError("think failed")
+
+        events = self.stream(interact)
+
+        self.assertEqual([event for event, _ in events], ["command_result", "error"])
+        self.assertIn("Error ID", events[-1][1]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
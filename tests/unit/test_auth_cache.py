@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from autogpt.auth_cache import VerifiedTokenCache
+
+
+class TestVerifiedTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.verified = []
+
+        def verify(id_token):
+            if id_token == "bad":
+                raise ValueError("invalid token")
+            self.verified.append(id_token)
+            return {"user_id": id_token, "exp": time.time() + 3600}
+
+        self.verify = verify
+
+    # Tests that a token is only verified once while it is cached.
+    def test_repeat_tokens_hit_the_cache(self):
+        cache = VerifiedTokenCache(self.verify)
+
+        self.assertEqual(cache.verify("token")["user_id"], "token")
+        self.assertEqual(cache.verify("token")["user_id"], "token")
+
+        self.assertEqual(self.verified, ["token"])
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 1, "misses": 1})
+
+    # Tests that failed verifications raise every time and are not cached.
+    def test_invalid_tokens_are_not_cached(self):
+        cache = VerifiedTokenCache(self.verify)
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                cache.verify("bad")
+        self.assertEqual(cache.stats()["size"], 0)
+
+    # Tests that tokens are verified again once their cache entry expires.
+    def test_entries_expire(self):
+        cache = VerifiedTokenCache(self.verify, max_ttl=0)
+
+        cache.verify("token")
+        cache.verify("token")
+
+        self.assertEqual(self.verified, ["token", "token"])
+
+    # Tests that the least recently used token is evicted.
+    def test_lru_eviction(self):
+        cache = VerifiedTokenCache(self.verify, max_size=1)
+
+        cache.verify("first")
+        cache.verify("second")
+        cache.verify("first")
+
+        self.assertEqual(self.verified, ["first", "second", "first"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,17 @@
 # Generated by CodiumAI
 import unittest
 import time
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from autogpt.chat import create_chat_message, generate_context
+from autogpt.chat import (
+    api_message,
+    build_context,
+    chat_with_ai,
+    create_chat_message,
+    generate_context,
+)
+from autogpt.config import Config
+from autogpt.llm_utils import Completion
 
 
 class TestChat(unittest.TestCase):
@@ -84,3 +92,76 @@ class TestChat(unittest.TestCase):
         self.assertLessEqual(
             result[1], 2048
         )  # token limit for GPT-3.5-turbo-0301 is 2048 tokens
+
+    # Tests that every message of the history is counted once, the reply from
+    # the usage OpenAI reported, and that the counts are not sent.
+    @patch("autogpt.chat.create_chat_completion_with_usage")
+    @patch("autogpt.token_counter.count_strings_tokens", lambda strings, model: [1])
+    @patch("autogpt.token_counter.count_each_message_tokens")
+    @patch("autogpt.token_counter.count_message_tokens")
+    def test_chat_with_ai_counts_messages_once(
+        self, mock_count, mock_count_each, mock_completion
+    ):
+        mock_count.side_effect = lambda messages, model: sum(
+            len(m["content"]) + 4 for m in messages
+        )
+        mock_count_each.side_effect = lambda messages, model: [
+            len(m["content"]) + 4 for m in messages
+        ]
+        mock_completion.return_value = Completion(
+            "Sure.",
+            "gpt-3.5-turbo",
+            {"prompt_tokens": 90, "completion_tokens": 2, "estimated_tokens": 0},
+        )
+        cfg = Config()
+        cfg.fast_llm_model = "gpt-3.5-turbo"
+        history = [
+            create_chat_message("user", "Hi there!"),
+            create_chat_message("assistant", "Hello!"),
+        ]
+
+        memory = MagicMock()
+        memory.get_relevant.return_value = ["An event"]
+
+        for _ in range(2):
+            chat_with_ai("prompt", "Next", history, memory, 4000, cfg)
+
+        counted = [
+            m["content"]
+            for args, _ in mock_count.call_args_list + mock_count_each.call_args_list
+            if args[0][0]["role"] != "system"
+            for m in args[0]
+        ]
+        self.assertEqual(counted.count("Hi there!"), 1)
+        self.assertEqual(counted.count("Sure."), 0)
+        self.assertEqual(history[3]["tokens"], {"gpt-3.5-turbo": 4 + 2})
+        sent = mock_completion.call_args.kwargs["messages"]
+        self.assertTrue(all("tokens" not in m for m in sent))
+        self.assertEqual(
+            api_message(history[0]), {"role": "user", "content": "Hi there!"}
+        )
+
+    # Tests that the most relevant memories that fit are kept, with every memory
+    # counted once and the context built once.
+    @patch("autogpt.token_counter.count_strings_tokens")
+    @patch("autogpt.token_counter.count_message_tokens")
+    def test_build_context_fits_memories(self, mock_count, mock_count_strings):
+        mock_count.return_value = 2000
+        mock_count_strings.side_effect = lambda strings, model: [
+            len(string) for string in strings
+        ]
+        memories = ["a" * 196, "b" * 196, "c" * 196, "d" * 96]
+
+        next_index, tokens, insertion_index, context = build_context(
+            "prompt", memories, [create_chat_message("user", "Hi")], "gpt-4", 2500
+        )
+
+        self.assertEqual(mock_count.call_count, 1)
+        self.assertEqual(mock_count_strings.call_count, 1)
+        self.assertEqual(tokens, 2000 + 200 + 200)
+        self.assertEqual((next_index, insertion_index), (0, 3))
+        self.assertIn(repr(memories[:2]), context[2]["content"])
+
+        _, tokens, _, context = build_context("prompt", "", [], "gpt-4", 2500)
+        self.assertEqual(tokens, 2000)
+        self.assertTrue(context[2]["content"].endswith(":\n\n\n"))
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+
+from autogpt.cloud_clients import ClientRegistry
+
+
+class TestClientRegistry(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+        self.registry = ClientRegistry()
+        self.registry.register("client", lambda: self.created.append(1) or object())
+
+    # Tests that a client is created on first use only, and then reused.
+    def test_created_lazily_once(self):
+        self.assertEqual(self.created, [])
+
+        first = self.registry.get("client")
+        self.assertIs(self.registry.get("client"), first)
+        self.assertEqual(len(self.created), 1)
+
+    # Tests that a forked process creates its own client instead of the parent's.
+    def test_recreated_after_fork(self):
+        parent = self.registry.get("client")
+
+        with patch("os.getpid", return_value=-1):
+            child = self.registry.get("client")
+
+        self.assertIsNot(child, parent)
+        self.assertEqual(len(self.created), 2)
+
+    # Tests that an override is returned without creating the client.
+    def test_override(self):
+        fake = object()
+        self.registry.override("client", fake)
+
+        self.assertIs(self.registry.get("client"), fake)
+        self.assertEqual(self.created, [])
+
+    # Tests that warmup creates the clients and reports how long each took.
+    def test_warmup(self):
+        timings = self.registry.warmup()
+
+        self.assertEqual(list(timings), ["client"])
+        self.assertEqual(len(self.created), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
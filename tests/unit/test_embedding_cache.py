@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from autogpt.embedding_cache import EmbeddingCache, SqliteStore, embedding_key
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SqliteStore(os.path.join(self.directory.name, "cache.sqlite3"))
+        self.calls = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create(self, text):
+        self.calls.append(text)
+        return [0.5, float(len(text))]
+
+    # Tests that the key covers the model and ignores newlines.
+    def test_embedding_key(self):
+        self.assertEqual(embedding_key("a\nb"), embedding_key("a b"))
+        self.assertNotEqual(embedding_key("a b"), embedding_key("a b", model="other"))
+
+    # Tests that the sqlite file is only opened on first use.
+    def test_store_opened_lazily(self):
+        path = os.path.join(self.directory.name, "lazy.sqlite3")
+        store = SqliteStore(path)
+        self.assertFalse(os.path.exists(path))
+
+        self.assertIsNone(store.get("key"))
+        self.assertTrue(os.path.exists(path))
+
+    # Tests that a text is embedded once, normalized, and served from memory after.
+    def test_get_or_create(self):
+        cache = EmbeddingCache(self.store)
+
+        first = cache.get_or_create("hello\nworld", self.create)
+        second = cache.get_or_create("hello world", self.create)
+
+        self.assertEqual(first, [0.5, 11.0])
+        self.assertEqual(second, first)
+        self.assertEqual(self.calls, ["hello world"])
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    # Tests that vectors survive the process through the sqlite store.
+    def test_disk_hit(self):
+        EmbeddingCache(self.store).get_or_create("text", self.create)
+
+        cache = EmbeddingCache(SqliteStore(self.store.path))
+        self.assertEqual(cache.get_or_create("text", self.create), [0.5, 4.0])
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    # Tests that only uncached texts are created, once each and in one call.
+    def test_get_many_or_create(self):
+        cache = EmbeddingCache(self.store)
+        cache.get_or_create("a", self.create)
+        batches = []
+
+        def create_many(texts):
+            batches.append(texts)
+            return [self.create(text) for text in texts]
+
+        vectors = cache.get_many_or_create(["a", "bb", "a", "b\nb", "ccc"], create_many)
+
+        self.assertEqual([v[1] for v in vectors], [1.0, 2.0, 1.0, 3.0, 3.0])
+        self.assertEqual(batches, [["bb", "b b", "ccc"]])
+
+    # Tests that the store keeps only the most recently used rows.
+    def test_store_eviction(self):
+        self.store.max_rows = 2
+        for key in ("a", "b", "c"):
+            self.store.put(key, np.ones(2, dtype=np.float32))
+        self.store.get("a")
+        self.store.evict()
+
+        self.assertIsNone(self.store.get("b"))
+        self.assertIsNotNone(self.store.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from autogpt.llm_backend import (
+    RecordingBackend,
+    ReplayBackend,
+    ReplayMiss,
+    SyntheticBackend,
+)
+from autogpt.metrics import call_site
+
+
+class TestLLMBackend(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "recording.jsonl")
+        self.request = {
+            "model": "gpt-3.5-turbo",
+            "messages": [{"role": "user", "content": "Hi"}],
+            "temperature": 0,
+            "max_tokens": 10,
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Tests that synthetic embeddings are unit vectors, fixed for a text.
+    def test_synthetic_embedding(self):
+        backend = SyntheticBackend()
+
+        response = backend.embedding(input=["a", "b", "a"], model="ada")
+        vectors = [np.array(item["embedding"]) for item in response["data"]]
+
+        self.assertAlmostEqual(float(np.linalg.norm(vectors[0])), 1.0, places=5)
+        self.assertEqual(vectors[0].tolist(), vectors[2].tolist())
+        self.assertNotEqual(vectors[0].tolist(), vectors[1].tolist())
+
+    # Tests that the synthetic agent reply is valid JSON with the configured command.
+    def test_synthetic_agent_reply(self):
+        backend = SyntheticBackend(command="task_complete")
+
+        with call_site("chat_with_ai"):
+            response = backend.chat_completion(**self.request)
+
+        reply = json.loads(response.choices[0].message["content"])
+        self.assertEqual(reply["command"]["name"], "task_complete")
+        self.assertIn("thoughts", reply)
+
+    # Tests that recorded responses are replayed by request, streamed or not.
+    def test_record_replay(self):
+        recorder = RecordingBackend(SyntheticBackend(), self.path)
+        recorded = recorder.chat_completion(**self.request, api_key="sk-secret")
+        recorder.embedding(input=["text"], model="ada")
+
+        replay = ReplayBackend(self.path)
+        replayed = replay.chat_completion(**self.request)
+        pieces = [
+            chunk.choices[0].delta.get("content", "")
+            for chunk in replay.chat_completion(**self.request, stream=True)
+        ]
+
+        content = recorded.choices[0].message["content"]
+        self.assertEqual(replayed.choices[0].message["content"], content)
+        self.assertEqual("".join(pieces), content)
+        self.assertEqual(len(replay.embedding(input=["text"], model="ada")["data"]), 1)
+        with open(self.path) as f:
+            self.assertNotIn("sk-secret", f.read())
+        with self.assertRaises(ReplayMiss):
+            replay.chat_completion(**{**self.request, "temperature": 1})
+
+    # Tests that a replay miss falls back to synthetic responses when configured.
+    def test_replay_fallback(self):
+        open(self.path, "w").close()
+        replay = ReplayBackend(self.path, fallback=SyntheticBackend())
+
+        response = replay.chat_completion(**self.request)
+
+        self.assertTrue(response.choices[0].message["content"].startswith("Synthetic"))
+        self.assertEqual(replay.stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
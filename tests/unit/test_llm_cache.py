@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from autogpt.llm_cache import (
+    CompletionCache,
+    DiskTier,
+    MemoryTier,
+    build_redis_client,
+    cache_key,
+)
+
+MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+class BrokenTier:
+    name = "broken"
+
+    def get(self, key):
+        raise ConnectionError("down")
+
+    def put(self, key, value):
+        raise ConnectionError("down")
+
+
+class TestCompletionCache(unittest.TestCase):
+    # Tests that the key is canonical and covers every parameter of the request.
+    def test_cache_key(self):
+        key = cache_key("gpt-3.5-turbo", MESSAGES, 0, None)
+
+        reordered = [{"content": "Hi", "role": "user"}]
+        self.assertEqual(cache_key("gpt-3.5-turbo", reordered, 0, None), key)
+        self.assertNotEqual(cache_key("gpt-4", MESSAGES, 0, None), key)
+        self.assertNotEqual(cache_key("gpt-3.5-turbo", MESSAGES, 0.2, None), key)
+        self.assertNotEqual(cache_key("gpt-3.5-turbo", MESSAGES, 0, 100), key)
+
+    # Tests that the memory tier evicts the least recently used and expired entries.
+    def test_memory_tier(self):
+        tier = MemoryTier(max_entries=2, ttl=60)
+        tier.put("a", "1")
+        tier.put("b", "2")
+        tier.get("a")
+        tier.put("c", "3")
+
+        self.assertIsNone(tier.get("b"))
+        self.assertEqual(tier.get("a"), "1")
+
+        tier.ttl = -1
+        tier.put("d", "4")
+        self.assertIsNone(tier.get("d"))
+
+    # Tests that the disk tier drops the oldest files beyond its size.
+    def test_disk_tier_size_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tier = DiskTier(directory, max_bytes=10, ttl=60)
+            tier.put("aa-old", "x" * 6)
+            os.utime(tier._path("aa-old"), (time.time() - 10, time.time() - 10))
+            tier.put("bb-new", "y" * 6)
+
+            self.assertIsNone(tier.get("aa-old"))
+            self.assertEqual(tier.get("bb-new"), "y" * 6)
+
+    # Tests that a hit in a slower tier is copied into the faster ones.
+    def test_backfills_faster_tiers(self):
+        fast, slow = MemoryTier(), MemoryTier()
+        slow.name = "slow"
+        cache = CompletionCache([fast, slow])
+        slow.put("key", "value")
+
+        self.assertEqual(cache.get("key"), "value")
+        self.assertEqual(fast.get("key"), "value")
+        self.assertEqual(cache.stats()["slow_hits"], 1)
+
+    # Tests that a failing tier is counted and treated as a miss.
+    def test_failing_tier_is_a_miss(self):
+        cache = CompletionCache([BrokenTier(), MemoryTier()])
+        cache.put("key", "value")
+
+        self.assertEqual(cache.get("key"), "value")
+        # the write, the read and the copy back into the failing tier
+        self.assertEqual(cache.stats()["errors"], 3)
+
+    # Tests that the Redis client is configured from Config, with timeouts.
+    def test_build_redis_client(self):
+        with patch.dict(os.environ, {"REDIS_HOST": ""}):
+            self.assertIsNone(build_redis_client())
+        redis_env = {"REDIS_HOST": "redis.internal", "REDIS_PORT": "6380"}
+        with patch.dict(os.environ, redis_env), patch("redis.Redis") as mock_redis:
+            build_redis_client(timeout=0.2)
+
+        kwargs = mock_redis.call_args.kwargs
+        self.assertEqual((kwargs["host"], kwargs["port"]), ("redis.internal", 6380))
+        self.assertEqual(kwargs["socket_timeout"], 0.2)
+        self.assertEqual(kwargs["socket_connect_timeout"], 0.2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from autogpt.llm_hedging import Hedger
+from autogpt.model_router import ModelRouter, Route
+from autogpt.usage import track_usage
+
+
+class TestHedger(unittest.TestCase):
+    def setUp(self):
+        self.router = ModelRouter({}, min_calls=1)
+        self.router.observe(Route("gpt-4"), 0.05, ok=True)
+        self.hedger = Hedger(self.router, {"chat_with_ai"}, min_delay=0.05)
+        self.routes = [Route("gpt-4"), Route("gpt-3.5-turbo")]
+        self.primary_done = threading.Event()
+
+    def call(self, routes):
+        if routes[0].model == "gpt-4":
+            time.sleep(0.5)
+            self.primary_done.set()
+            usage = {"prompt_tokens": 30, "completion_tokens": 12, "total_tokens": 42}
+            return routes[0], {"usage": usage}
+        return routes[0], {"usage": {"total_tokens": 10}}
+
+    # Tests that a slow call is hedged on the next route, which wins.
+    def test_slow_call_hedged(self):
+        t0 = time.time()
+        route, response = self.hedger.call("chat_with_ai", self.routes, self.call, 100)
+
+        self.assertLess(time.time() - t0, 0.4)
+        self.assertEqual(route, Route("gpt-3.5-turbo"))
+        self.assertTrue(self.primary_done.wait(2))
+        time.sleep(0.05)
+        stats = self.hedger.stats()
+        self.assertEqual((stats["hedged"], stats["hedge_wins"]), (1, 1))
+        self.assertEqual(stats["extra_tokens"], 42)
+
+    # Tests that the tokens of the losing request are charged to the caller.
+    def test_loser_usage_recorded(self):
+        with track_usage() as ledger:
+            self.hedger.call("chat_with_ai", self.routes, self.call, 100)
+        # the caller records the usage of the winner
+        self.assertEqual(ledger.as_dict()["total_tokens"], 0)
+
+        self.assertTrue(self.primary_done.wait(2))
+        time.sleep(0.05)
+        totals = ledger.as_dict()
+        self.assertEqual((totals["requests"], totals["total_tokens"]), (1, 42))
+
+    # Tests that the calls of other sites, and fast calls, are not hedged.
+    def test_not_hedged(self):
+        route, _ = self.hedger.call("task_name", self.routes, self.call, 100)
+        self.assertEqual(route, Route("gpt-4"))
+
+        fast = [Route("gpt-3.5-turbo")]
+        self.router.observe(fast[0], 1, ok=True)
+        route, _ = self.hedger.call("chat_with_ai", fast, self.call, 100)
+
+        self.assertEqual(route, Route("gpt-3.5-turbo"))
+        self.assertEqual(self.hedger.stats()["hedged"], 0)
+
+    # Tests that the hedge's answer is used when the original request fails.
+    def test_original_fails(self):
+        def call(routes):
+            if routes[0].model == "gpt-4":
+                time.sleep(0.1)
+                raise TimeoutError("timed out")
+            time.sleep(0.2)
+            return routes[0], {}
+
+        route, _ = self.hedger.call("chat_with_ai", self.routes, call, 100)
+
+        self.assertEqual(route, Route("gpt-3.5-turbo"))
+
+    # Tests that an async hedge that wins cancels the original request.
+    def test_async_loser_cancelled(self):
+        cancelled = []
+
+        async def call(routes):
+            try:
+                await asyncio.sleep(0.5 if routes[0].model == "gpt-4" else 0)
+            except asyncio.CancelledError:
+                cancelled.append(routes[0].model)
+                raise
+            return routes[0], {}
+
+        route, _ = asyncio.run(
+            self.hedger.acall("chat_with_ai", self.routes, call, 100)
+        )
+
+        self.assertEqual(route, Route("gpt-3.5-turbo"))
+        self.assertEqual(cancelled, ["gpt-4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import unittest
+from types import SimpleNamespace
+
+from openai import api_requestor
+
+from autogpt.llm_transport import Credentials, SessionPool, credentials_for
+
+
+def credentials(api_key="sk-1", api_base="https://api.openai.com/v1"):
+    return Credentials(api_key, api_base, "open_ai", None)
+
+
+class TestSessionPool(unittest.TestCase):
+    # Tests that threads share one session per API key and endpoint.
+    def test_session_per_key_and_endpoint(self):
+        pool = SessionPool()
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(pool.get(credentials())))
+        thread.start()
+        thread.join()
+
+        self.assertIs(pool.get(credentials()), sessions[0])
+        self.assertIsNot(pool.get(credentials(api_key="sk-2")), sessions[0])
+        self.assertIsNot(pool.get(credentials(api_base="https://azure")), sessions[0])
+        self.assertEqual(pool.stats()["sessions"], 3)
+
+    # Tests that the least recently used session is closed beyond the limit.
+    def test_eviction(self):
+        pool = SessionPool(max_sessions=1)
+        first = pool.get(credentials())
+        pool.get(credentials(api_key="sk-2"))
+
+        self.assertIsNot(pool.get(credentials()), first)
+        self.assertEqual(pool.stats()["evictions"], 2)
+
+    # Tests that the pooled session is only used by openai for the duration.
+    def test_use_restores_thread_session(self):
+        pool = SessionPool()
+        self.assertFalse(hasattr(api_requestor._thread_context, "session"))
+
+        with pool.use(credentials()) as session:
+            self.assertIs(api_requestor._thread_context.session, session)
+
+        self.assertFalse(hasattr(api_requestor._thread_context, "session"))
+
+    # Tests that Azure configs get their endpoint and version.
+    def test_azure_credentials(self):
+        cfg = SimpleNamespace(
+            use_azure=True,
+            openai_api_key="key",
+            openai_api_base="https://example.openai.azure.com",
+            openai_api_type="azure",
+            openai_api_version="2023-03-15-preview",
+        )
+
+        self.assertEqual(
+            credentials_for(cfg).as_kwargs(),
+            {
+                "api_key": "key",
+                "api_base": "https://example.openai.azure.com",
+                "api_type": "azure",
+                "api_version": "2023-03-15-preview",
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
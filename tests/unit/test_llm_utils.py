@@ -0,0 +1,263 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import openai
+from openai.util import convert_to_openai_object
+
+from autogpt.config import Config
+from autogpt.embedding_cache import EmbeddingCache
+from autogpt.llm_cache import CompletionCache, MemoryTier
+from autogpt.llm_utils import (
+    acreate_chat_completion,
+    create_chat_completion,
+    create_chat_completion_with_usage,
+    create_embeddings_batch,
+    run_sync,
+)
+from autogpt.usage import track_usage
+
+
+def chat_response(content, usage=None):
+    return convert_to_openai_object(
+        {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": usage
+            or {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+    )
+
+
+def stream_chunks(pieces):
+    return iter(
+        convert_to_openai_object({"choices": [{"delta": {"content": piece}}]})
+        for piece in pieces
+    )
+
+
+class TestLLMUtils(unittest.TestCase):
+    def setUp(self):
+        self.cfg = Config()
+        self.cfg.openai_api_key = "sk-test"
+        self.messages = [{"role": "user", "content": "Hi"}]
+
+    # Tests that the content of the first choice is returned.
+    @patch("openai.ChatCompletion.create")
+    def test_create_chat_completion(self, mock_create):
+        mock_create.return_value = chat_response("Hello")
+
+        reply = create_chat_completion(self.messages, self.cfg, temperature=0)
+
+        self.assertEqual(reply, "Hello")
+        self.assertEqual(mock_create.call_args.kwargs["api_key"], "sk-test")
+
+    # Tests that the usage OpenAI reported is returned and recorded.
+    @patch("openai.ChatCompletion.create")
+    def test_create_chat_completion_with_usage(self, mock_create):
+        mock_create.side_effect = [
+            chat_response("Hello"),
+            stream_chunks(["Hello there"]),
+        ]
+
+        with track_usage() as ledger:
+            completion = create_chat_completion_with_usage(
+                self.messages, self.cfg, model="gpt-3.5-turbo", temperature=0
+            )
+            list(
+                create_chat_completion(
+                    self.messages, self.cfg, temperature=0, stream=True
+                )
+            )
+
+        self.assertEqual(completion.content, "Hello")
+        self.assertEqual(completion.usage["total_tokens"], 15)
+        totals = ledger.as_dict()
+        self.assertEqual(totals["requests"], 2)
+        # the streamed completion is estimated
+        self.assertEqual(totals["estimated_tokens"], totals["total_tokens"] - 15)
+        self.assertGreater(totals["estimated_tokens"], 0)
+
+    # Tests that a streamed completion yields the content deltas.
+    @patch("openai.ChatCompletion.create")
+    def test_create_chat_completion_stream(self, mock_create):
+        mock_create.return_value = stream_chunks(["Hel", "lo", None])
+
+        pieces = list(
+            create_chat_completion(self.messages, self.cfg, temperature=0, stream=True)
+        )
+
+        self.assertEqual(pieces, ["Hel", "lo"])
+        self.assertTrue(mock_create.call_args.kwargs["stream"])
+
+    # Tests that an identical cached request does not call the model again.
+    @patch("openai.ChatCompletion.create")
+    def test_create_chat_completion_cache(self, mock_create):
+        mock_create.return_value = chat_response("Hello")
+
+        with patch("autogpt.llm_utils.completion_cache", CompletionCache([MemoryTier()])):
+            first = create_chat_completion(
+                self.messages, self.cfg, temperature=0, cache=True
+            )
+            second = create_chat_completion(
+                self.messages, self.cfg, temperature=0, cache=True
+            )
+            create_chat_completion(self.messages, self.cfg, temperature=0)
+
+        self.assertEqual((first, second), ("Hello", "Hello"))
+        self.assertEqual(mock_create.call_count, 2)
+
+    # Tests that concurrent identical cached requests share one call, and only
+    # the caller that made it is charged its tokens.
+    @patch("openai.ChatCompletion.create")
+    def test_create_chat_completion_coalesced(self, mock_create):
+        def slow_response(**kwargs):
+            time.sleep(0.2)
+            return chat_response("Hello")
+
+        mock_create.side_effect = slow_response
+        completions = []
+
+        def call():
+            completions.append(
+                create_chat_completion_with_usage(
+                    self.messages, self.cfg, temperature=0, cache=True
+                )
+            )
+
+        with patch("autogpt.llm_utils.completion_cache", CompletionCache([MemoryTier()])):
+            threads = [threading.Thread(target=call) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(mock_create.call_count, 1)
+        self.assertEqual([c.content for c in completions], ["Hello"] * 3)
+        self.assertEqual(sorted(bool(c.usage) for c in completions), [False, False, True])
+
+    # Tests that identical requests made with different API keys are each made
+    # with their own key.
+    @patch("openai.ChatCompletion.create")
+    def test_create_chat_completion_coalesced_per_key(self, mock_create):
+        def slow_response(**kwargs):
+            time.sleep(0.2)
+            return chat_response(kwargs["api_key"])
+
+        mock_create.side_effect = slow_response
+        replies = []
+
+        def call(api_key):
+            cfg = Config()
+            cfg.openai_api_key = api_key
+            replies.append(
+                create_chat_completion(self.messages, cfg, temperature=0, cache=True)
+            )
+
+        with patch("autogpt.llm_utils.completion_cache", CompletionCache([MemoryTier()])):
+            threads = [
+                threading.Thread(target=call, args=(key,))
+                for key in ["sk-one", "sk-two"]
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(mock_create.call_count, 2)
+        self.assertEqual(sorted(replies), ["sk-one", "sk-two"])
+
+    # Tests that embeddings are requested in batches bounded by items and tokens.
+    @patch("autogpt.llm_utils.EMBEDDING_BATCH_TOKENS", 5)
+    @patch("autogpt.llm_utils.EMBEDDING_BATCH_SIZE", 3)
+    @patch(
+        "autogpt.llm_utils.count_strings_tokens",
+        lambda texts, model: [len(text) for text in texts],
+    )
+    @patch("openai.Embedding.create")
+    def test_create_embeddings_batch(self, mock_create):
+        def embed(input, **kwargs):
+            # answered out of order, as the API may
+            data = [
+                {"index": i, "embedding": [float(len(text))]}
+                for i, text in enumerate(input)
+            ]
+            return convert_to_openai_object({"data": data[::-1]})
+
+        mock_create.side_effect = embed
+        texts = ["a", "b", "c", "d", "eeeee", "a"]
+
+        with patch("autogpt.llm_utils.embedding_cache", EmbeddingCache()):
+            embeddings = create_embeddings_batch(texts, self.cfg)
+
+        self.assertEqual(embeddings, [[1.0], [1.0], [1.0], [1.0], [5.0], [1.0]])
+        batches = [call.kwargs["input"] for call in mock_create.call_args_list]
+        self.assertEqual(batches, [["a", "b", "c"], ["d"], ["eeeee"]])
+
+    # Tests that async completions run concurrently on one event loop.
+    @patch("openai.ChatCompletion.acreate", new_callable=AsyncMock)
+    def test_acreate_chat_completion(self, mock_acreate):
+        async def reply(**kwargs):
+            await asyncio.sleep(0.1)
+            return chat_response(kwargs["messages"][0]["content"])
+
+        mock_acreate.side_effect = reply
+
+        async def step():
+            return await asyncio.gather(
+                *[
+                    acreate_chat_completion(
+                        [{"role": "user", "content": str(i)}], self.cfg, temperature=0
+                    )
+                    for i in range(5)
+                ]
+            )
+
+        t0 = time.time()
+        replies = run_sync(step())
+
+        self.assertLess(time.time() - t0, 0.4)
+        self.assertEqual(replies, ["0", "1", "2", "3", "4"])
+        self.assertEqual(mock_acreate.call_args.kwargs["api_key"], "sk-test")
+
+    # Tests that a call past its deadline is cancelled.
+    @patch("openai.ChatCompletion.acreate", new_callable=AsyncMock)
+    def test_acreate_chat_completion_deadline(self, mock_acreate):
+        cancelled = []
+
+        async def stall(**kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        mock_acreate.side_effect = stall
+
+        with self.assertRaises(asyncio.TimeoutError):
+            run_sync(
+                acreate_chat_completion(
+                    self.messages, self.cfg, temperature=0, deadline=0.1
+                )
+            )
+        self.assertEqual(cancelled, [True])
+
+    # Tests that the calls of every run share the session of one loop, also
+    # when made from a thread running an event loop of its own.
+    def test_run_sync_shares_loop(self):
+        async def session():
+            return asyncio.get_running_loop(), openai.aiosession.get()
+
+        async def nested():
+            return run_sync(session())
+
+        first = run_sync(session())
+        second = asyncio.run(nested())
+
+        self.assertIsNotNone(first[1])
+        self.assertEqual(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
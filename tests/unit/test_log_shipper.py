@@ -0,0 +1,158 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from autogpt.log_shipper import CLAIM_SUFFIX, LogShipper
+
+
+def read_segment(data):
+    return [json.loads(line) for line in gzip.decompress(data).decode().splitlines()]
+
+
+class TestLogShipper(unittest.TestCase):
+    def setUp(self):
+        self.spool = tempfile.TemporaryDirectory()
+        self.uploads = {}
+        self.fail = False
+
+        def upload(name, data):
+            if self.fail:
+                raise TimeoutError("slow")
+            self.uploads[name] = data
+
+        self.shipper = LogShipper(
+            upload, max_queue=3, flush_interval=60, spool_dir=self.spool.name
+        )
+
+    def tearDown(self):
+        self.shipper.close(timeout=1)
+        self.spool.cleanup()
+
+    # Tests that entries are shipped as one compressed segment per agent.
+    def test_flush_batches_per_agent(self):
+        self.shipper.submit("agent-1", "first")
+        self.shipper.submit("agent-1", "second")
+        self.shipper.submit("agent-2", "other")
+        self.shipper.flush()
+
+        self.assertEqual(len(self.uploads), 2)
+        segments = {
+            name.split("/")[1]: read_segment(data) for name, data in self.uploads.items()
+        }
+        self.assertEqual([e["text"] for e in segments["agent-1"]], ["first", "second"])
+        self.assertEqual(self.shipper.stats()["shipped_entries"], 3)
+
+    # Tests that entries are dropped rather than blocking when the queue is full.
+    def test_full_queue_drops(self):
+        self.shipper._ensure_started = lambda: None
+        for i in range(4):
+            self.shipper.submit("agent", str(i))
+
+        stats = self.shipper.stats()
+        self.assertEqual(stats["queue_depth"], 3)
+        self.assertEqual(stats["dropped"], 1)
+
+    # Tests that failed uploads are spooled to disk and retried on the next flush.
+    def test_failed_upload_is_spooled_and_retried(self):
+        self.fail = True
+        self.shipper.submit("agent", "entry")
+        self.shipper.flush()
+
+        self.assertEqual(self.uploads, {})
+        self.assertEqual(len(self.shipper._spool_files()), 1)
+
+        self.fail = False
+        self.shipper.flush()
+
+        self.assertEqual(len(self.uploads), 1)
+        (name,) = self.uploads
+        self.assertTrue(name.startswith("godmode-logs/agent/"))
+        self.assertEqual(self.shipper._spool_files(), [])
+
+    # Tests that a flush stops uploading at the first failure.
+    def test_failed_upload_spools_the_rest(self):
+        self.fail = True
+        self.shipper.submit("agent-1", "entry")
+        self.shipper.flush()
+        for agent_id in ["agent-2", "agent-3"]:
+            self.shipper.submit(agent_id, "entry")
+        self.shipper.flush()
+
+        # the spool retry failed, the new segments were not tried
+        self.assertEqual(self.shipper.stats()["failed_uploads"], 2)
+        self.assertEqual(len(self.shipper._spool_files()), 3)
+
+    # Tests that the segments left past the flush budget are spooled.
+    def test_flush_budget(self):
+        self.shipper.flush_budget = 0
+        self.shipper.submit("agent", "entry")
+        self.shipper.flush()
+
+        self.assertEqual(self.uploads, {})
+        self.assertEqual(len(self.shipper._spool_files()), 1)
+        self.assertEqual(self.shipper.stats()["failed_uploads"], 0)
+
+    # Tests that a segment another worker uploaded meanwhile is skipped.
+    def test_retry_skips_segment_taken_by_another_worker(self):
+        self.fail = True
+        self.shipper.submit("agent", "entry")
+        self.shipper.flush()
+        (path,) = self.shipper._spool_files()
+        os.remove(path)
+
+        self.fail = False
+        self.assertTrue(self.shipper._retry_spool(deadline=float("inf")))
+        self.assertEqual(self.uploads, {})
+
+    # Tests that a segment claimed by a worker that died is uploaded by another.
+    def test_dead_claim_is_released(self):
+        self.fail = True
+        self.shipper.submit("agent", "entry")
+        self.shipper.flush()
+        (path,) = self.shipper._spool_files()
+        # no process has this pid
+        os.rename(path, f"{path}.{2 ** 22 + 1}{CLAIM_SUFFIX}")
+
+        self.fail = False
+        self.shipper.flush()
+
+        self.assertEqual(len(self.uploads), 1)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+
+    # Tests that the background thread keeps shipping after a flush failed.
+    def test_thread_survives_failed_flush(self):
+        flush = self.shipper.flush
+        calls = []
+
+        def failing_flush():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OSError("disk full")
+            flush()
+
+        self.shipper.flush = failing_flush
+        self.shipper.flush_interval = 0.05
+        self.shipper.submit("agent", "first")
+        time.sleep(0.3)
+        self.shipper.submit("agent", "second")
+        time.sleep(0.3)
+
+        self.assertTrue(self.shipper._thread.is_alive())
+        self.assertEqual(self.shipper.stats()["shipped_entries"], 2)
+
+    # Tests that the spool is bounded by dropping the oldest segments.
+    def test_spool_is_bounded(self):
+        self.fail = True
+        self.shipper.spool_max_bytes = 1
+        self.shipper.submit("agent", "entry")
+        self.shipper.flush()
+
+        self.assertEqual(self.shipper._spool_files(), [])
+        self.assertEqual(self.shipper.stats()["dropped"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import patch
+
+from openai.util import convert_to_openai_object
+
+from autogpt import metrics
+from autogpt.config import Config
+from autogpt.llm_utils import create_chat_completion
+from autogpt.metrics import call_site, collect_stats, current_call_site, register_stats
+
+
+def sample(name, labels):
+    return metrics.prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(unittest.TestCase):
+    # Tests that the call site applies within a block or a decorated function only.
+    def test_call_site(self):
+        @call_site("fix_json")
+        def fix():
+            return current_call_site()
+
+        with call_site("subgoals"):
+            self.assertEqual(current_call_site(), "subgoals")
+            self.assertEqual(fix(), "fix_json")
+            self.assertEqual(current_call_site(), "subgoals")
+        self.assertEqual(current_call_site(), "other")
+
+    # Tests that numeric stats are exported and a failing source is skipped.
+    def test_collect_stats(self):
+        register_stats("test_ok", lambda: {"hits": 3, "name": "x"})
+        register_stats("test_broken", lambda: 1 / 0)
+        self.addCleanup(metrics._stats_sources.pop, "test_ok")
+        self.addCleanup(metrics._stats_sources.pop, "test_broken")
+
+        values = collect_stats()
+
+        self.assertEqual(values["godmode_test_ok_hits"], 3)
+        self.assertNotIn("godmode_test_ok_name", values)
+
+    # Tests that a chat completion records its latency and tokens by call site.
+    @unittest.skipIf(metrics.prometheus_client is None, "prometheus_client not installed")
+    @patch("openai.ChatCompletion.create")
+    def test_chat_completion_recorded(self, mock_create):
+        mock_create.return_value = convert_to_openai_object(
+            {
+                "choices": [{"message": {"role": "assistant", "content": "Hi"}}],
+                "usage": {"prompt_tokens": 7, "completion_tokens": 2},
+            }
+        )
+        cfg = Config()
+        cfg.openai_api_key = "sk-test"
+        labels = {"kind": "chat", "model": "gpt-test", "call_site": "task_name"}
+        before = sample("llm_prompt_tokens_sum", labels)
+
+        with call_site("task_name"):
+            create_chat_completion(
+                [{"role": "user", "content": "Hi"}], cfg, model="gpt-test"
+            )
+
+        self.assertEqual(sample("llm_prompt_tokens_sum", labels), before + 7)
+        self.assertEqual(
+            sample("llm_requests_total", {**labels, "outcome": "ok"}), 1
+        )
+        self.assertEqual(sample("llm_request_seconds_count", labels), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
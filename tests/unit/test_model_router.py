@@ -0,0 +1,136 @@
+import unittest
+
+from openai.error import InvalidRequestError, RateLimitError, Timeout
+
+from autogpt.config import Config
+from autogpt.model_router import ModelRouter, Route, latency_budget
+
+
+class TestModelRouter(unittest.TestCase):
+    def setUp(self):
+        self.cfg = Config()
+        self.cfg.use_azure = False
+        self.cfg.fast_llm_model = "gpt-3.5-turbo"
+        self.cfg.smart_llm_model = "gpt-4"
+        self.router = ModelRouter(
+            {"task_name": "light", "chat_with_ai": "fast", "other": "smart"},
+            light_model="gpt-3.5-turbo-0301",
+            budgets={"task_name": 10},
+            min_calls=2,
+            timeout=600,
+        )
+
+    def models(self, site, prompt_tokens=100, max_tokens=None):
+        routes = self.router.plan(self.cfg, None, site, prompt_tokens, max_tokens)
+        return [route.model for route in routes]
+
+    # Tests that the call site picks the first model and the others follow.
+    def test_plan_by_call_site(self):
+        self.assertEqual(
+            self.models("task_name"), ["gpt-3.5-turbo-0301", "gpt-3.5-turbo", "gpt-4"]
+        )
+        self.assertEqual(self.models("chat_with_ai"), ["gpt-3.5-turbo", "gpt-4"])
+        self.assertEqual(self.models("improve_code"), ["gpt-4", "gpt-3.5-turbo"])
+        explicit = self.router.plan(self.cfg, "gpt-4", "task_name", 100)
+        self.assertEqual(explicit, [Route("gpt-4")])
+
+    # Tests that models whose context window is too small are skipped.
+    def test_plan_by_prompt_size(self):
+        self.assertEqual(self.models("chat_with_ai", 3000, 2000), ["gpt-4"])
+
+    # Tests that failing models, and slow ones over the budget, go last.
+    def test_plan_by_health(self):
+        for _ in range(2):
+            self.router.observe(Route("gpt-4"), 1, ok=False)
+            self.router.observe(Route("gpt-3.5-turbo-0301"), 20, ok=True)
+
+        self.assertEqual(self.models("improve_code"), ["gpt-3.5-turbo", "gpt-4"])
+        self.assertEqual(
+            self.models("task_name"), ["gpt-3.5-turbo", "gpt-3.5-turbo-0301", "gpt-4"]
+        )
+        with latency_budget(30):
+            self.assertEqual(self.models("task_name")[0], "gpt-3.5-turbo-0301")
+        self.assertEqual(self.router.stats()["gpt_4_error_rate"], 1.0)
+
+    # Tests that a timeout fails over to the next route, within the budget.
+    def test_call_fails_over(self):
+        timeouts = []
+
+        def attempt(route, timeout):
+            timeouts.append(timeout)
+            if route.model == "gpt-4":
+                raise Timeout("timed out")
+            return "reply"
+
+        routes = [Route("gpt-4"), Route("gpt-3.5-turbo")]
+        route, response = self.router.call(routes, attempt, budget=5)
+
+        self.assertEqual((route, response), (Route("gpt-3.5-turbo"), "reply"))
+        self.assertEqual(timeouts, [5, 600])
+        self.assertEqual(self.router.stats()["failovers"], 1)
+        with self.assertRaises(Timeout):
+            self.router.call(routes[:1], attempt)
+
+    # Tests that rate limits leave the health of a model alone, and only fail
+    # over with the server's own key.
+    def test_call_rate_limited(self):
+        def attempt(route, timeout):
+            if route.model == "gpt-4":
+                raise RateLimitError("quota exceeded")
+            return "reply"
+
+        routes = [Route("gpt-4"), Route("gpt-3.5-turbo")]
+        for _ in range(3):
+            with self.assertRaises(RateLimitError):
+                self.router.call(routes, attempt, rate_limit_failover=False)
+        route, _ = self.router.call(routes, attempt)
+
+        self.assertEqual(route, Route("gpt-3.5-turbo"))
+        self.assertEqual(self.models("improve_code"), ["gpt-4", "gpt-3.5-turbo"])
+        self.assertEqual(self.router.stats()["rate_limit_failovers"], 1)
+
+    # Tests that other errors are raised without failing over.
+    def test_call_raises_other_errors(self):
+        def attempt(route, timeout):
+            raise InvalidRequestError("bad request", None)
+
+        with self.assertRaises(InvalidRequestError):
+            self.router.call([Route("gpt-4"), Route("gpt-3.5-turbo")], attempt)
+
+    # Tests that on Azure every model is tried on its deployments only.
+    def test_plan_azure_deployments(self):
+        self.cfg.use_azure = True
+        self.cfg.azure_model_to_deployment_id_map = {
+            "fast_llm_model_deployment_id": "gpt35",
+            "smart_llm_model_deployment_id": "gpt4",
+            "smart_llm_model_fallback_deployment_ids": ["gpt4-eu"],
+        }
+
+        routes = self.router.plan(self.cfg, None, "improve_code", 100)
+
+        self.assertEqual(
+            routes,
+            [
+                Route("gpt-4", "gpt4"),
+                Route("gpt-4", "gpt4-eu"),
+                Route("gpt-3.5-turbo", "gpt35"),
+            ],
+        )
+
+    # Tests that on Azure models without deployments fail with a config error.
+    def test_plan_azure_without_deployments(self):
+        self.cfg.use_azure = True
+        self.cfg.azure_model_to_deployment_id_map = {
+            "fast_llm_model_deployment_id": "",
+            "smart_llm_model_deployment_id": "",
+        }
+
+        with self.assertRaisesRegex(ValueError, "No Azure deployment"):
+            self.router.plan(self.cfg, None, "improve_code", 100)
+        self.assertEqual(
+            self.router.plan(self.cfg, "gpt-4", "improve_code", 100), [Route("gpt-4")]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from unittest.mock import patch
+
+from openai.error import RateLimitError
+
+from autogpt.rate_limiter import RateLimiter, TokenBucket, parse_limits
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def limiter(self, **kwargs):
+        return RateLimiter(
+            parse_limits("gpt-4=2/1000,gpt-4-32k=60/6000"),
+            clock=self.clock,
+            sleep=self.clock.sleep,
+            **kwargs,
+        )
+
+    # Tests that the longest matching model prefix gives the limits.
+    def test_limits_for(self):
+        limiter = self.limiter()
+        self.assertEqual(limiter.limits_for("gpt-4-0314"), (2, 1000))
+        self.assertEqual(limiter.limits_for("gpt-4-32k-0314"), (60, 6000))
+        self.assertIsNone(limiter.limits_for("gpt-3.5-turbo"))
+
+    # Tests that every worker gets its share of the limits.
+    def test_parse_limits_per_worker(self):
+        self.assertEqual(
+            parse_limits("gpt-4=200/40000,gpt-4-32k=3/6000", workers=4),
+            {"gpt-4": (50, 10000), "gpt-4-32k": (1, 1500)},
+        )
+
+    # Tests that a bucket below zero reports the time to refill the deficit.
+    def test_token_bucket(self):
+        bucket = TokenBucket(60, now=0)
+        self.assertEqual(bucket.reserve(60, now=0), 0)
+        self.assertEqual(bucket.reserve(2, now=0), 2)
+        self.assertEqual(bucket.reserve(1, now=2), 1)
+
+    # Tests that a burst over the request quota waits instead of failing.
+    def test_burst_waits(self):
+        limiter = self.limiter()
+        for _ in range(3):
+            limiter.call("sk-a", "gpt-4", 10, lambda: "ok")
+
+        self.assertEqual(self.clock.sleeps, [30.0])
+        self.assertEqual(limiter.stats()["waits"], 1)
+        # another key has its own quota
+        limiter.call("sk-b", "gpt-4", 10, lambda: "ok")
+        self.assertEqual(len(self.clock.sleeps), 1)
+
+    # Tests that a call that would wait longer than allowed is rejected.
+    def test_rejected(self):
+        limiter = self.limiter(max_wait=5)
+        limiter.call("sk-a", "gpt-4", 1000, lambda: "ok")
+
+        with self.assertRaises(RateLimitError):
+            limiter.call("sk-a", "gpt-4", 1000, lambda: "ok")
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+    # Tests that a 429 is retried after its Retry-After.
+    @patch("autogpt.rate_limiter.random.uniform", lambda low, high: low)
+    def test_retry_after(self):
+        limiter = self.limiter()
+        responses = [RateLimitError("slow down", headers={"retry-after": "3"}), "ok"]
+
+        def call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual(limiter.call("sk-a", "gpt-3.5-turbo", 10, call), "ok")
+        self.assertEqual(self.clock.sleeps, [3.0])
+        self.assertEqual(limiter.stats()["retries"], 1)
+
+    # Tests that the 429 is raised once the retries are used up.
+    @patch("autogpt.rate_limiter.random.uniform", lambda low, high: low)
+    def test_retries_exhausted(self):
+        limiter = self.limiter(retries=2, backoff_base=1)
+
+        def call():
+            raise RateLimitError("slow down")
+
+        with self.assertRaises(RateLimitError):
+            limiter.call("sk-a", "gpt-3.5-turbo", 10, call)
+        # jittered exponential backoff, 1s then 2s, halved by the jitter
+        self.assertEqual(self.clock.sleeps, [0.5, 1.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import contextlib
+import datetime
+import unittest
+
+from google.cloud import datastore
+
+from autogpt.session_index import (
+    SessionIndex,
+    add_session,
+    backfill_index,
+    list_sessions,
+    remove_session,
+)
+
+
+class FakeDatastore:
+    """An in-memory stand-in for the parts of datastore.Client used by the index."""
+
+    def __init__(self):
+        self.entities = {}
+        self.reads = 0
+
+    def key(self, *path):
+        return datastore.Key(*path, project="test")
+
+    def get(self, key):
+        self.reads += 1
+        return self.entities.get(key)
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        for entity in entities:
+            self.entities[entity.key] = entity
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+def session(agent_id, day=1):
+    return {
+        "agent_id": agent_id,
+        "ai_name": f"name-{agent_id}",
+        "ai_role": "role",
+        "created": datetime.datetime(2023, 4, day),
+    }
+
+
+class TestSessionIndex(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeDatastore()
+
+    # Tests that sessions are listed newest first, one page per cursor.
+    def test_list_pages_newest_first(self):
+        for i in range(5):
+            add_session(self.client, "user", session(f"a{i}"), page_size=2)
+
+        first, cursor = list_sessions(self.client, "user")
+        self.assertEqual([s["agent_id"] for s in first], ["a4"])
+        second, cursor = list_sessions(self.client, "user", cursor)
+        self.assertEqual([s["agent_id"] for s in second], ["a3", "a2"])
+        third, cursor = list_sessions(self.client, "user", cursor)
+        self.assertEqual([s["agent_id"] for s in third], ["a1", "a0"])
+        self.assertIsNone(cursor)
+
+    # Tests that adding a session twice does not duplicate it.
+    def test_add_is_idempotent(self):
+        add_session(self.client, "user", session("a"))
+        add_session(self.client, "user", {**session("a"), "ai_name": "renamed"})
+
+        sessions, _ = list_sessions(self.client, "user")
+        self.assertEqual([s["ai_name"] for s in sessions], ["renamed"])
+
+    # Tests that removed sessions are not listed and empty pages are skipped.
+    def test_remove_skips_empty_pages(self):
+        add_session(self.client, "user", session("a0"), page_size=1)
+        page = add_session(self.client, "user", session("a1"), page_size=1)
+        remove_session(self.client, "user", "a1", page)
+
+        sessions, cursor = list_sessions(self.client, "user")
+        self.assertEqual([s["agent_id"] for s in sessions], ["a0"])
+        self.assertIsNone(cursor)
+
+    # Tests that a user without an index is backfilled once from the legacy query.
+    def test_backfill_from_legacy_sessions(self):
+        legacy = [session("old", day=2), session("older", day=1)]
+        index = SessionIndex(lambda: self.client, lambda user_id: legacy)
+
+        sessions, _ = index.list_page("user")
+
+        self.assertEqual([s["agent_id"] for s in sessions], ["old", "older"])
+        self.assertEqual(index.stats()["backfills"], 1)
+        self.assertFalse(backfill_index(self.client, "user", []))
+
+    # Tests that a known session only reads the head of the index again, and
+    # that a backfilled session is found instead of being added twice.
+    def test_ensure(self):
+        index = SessionIndex(lambda: self.client, lambda user_id: [session("old")])
+        page = index.ensure("user", session("old"), lambda: {"ai_name": "old"})
+        reads = self.client.reads
+
+        self.assertEqual(index.ensure("user", session("old"), lambda: None), page)
+        self.assertEqual(self.client.reads, reads + 1)
+        sessions, _ = list_sessions(self.client, "user")
+        self.assertEqual([s["agent_id"] for s in sessions], ["old"])
+
+    # Tests that a session removed by another worker is indexed again on its
+    # next step, although the worker remembers it as indexed.
+    def test_ensure_after_remove_elsewhere(self):
+        index = SessionIndex(lambda: self.client, lambda user_id: [])
+        other = SessionIndex(lambda: self.client, lambda user_id: [])
+        page = index.ensure("user", session("a"), lambda: None)
+        stored = {"agent_id": "a", "index_page": page}
+
+        other.remove("user", "a", page)
+        stored["deleted"] = True
+        index.ensure("user", session("a"), lambda: stored)
+
+        sessions, _ = list_sessions(self.client, "user")
+        self.assertEqual([s["agent_id"] for s in sessions], ["a"])
+
+    # Tests that listed pages are cached until the index of the user changes.
+    def test_list_is_cached_until_changed(self):
+        index = SessionIndex(lambda: self.client, lambda user_id: [])
+        index.ensure("user", session("a"), lambda: None)
+        index.list_page("user")
+        reads = self.client.reads
+
+        index.list_page("user")
+        self.assertEqual(self.client.reads, reads)
+
+        index.remove("user", "a", 1)
+        sessions, _ = index.list_page("user")
+        self.assertEqual(sessions, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
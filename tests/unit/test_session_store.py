@@ -0,0 +1,148 @@
+import unittest
+
+from autogpt.chat import create_chat_message
+from autogpt.session_store import (
+    SESSION_MAX_MESSAGES,
+    HistoryVersionMismatch,
+    Session,
+    SessionStore,
+)
+
+
+class FakeRedis:
+    """The Redis commands the store uses, in memory."""
+
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+    def eval(self, script, numkeys, key, expected, version, messages, ttl):
+        current = self.hget(key, "version")
+        if current is not None and int(current) != int(expected):
+            return 0
+        self.data[key] = {"version": str(version), "messages": messages}
+        return 1
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestSessionStore(unittest.TestCase):
+    # Tests that a matching version appends the client's new messages.
+    def test_resolve_appends_delta(self):
+        store = SessionStore()
+        store.put("agent", Session(3, [create_chat_message("system", "a")]))
+
+        session = store.resolve("agent", 3, delta=[create_chat_message("user", "b")])
+
+        self.assertEqual(session.version, 3)
+        self.assertEqual([m["content"] for m in session.messages], ["a", "b"])
+
+    # Tests that a stale version asks the client to resync with the stored history.
+    def test_resolve_version_mismatch(self):
+        store = SessionStore()
+        store.put("agent", Session(3, [create_chat_message("system", "a")]))
+
+        with self.assertRaises(HistoryVersionMismatch) as ctx:
+            store.resolve("agent", 2)
+        self.assertEqual(ctx.exception.session.version, 3)
+
+        with self.assertRaises(HistoryVersionMismatch) as ctx:
+            store.resolve("unknown", 0)
+        self.assertIsNone(ctx.exception.session)
+
+    # Tests that a full history replaces the stored one and keeps its version.
+    def test_resolve_full_history_resyncs(self):
+        store = SessionStore()
+        store.put("agent", Session(5, [create_chat_message("system", "old")]))
+
+        session = store.resolve("agent", None, full_history=[])
+
+        self.assertEqual(session, Session(5, []))
+
+    # Tests that sessions are shared through redis and then loaded from the loader.
+    def test_get_falls_through_tiers(self):
+        redis_client = FakeRedis()
+        loaded = []
+
+        def loader(agent_id):
+            loaded.append(agent_id)
+            return Session(1, []) if agent_id == "stored" else None
+
+        SessionStore(redis_client=redis_client).put("shared", Session(2, []), 1)
+        store = SessionStore(redis_client=redis_client, loader=loader)
+
+        self.assertEqual(store.get("shared"), Session(2, []))
+        self.assertEqual(store.get("stored"), Session(1, []))
+        self.assertEqual(store.get("stored"), Session(1, []))
+        self.assertIsNone(store.get("missing"))
+        # redis has the current version, so a session missing there is loaded again
+        self.assertEqual(loaded, ["stored", "stored", "missing"])
+
+        # without redis, the session in process is used while it has the version
+        store = SessionStore(loader=loader)
+        self.assertEqual(store.get("stored", 1), Session(1, []))
+        self.assertEqual(store.get("stored", 1), Session(1, []))
+        self.assertEqual(loaded, ["stored", "stored", "missing", "stored"])
+
+    # Tests that a worker reads a session advanced by another worker from redis.
+    def test_get_checks_version_in_redis(self):
+        redis_client = FakeRedis()
+        first = SessionStore(redis_client=redis_client)
+        second = SessionStore(redis_client=redis_client)
+        first.put("agent", Session(1, [create_chat_message("user", "a")]))
+        self.assertEqual(second.get("agent").version, 1)
+
+        first.put("agent", Session(2, [create_chat_message("user", "b")]))
+
+        session = second.resolve("agent", 2)
+        self.assertEqual([m["content"] for m in session.messages], ["b"])
+
+    # Tests that of two steps from the same version only the first is stored.
+    def test_put_compares_versions(self):
+        for redis_client in (FakeRedis(), None):
+            store = SessionStore(redis_client=redis_client)
+            store.put("agent", Session(1, []))
+            store.put("agent", Session(2, [create_chat_message("user", "first")]), 1)
+
+            with self.assertRaises(HistoryVersionMismatch) as ctx:
+                store.put("agent", Session(2, [create_chat_message("user", "lost")]), 1)
+            self.assertEqual(ctx.exception.session.messages[0]["content"], "first")
+
+    # Tests that a failed Redis write drops the copy in Redis, so the next read
+    # goes to the loader.
+    def test_failed_redis_write_invalidates(self):
+        redis_client = FakeRedis()
+        stored = {"agent": Session(2, [create_chat_message("user", "stored")])}
+        store = SessionStore(redis_client=redis_client, loader=stored.get)
+        store.put("agent", Session(1, []))
+
+        def fail(*args):
+            raise ConnectionError("redis down")
+
+        redis_client.eval = fail
+        store.put("agent", stored["agent"], 1)
+
+        self.assertEqual(redis_client.data, {})
+        session = store.get("agent", 2)
+        self.assertEqual([m["content"] for m in session.messages], ["stored"])
+
+    # Tests that only the most recent messages are kept and old sessions evicted.
+    def test_put_bounds_messages_and_sessions(self):
+        store = SessionStore(capacity=1)
+        messages = [create_chat_message("user", str(i)) for i in range(150)]
+
+        store.put("first", Session(1, messages))
+        self.assertEqual(len(store.get("first").messages), SESSION_MAX_MESSAGES)
+
+        store.put("second", Session(1, []))
+        self.assertIsNone(store.get("first"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from autogpt.singleflight import SingleFlight
+
+
+class FakeRedis:
+    """The Redis commands the locks use, in memory."""
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def eval(self, script, numkeys, key, token):
+        if self.values.get(key) == token:
+            del self.values[key]
+            return 1
+        return 0
+
+
+class TestSingleFlight(unittest.TestCase):
+    # Tests that concurrent identical calls share one call and its result.
+    def test_concurrent_calls_coalesced(self):
+        flights = SingleFlight()
+        calls = []
+        results = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return "subgoals"
+
+        threads = [
+            threading.Thread(target=lambda: results.append(flights.do("k", fn)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["subgoals"] * 5)
+        self.assertEqual(flights.stats()["saved"], 4)
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    # Tests that the error of a call is raised to the callers that waited for it,
+    # and that the next call is made again.
+    def test_error_shared(self):
+        flights = SingleFlight()
+        errors = []
+
+        def fail():
+            time.sleep(0.1)
+            raise ValueError("boom")
+
+        def call():
+            try:
+                flights.do("k", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flights.do("k", lambda: "ok"), "ok")
+
+    # Tests that a worker waits for the lock of another worker and then reads
+    # the result it stored.
+    def test_other_worker_holds_lock(self):
+        redis = FakeRedis()
+        stored = {}
+        flights = SingleFlight(redis, wait=2, poll=0.01)
+        redis.values["singleflight:k"] = "other-worker"
+
+        def other_worker():
+            time.sleep(0.1)
+            stored["k"] = "done elsewhere"
+            del redis.values["singleflight:k"]
+
+        threading.Thread(target=other_worker).start()
+        result = flights.do("k", lambda: "called", lambda: stored.get("k"))
+
+        self.assertEqual(result, "done elsewhere")
+        self.assertEqual(flights.stats()["remote_coalesced"], 1)
+        self.assertEqual(flights.stats()["calls"], 0)
+
+        # the lock is taken and released by the worker that makes the call
+        self.assertEqual(flights.do("j", lambda: "called", lambda: None), "called")
+        self.assertEqual(redis.values, {})
+
+    # Tests that async callers share one call too.
+    def test_async_coalesced(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return [0.1, 0.2]
+
+        async def main():
+            return await asyncio.gather(*[flights.ado("k", fn) for _ in range(3)])
+
+        results = asyncio.run(main())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[0.1, 0.2]] * 3)
+
+    # Tests that an async caller waiting for a call is cancelled with its task.
+    def test_async_wait_cancelled(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=lambda: flights.do("k", release.wait))
+        leader.start()
+        time.sleep(0.05)
+
+        async def main():
+            return await asyncio.wait_for(flights.ado("k", None), 0.1)
+
+        t0 = time.time()
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(main())
+        self.assertLess(time.time() - t0, 1)
+        release.set()
+        leader.join()
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import asyncio
+import importlib.util
+import time
+import unittest
+from unittest.mock import patch
+
+from autogpt.step_pipeline import (
+    PhaseTimer,
+    StepSlots,
+    phase_timeout,
+    run_with_deadline,
+    settle,
+)
+
+
+class TestStepPipeline(unittest.TestCase):
+    # Tests that independent phases overlap instead of running back to back.
+    def test_spawned_phases_run_concurrently(self):
+        async def step():
+            timer = PhaseTimer()
+            first = timer.spawn("first", time.sleep, 0.2)
+            second = timer.spawn("second", time.sleep, 0.2)
+            await settle(first, second)
+            return timer.as_dict()
+
+        timings = asyncio.run(step())
+
+        self.assertEqual(set(timings["phases"]), {"first", "second"})
+        self.assertLess(timings["total"], 0.35)
+
+    # Tests that settle waits for every phase before re-raising a failure.
+    def test_settle_waits_for_all_phases_before_raising(self):
+        finished = []
+
+        def fail():
+            raise ValueError("boom")
+
+        def slow():
+            time.sleep(0.1)
+            finished.append(True)
+
+        async def step():
+            timer = PhaseTimer()
+            await settle(timer.spawn("fail", fail), timer.spawn("slow", slow))
+
+        with self.assertRaises(ValueError):
+            asyncio.run(step())
+        self.assertEqual(finished, [True])
+
+    # Tests that settle can return the failures instead of replacing the error
+    # being raised.
+    def test_settle_without_raising(self):
+        def fail():
+            raise ValueError("sibling")
+
+        async def step():
+            timer = PhaseTimer()
+            try:
+                await timer.run("primary", lambda: 1 / 0)
+            except ZeroDivisionError:
+                errors = await settle(timer.spawn("fail", fail), raise_error=False)
+                self.assertEqual([str(e) for e in errors], ["sibling"])
+                raise
+
+        with self.assertRaises(ZeroDivisionError):
+            asyncio.run(step())
+
+    # Tests that the blocking calls of a step get timeouts within its deadline.
+    def test_phase_timeout_cut_to_deadline(self):
+        async def step():
+            return await PhaseTimer().run("timeout", phase_timeout, 600)
+
+        self.assertLessEqual(run_with_deadline(step(), deadline=20), 20)
+        self.assertEqual(phase_timeout(600), 600)
+
+    # Tests that the return value of the phase is passed through.
+    def test_run_returns_value(self):
+        async def step():
+            timer = PhaseTimer()
+            return await timer.run("add", lambda a, b: a + b, 1, 2), timer
+
+        value, timer = asyncio.run(step())
+        self.assertEqual(value, 3)
+        self.assertIn("add", timer.phases)
+
+    # Tests that a step running past its deadline is cancelled.
+    def test_run_with_deadline_cancels(self):
+        async def step():
+            await asyncio.sleep(1)
+
+        started = time.perf_counter()
+        with self.assertRaises(asyncio.TimeoutError):
+            run_with_deadline(step(), deadline=0.05)
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    # Tests that requests beyond the cap are turned away once the wait is over.
+    def test_step_slots_cap(self):
+        slots = StepSlots(limit=1, wait=0.01)
+
+        self.assertTrue(slots.acquire())
+        self.assertFalse(slots.acquire())
+        slots.release()
+        self.assertTrue(slots.acquire())
+        self.assertEqual(slots.stats(), {"limit": 1, "active": 1, "rejected": 1})
+
+
+@unittest.skipUnless(importlib.util.find_spec("gevent"), "gevent is not installed")
+@patch("autogpt.step_pipeline.gevent_patched", return_value=True)
+class TestGreenStepPipeline(unittest.TestCase):
+    # Tests that phases overlap on greenlets and the step runs without asyncio.
+    def test_spawned_phases_run_concurrently(self, _):
+        import gevent
+
+        async def step():
+            timer = PhaseTimer()
+            first = timer.spawn("first", gevent.sleep, 0.2)
+            second = timer.spawn("second", gevent.sleep, 0.2)
+            await settle(first, second)
+            return await timer.run("add", lambda a, b: a + b, 1, 2), timer.as_dict()
+
+        value, timings = run_with_deadline(step())
+
+        self.assertEqual(value, 3)
+        self.assertEqual(set(timings["phases"]), {"first", "second", "add"})
+        self.assertLess(timings["total"], 0.35)
+
+    # Tests that a green step running past its deadline is cancelled.
+    def test_run_with_deadline_cancels(self, _):
+        import gevent
+
+        async def step():
+            await PhaseTimer().run("sleep", gevent.sleep, 1)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            run_with_deadline(step(), deadline=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
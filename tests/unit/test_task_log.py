@@ -0,0 +1,89 @@
+import contextlib
+import unittest
+
+from google.cloud import datastore
+
+from autogpt.task_log import append_task, migrate_embedded_tasks, set_task_name, task_key
+
+
+class FakeDatastore:
+    """An in-memory stand-in for the parts of datastore.Client used by the log."""
+
+    def __init__(self):
+        self.entities = {}
+        self.commits = 0
+
+    def key(self, *path):
+        return datastore.Key(*path, project="test")
+
+    def get(self, key):
+        return self.entities.get(key)
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        self.commits += 1
+        for entity in entities:
+            self.entities[entity.key] = entity
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+class TestTaskLog(unittest.TestCase):
+    # Tests that each step adds one entity and sets the result of the previous one.
+    def test_append_task_updates_previous_result(self):
+        client = FakeDatastore()
+        append_task(client, "agent", 0, {"command_name": "google", "result": None})
+        append_task(
+            client,
+            "agent",
+            1,
+            {"command_name": "browse_website", "result": None},
+            previous_updates={"result": "found"},
+        )
+
+        first = client.get(task_key(client, "agent", 0))
+        second = client.get(task_key(client, "agent", 1))
+        self.assertEqual(first["result"], "found")
+        self.assertEqual(second["command_name"], "browse_website")
+        self.assertEqual(len(client.entities), 2)
+
+    # Tests that a placeholder name of the previous task is filled in.
+    def test_append_task_fills_pending_name(self):
+        client = FakeDatastore()
+        append_task(client, "agent", 0, {"task_name": "google: x", "task_name_pending": True})
+        append_task(
+            client,
+            "agent",
+            1,
+            {},
+            previous_updates={"result": "ok"},
+            fill_pending_name=lambda task: "Search for x.",
+        )
+
+        first = client.get(task_key(client, "agent", 0))
+        self.assertEqual(first["task_name"], "Search for x.")
+        self.assertFalse(first["task_name_pending"])
+
+    # Tests that only placeholder names are replaced.
+    def test_set_task_name(self):
+        client = FakeDatastore()
+        append_task(client, "agent", 0, {"task_name": "Named.", "task_name_pending": False})
+        set_task_name(client, "agent", 0, "Other.")
+        self.assertEqual(client.get(task_key(client, "agent", 0))["task_name"], "Named.")
+
+    # Tests that tasks embedded on an old agent entity are moved into the log.
+    def test_migrate_embedded_tasks(self):
+        client = FakeDatastore()
+        tasks = [{"command_name": str(i)} for i in range(1200)]
+
+        self.assertEqual(migrate_embedded_tasks(client, "agent", tasks), 1200)
+        self.assertEqual(client.commits, 3)
+        self.assertEqual(client.get(task_key(client, "agent", 1199))["command_name"], "1199")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import threading
+import unittest
+
+from autogpt.task_naming import TaskNamer, normalize_task, placeholder_task_name
+
+
+class TestTaskNaming(unittest.TestCase):
+    # Tests that case, whitespace and key order do not change the cache key.
+    def test_normalize_task_ignores_case_whitespace_and_order(self):
+        self.assertEqual(
+            normalize_task("google", {"input": "Best  Phones", "page": 1}),
+            normalize_task("Google", '{"page": 1, "input": "best phones"}'),
+        )
+        self.assertNotEqual(
+            normalize_task("google", {"input": "best phones"}),
+            normalize_task("google", {"input": "best laptops"}),
+        )
+
+    # Tests that long placeholder names are truncated.
+    def test_placeholder_task_name(self):
+        self.assertEqual(
+            placeholder_task_name("google", {"input": "phones"}), "google: phones"
+        )
+        self.assertEqual(len(placeholder_task_name("google", {"q": "x" * 200})), 80)
+
+    # Tests that a task is named once and later lookups are served from the cache.
+    def test_submit_names_in_background_and_caches(self):
+        calls = []
+        named = threading.Event()
+        names = []
+
+        def name_fn(cfg, command_name, arguments):
+            calls.append(command_name)
+            return "Search for phones."
+
+        def on_named(name):
+            names.append(name)
+            named.set()
+
+        namer = TaskNamer(name_fn, max_workers=1)
+        self.assertIsNone(namer.lookup("google", {"input": "phones"}))
+
+        namer.submit(None, "google", {"input": "phones"}, on_named=on_named)
+        self.assertTrue(named.wait(5))
+
+        self.assertEqual(names, ["Search for phones."])
+        self.assertEqual(namer.lookup("GOOGLE", {"input": " phones "}), "Search for phones.")
+        self.assertEqual(calls, ["google"])
+
+    # Tests that a failed naming is not cached.
+    def test_failed_naming_is_not_cached(self):
+        done = threading.Event()
+
+        def name_fn(cfg, command_name, arguments):
+            done.set()
+            return None
+
+        namer = TaskNamer(name_fn, max_workers=1)
+        namer.submit(None, "google", {"input": "phones"})
+        self.assertTrue(done.wait(5))
+        namer._executor.shutdown(wait=True)
+
+        self.assertIsNone(namer.lookup("google", {"input": "phones"}))
+        self.assertEqual(namer.stats()["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
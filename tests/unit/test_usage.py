@@ -0,0 +1,84 @@
+import threading
+import unittest
+
+from autogpt.usage import (
+    Calibration,
+    UsageQuota,
+    add_usage,
+    cost,
+    record_usage,
+    track_usage,
+)
+
+
+class TestUsage(unittest.TestCase):
+    # Tests that usage is recorded into the ledger of the block and its parents,
+    # from other threads too.
+    def test_track_usage(self):
+        reported = {"prompt_tokens": 1000, "completion_tokens": 100}
+        with track_usage() as step:
+            with track_usage() as inner:
+                thread = threading.Thread(
+                    target=record_usage, args=("gpt-4", reported, 900)
+                )
+                thread.start()
+                thread.join()
+            record_usage("gpt-4", reported, 900)
+
+        self.assertEqual(inner.as_dict()["total_tokens"], 0)
+        totals = step.as_dict()
+        self.assertEqual(totals["requests"], 1)
+        self.assertEqual(totals["total_tokens"], 1100)
+        self.assertAlmostEqual(totals["cost"], 0.036)
+
+    # Tests that the price of a model is that of its longest matching prefix.
+    def test_cost(self):
+        self.assertAlmostEqual(cost("gpt-4-32k-0314", 1000, 1000), 0.18)
+        self.assertAlmostEqual(cost("gpt-4-0314", 1000, 1000), 0.09)
+        self.assertEqual(cost("unknown", 1000, 1000), 0)
+        self.assertEqual(
+            add_usage({"total_tokens": 5}, {"total_tokens": 7})["total_tokens"], 12
+        )
+
+    # Tests that the reported tokens correct the local estimates.
+    def test_calibration(self):
+        calibration = Calibration(weight=0.5)
+        self.assertEqual(calibration.estimate("chars", "gpt-4", 100), 100)
+
+        calibration.observe("chars", "gpt-4", 100, 120)
+        calibration.observe("chars", "gpt-4", 100, 140)
+
+        self.assertEqual(calibration.estimate("chars", "gpt-4", 100), 130)
+        self.assertEqual(calibration.stats()["chars_gpt_4_samples"], 2)
+
+
+class TestUsageQuota(unittest.TestCase):
+    def setUp(self):
+        self.now = 86400 * 19000
+        self.quota = UsageQuota(daily_tokens=1000, clock=lambda: self.now)
+
+    # Tests that a user is over quota once they spent their tokens, until the
+    # next day.
+    def test_exceeded(self):
+        self.quota.add("alice", 600)
+        self.assertFalse(self.quota.exceeded("alice"))
+        self.quota.add("alice", 400)
+
+        self.assertTrue(self.quota.exceeded("alice"))
+        self.assertFalse(self.quota.exceeded("bob"))
+        self.assertEqual(self.quota.status("alice")["remaining"], 0)
+
+        self.now += 86400
+        self.assertFalse(self.quota.exceeded("alice"))
+
+    # Tests that there is no quota without a daily limit.
+    def test_no_quota(self):
+        quota = UsageQuota(daily_tokens=0)
+        quota.add("alice", 10**9)
+
+        self.assertFalse(quota.exceeded("alice"))
+        self.assertEqual(quota.status("alice")["remaining"], None)
+
+
+if __name__ == "__main__":
+    unittest.main()